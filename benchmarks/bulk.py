@@ -0,0 +1,125 @@
+"""Onboarding a batch of users with POST /users/bulk vs POST /users.
+
+Starts stub auth and payments services answering after --auth-latency
+and --payments-latency seconds, then through the ASGI app creates
+--baseline users one request at a time, like partners do today, and
+batches of each --sizes in a single bulk request. Half the users are
+trainers with coordinates. The one by one time for a whole batch is
+extrapolated from the baseline.
+
+Usage: python -m benchmarks.bulk [--sizes 1000 10000] [--baseline 200]
+           [--auth-latency 0.02] [--payments-latency 0.02]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.stubs import serve_stub
+
+os.environ.setdefault("TESTING", "TRUE")
+
+
+def member(idx: int) -> dict:
+    """Build the details of a new gym member."""
+    trainer = idx % 2 == 0
+    return {
+        "email": f"member_{idx}@gym.com", "password": "secret",
+        "username": f"member_{idx}", "name": "name", "surname": "surname",
+        "height": 1.8, "weight": 80, "birth_date": "1990-01-01",
+        "location": "", "registration_date": "2023-01-01",
+        "is_athlete": not trainer,
+        "coordinates": [-58.4 + idx / 1e5, -34.6] if trainer else None,
+    }
+
+
+async def one_by_one(client: httpx.AsyncClient, first: int,
+                     count: int) -> float:
+    """Return seconds taken to create users one request at a time."""
+    start = time.perf_counter()
+    for idx in range(first, first + count):
+        response = await client.post("/users", json=member(idx))
+        assert response.status_code == 200, response.text
+    return time.perf_counter() - start
+
+
+async def in_bulk(client: httpx.AsyncClient, first: int,
+                  count: int) -> float:
+    """Return seconds taken to create users in a single bulk request."""
+    start = time.perf_counter()
+    response = await client.post(
+        "/users/bulk", headers={"Authorization": "Bearer admin"},
+        json=[member(idx) for idx in range(first, first + count)],
+    )
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.text
+    assert response.json()["created"] == count, response.json()
+    return elapsed
+
+
+# pylint: disable=too-many-locals
+def main():
+    """Run both modes and print a small report."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000])
+    parser.add_argument("--baseline", type=int, default=200)
+    parser.add_argument("--auth-latency", type=float, default=0.02)
+    parser.add_argument("--payments-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    os.environ["USERS_AUTH_HOST"] = serve_stub(args.auth_latency)
+    os.environ["USERS_PAYMENTS_HOST"] = serve_stub(args.payments_latency)
+    os.environ["USERS_MONGO_ENABLED"] = "false"
+    os.environ["USERS_WALLET_POOL_SIZE"] = "0"
+
+    # pylint: disable=import-outside-toplevel
+    from users.main import CONFIGURATION, app, get_db
+    from users.models import Base, Users
+
+    engine = create_engine("sqlite:///./benchmarks/bench.db",
+                           connect_args={"check_same_thread": False})
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        with factory() as session:
+            yield session
+
+    async def measure():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, timeout=None,
+                                     base_url="http://users") as client:
+            baseline = await one_by_one(client, 0, args.baseline)
+            first = args.baseline
+            timings = []
+            for size in args.sizes:
+                timings.append(await in_bulk(client, first, size))
+                first += size
+        return baseline, timings
+
+    app.dependency_overrides[get_db] = override_get_db
+    baseline, timings = asyncio.run(measure())
+    per_user = baseline / args.baseline
+    print(f"auth {args.auth_latency * 1000:.0f}ms, payments "
+          f"{args.payments_latency * 1000:.0f}ms, bulk concurrency "
+          f"{CONFIGURATION.bulk.concurrency}")
+    print(f"one by one: {per_user * 1000:.1f}ms per user "
+          f"({args.baseline} users)")
+    for size, elapsed in zip(args.sizes, timings):
+        print(f"{size:>6} users: bulk {elapsed:.2f}s "
+              f"({size / elapsed:.0f} users/s), one by one "
+              f"~{per_user * size:.0f}s")
+    with factory() as session:
+        print("users stored:",
+              session.execute(select(func.count()).select_from(Users))
+              .scalar())
+    os.remove("./benchmarks/bench.db")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Throughput of GET /users for increasing numbers of concurrent clients.
+
+Start the service once per database mode and point this script at it:
+
+    USERS_DB_DRIVER=postgresql uvicorn users.main:app --port 8000
+    python -m benchmarks.concurrency --url http://localhost:8000/users
+
+    USERS_DB_DRIVER=postgresql+asyncpg uvicorn users.main:app --port 8000
+    python -m benchmarks.concurrency --url http://localhost:8000/users
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, url: str, deadline: float,
+                 samples: list, errors: list):
+    """Send requests back to back until the deadline."""
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.get(url)
+            response.raise_for_status()
+        except httpx.HTTPError as error:
+            errors.append(error)
+            continue
+        samples.append(time.perf_counter() - start)
+
+
+async def measure(url: str, concurrency: int, duration: float):
+    """Run `concurrency` workers for `duration` seconds."""
+    samples: list = []
+    errors: list = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            worker(client, url, deadline, samples, errors)
+            for _ in range(concurrency)
+        ))
+    cuts = statistics.quantiles(samples, n=100) if len(samples) > 1 \
+        else [0.0] * 99
+    print(
+        f"clients={concurrency:>4} rps={len(samples) / duration:8.1f} "
+        f"p50={cuts[49] * 1000:7.1f}ms p99={cuts[98] * 1000:7.1f}ms "
+        f"errors={len(errors)}"
+    )
+
+
+def main():
+    """Measure every requested concurrency level."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/users")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[50, 200, 500])
+    args = parser.parse_args()
+    for concurrency in args.concurrency:
+        asyncio.run(measure(args.url, concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
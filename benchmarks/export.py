@@ -0,0 +1,98 @@
+"""Transactions export throughput and memory, streaming vs paging.
+
+Seeds --transactions transfers over a year, then exports them all with
+export_transactions, and once more tracking peak Python memory with
+tracemalloc, which slows it down. For comparison, reads --pages pages of
+10 the way admins did, each with its count, and extrapolates to the
+whole table.
+
+Usage: python -m benchmarks.export [--transactions 1000000]
+           [--db-url postgresql://.../bench]
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.transactions import BATCH, random_transaction
+from users.crud import get_all_transactions
+from users.export import export_transactions
+from users.models import Base, Transactions
+
+
+def seed(engine, transactions: int, wallets: int):
+    """Fill transactions with random transfers."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for start in range(0, transactions, BATCH):
+            connection.execute(insert(Transactions), [
+                random_transaction(wallets)
+                for _ in range(min(BATCH, transactions - start))
+            ])
+
+
+def measure_export(session, export_format: str, trace: bool = False):
+    """Print rows per second and bytes of a full export.
+
+    With trace, also its peak memory.
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    size = lines = 0
+    for chunk in export_transactions(session, "", None, 0, None, None,
+                                     export_format):
+        size += len(chunk)
+        lines += chunk.count("\n")
+    elapsed = time.perf_counter() - start
+    memory = ""
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        memory = f", peak memory {peak / 2 ** 20:.1f}MiB"
+        tracemalloc.stop()
+    print(f"{export_format:>6} export: {lines} lines, "
+          f"{size / 2 ** 20:.0f}MiB in {elapsed:.1f}s "
+          f"({lines / elapsed:,.0f} rows/s){memory}")
+
+
+def measure_paging(session, transactions: int, pages: int):
+    """Print the time of pages of 10 with counts, and the extrapolation."""
+    start = time.perf_counter()
+    page = {"next_cursor": None}
+    for _ in range(pages):
+        page = get_all_transactions(session, None, 0, 10, 0,
+                                    page["next_cursor"])
+    elapsed = time.perf_counter() - start
+    print(f"paging: {pages} pages in {elapsed:.1f}s, "
+          f"{elapsed / pages * 1000:.1f}ms a page, about "
+          f"{elapsed / pages * transactions / 10 / 60:,.0f}min for all rows")
+
+
+def main():
+    """Seed, then time both ways of reading every transaction."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=100_000)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--db-url", default="sqlite:///./benchmarks/bench.db")
+    args = parser.parse_args()
+    random.seed(0)
+    engine = create_engine(args.db_url)
+    start = time.perf_counter()
+    seed(engine, args.transactions, args.wallets)
+    print(f"seeded {args.transactions} transactions in "
+          f"{time.perf_counter() - start:.0f}s")
+    with sessionmaker(bind=engine)() as session:
+        measure_paging(session, args.transactions, args.pages)
+    for export_format, trace in (("ndjson", False), ("csv", False),
+                                 ("ndjson", True)):
+        with sessionmaker(bind=engine)() as session:
+            measure_export(session, export_format, trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Radius query latency of the in-memory trainer index.
+
+Loads --trainers random locations spread over Buenos Aires and runs
+radius searches from random points, reporting build time and p50/p99
+per radius. A brute force scan over every trainer is shown for reference.
+
+Usage: python -m benchmarks.geo_index [--trainers 500000] [--searches 200]
+           [--cell-size 0.01]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from users.geo_index import GeoIndex, distance_m
+
+CENTER = (-58.43, -34.6)
+SPREAD = 0.15
+RADII = (500, 1000, 5000)
+
+
+def random_point():
+    """Return a point inside the city."""
+    return (CENTER[0] + random.uniform(-SPREAD, SPREAD),
+            CENTER[1] + random.uniform(-SPREAD, SPREAD))
+
+
+def brute_force(points: dict, center, radius: float, limit: int):
+    """Return closest users by checking every point."""
+    found = sorted(
+        (distance, user_id) for user_id, point in points.items()
+        if (distance := distance_m(center, point)) <= radius
+    )
+    return found[:limit]
+
+
+def report(name: str, samples: list):
+    """Print latency percentiles."""
+    cuts = statistics.quantiles(samples, n=100)
+    print(f"{name:>16}: p50={cuts[49] * 1000:.2f}ms "
+          f"p99={cuts[98] * 1000:.2f}ms")
+
+
+def main():
+    """Build the index and time searches."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trainers", type=int, default=500_000)
+    parser.add_argument("--searches", type=int, default=200)
+    parser.add_argument("--cell-size", type=float, default=0.01)
+    args = parser.parse_args()
+    random.seed(0)
+    locations = [(idx, random_point()) for idx in range(args.trainers)]
+    index = GeoIndex(args.cell_size)
+    start = time.perf_counter()
+    index.load(locations)
+    print(f"load: {args.trainers} trainers in "
+          f"{time.perf_counter() - start:.2f}s, {len(index.cells)} cells")
+    for radius in RADII:
+        samples = []
+        for _ in range(args.searches):
+            center = random_point()
+            start = time.perf_counter()
+            index.within(center, radius, 10, 0)
+            samples.append(time.perf_counter() - start)
+        report(f"index r={radius}m", samples)
+    samples = []
+    for _ in range(5):
+        start = time.perf_counter()
+        brute_force(index.points, random_point(), 1000, 10)
+        samples.append(time.perf_counter() - start)
+    print(f"brute force r=1000m: avg="
+          f"{statistics.mean(samples) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
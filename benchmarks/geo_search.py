@@ -0,0 +1,117 @@
+"""Geo search latency with a client per call vs the shared Mongo client.
+
+Seeds --trainers locations around Buenos Aires in a local mongod and runs
+sequential get_users_within searches, first building a MongoClient for
+every search like before, then through the shared sync and async clients.
+
+Usage: python -m benchmarks.geo_search [--searches 500] [--trainers 5000]
+           [--host localhost:27017]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from unittest.mock import MagicMock
+
+from pymongo import MongoClient
+
+from users import mongodb
+from users.mongodb import (
+    close_mongo,
+    get_mongo_url,
+    get_mongodb_connection,
+    get_users_within,
+    initialize,
+)
+
+CENTER = (-58.43, -34.6)
+
+
+def random_point(spread: float = 0.1):
+    """Return a point close to the center."""
+    return (CENTER[0] + random.uniform(-spread, spread),
+            CENTER[1] + random.uniform(-spread, spread))
+
+
+def build_config(host: str, asynchronous: bool):
+    """Return a configuration pointing at a local mongod."""
+    return MagicMock(**{
+        "mongo.driver": "mongodb",
+        "mongo.user": "fiufit",
+        "mongo.password": "fiufit",
+        "mongo.host": host,
+        "mongo.database": "fiufit?authSource=admin",
+        "mongo.asynchronous": asynchronous,
+        "mongo.max_pool_size": 100,
+        "mongo.min_pool_size": 0,
+        "mongo.max_idle_time": 60.0,
+        "mongo.server_selection_timeout": 5.0,
+    })
+
+
+def seed(url: str, trainers: int):
+    """Replace stored locations with trainers random ones."""
+    with MongoClient(url) as client:
+        collection = client.fiufit.user_location
+        collection.drop()
+        collection.insert_many([
+            {"user_id": idx, "location": random_point()}
+            for idx in range(trainers)
+        ])
+        asyncio.run(initialize(client))
+
+
+async def per_call(url: str, searches: int):
+    """Search with a new client each time, as before."""
+    samples = []
+    for _ in range(searches):
+        start = time.perf_counter()
+        client = MongoClient(url)
+        await get_users_within(client, random_point(), 1000, 10, 0)
+        client.close()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def shared(config, searches: int):
+    """Search through the shared client."""
+    mongodb.CLIENT = None
+    connection = get_mongodb_connection(config)
+    await get_users_within(connection, random_point(), 1000, 10, 0)
+    samples = []
+    for _ in range(searches):
+        start = time.perf_counter()
+        await get_users_within(connection, random_point(), 1000, 10, 0)
+        samples.append(time.perf_counter() - start)
+    await close_mongo()
+    return samples
+
+
+def report(name: str, samples: list):
+    """Print latency percentiles."""
+    cuts = statistics.quantiles(samples, n=100)
+    print(f"{name:>12}: p50={cuts[49] * 1000:.2f}ms "
+          f"p99={cuts[98] * 1000:.2f}ms")
+
+
+def main():
+    """Seed and compare the three strategies."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--trainers", type=int, default=5000)
+    parser.add_argument("--host", default="localhost:27017")
+    args = parser.parse_args()
+    url = get_mongo_url(build_config(args.host, False))
+    seed(url, args.trainers)
+    report("per-call", asyncio.run(per_call(url, args.searches)))
+    report("shared sync", asyncio.run(
+        shared(build_config(args.host, False), args.searches)
+    ))
+    report("shared async", asyncio.run(
+        shared(build_config(args.host, True), args.searches)
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Throughput of GET /users/locations/ before and after the catalog.
+
+Serves the locations endpoint the old way (read and parse
+static/location.json, then validate through the response model on every
+request) next to the preloaded catalog, with and without a matching
+If-None-Match, and reports requests per second through the ASGI stack.
+
+Usage: python -m benchmarks.locations [--requests 3000]
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, Header
+
+from users.locations import LOCATIONS_PATH, LocationCatalog
+from users.schemas import Location
+
+
+def build_app() -> Tuple[FastAPI, LocationCatalog]:
+    """Return an app with the old and the catalog endpoints."""
+    app = FastAPI()
+    catalog = LocationCatalog.load(LOCATIONS_PATH, 86400)
+
+    @app.get("/old/", response_model=List[Location])
+    async def old_locations():
+        with open(LOCATIONS_PATH, encoding="UTF-8") as location_file:
+            return json.load(location_file)
+
+    @app.get("/catalog/", response_model=List[Location])
+    async def catalog_locations(if_none_match: Optional[str] = Header(None)):
+        return catalog.response(if_none_match)
+
+    return app, catalog
+
+
+async def throughput(app: FastAPI, path: str, requests: int,
+                     headers: Optional[dict] = None) -> float:
+    """Return requests per second for sequential GETs of path."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://users") as client:
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = await client.get(path, headers=headers)
+            assert response.status_code in (200, 304), response.text
+        return requests / (time.perf_counter() - start)
+
+
+def main():
+    """Time each variant and print requests per second."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    args = parser.parse_args()
+    app, catalog = build_app()
+    cases = (
+        ("parse per request", "/old/", None),
+        ("catalog", "/catalog/", None),
+        ("catalog 304", "/catalog/", {"If-None-Match": catalog.etag}),
+    )
+    for name, path, headers in cases:
+        asyncio.run(throughput(app, path, 100, headers))
+        rate = asyncio.run(throughput(app, path, args.requests, headers))
+        print(f"{name:>17}: {rate:8.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Latency of GET /users/{_id} with a new vs a pooled auth client per call.
+
+Starts a stub auth service on localhost and sends sequential requests
+through the ASGI app, reporting p50/p99 for both client strategies.
+
+Usage: python -m benchmarks.outbound_clients [--requests 2000]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.stubs import serve_stub
+
+os.environ.setdefault("TESTING", "TRUE")
+
+
+def percentiles(samples):
+    """Return p50 and p99 in milliseconds."""
+    cuts = statistics.quantiles(samples, n=100)
+    return cuts[49] * 1000, cuts[98] * 1000
+
+
+async def measure(app, requests: int):
+    """Time sequential GET /users/1 calls."""
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://users") as client:
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.get(
+                "/users/1", headers={"Authorization": "Bearer token"}
+            )
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+    return samples
+
+
+def main():
+    """Run both modes and print a small report."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    os.environ["USERS_AUTH_HOST"] = serve_stub()
+
+    # pylint: disable=import-outside-toplevel
+    from users.main import app, get_db
+    from users.models import Base, Users
+
+    engine = create_engine("sqlite:///./benchmarks/bench.db")
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        session.add(Users(email="a@b.c", username="a", is_blocked=False))
+        session.commit()
+
+    def override_get_db():
+        with factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+
+    def new_client_per_call():
+        return httpx.AsyncClient()
+
+    with patch("users.util.auth_client", new_client_per_call):
+        before = asyncio.run(measure(app, args.requests))
+    after = asyncio.run(measure(app, args.requests))
+    for name, samples in (("per-call", before), ("pooled", after)):
+        p50, p99 = percentiles(samples)
+        print(f"{name:>9}: p50={p50:.2f}ms p99={p99:.2f}ms")
+    os.remove("./benchmarks/bench.db")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Location update latency with MongoDB on the request path vs the outbox.
+
+MongoDB is simulated by a collection answering after --mongo-latency
+seconds per call. Times PATCH /users/{id} with new coordinates for a
+trainer through the ASGI app: first writing to MongoDB before answering,
+like patch_user did before, then queueing in the outbox while the relay
+drains it in the background. Reports how long the relay took to catch up.
+
+Usage: python -m benchmarks.outbox [--requests 200] [--mongo-latency 0.02]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+os.environ.setdefault("TESTING", "TRUE")
+
+
+class SlowCollection:
+    """Blocking collection, like pymongo's, with a fixed latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.writes = 0
+
+    def bulk_write(self, requests, **_):
+        """Write a batch of locations in one round trip."""
+        time.sleep(self.latency)
+        self.writes += len(requests)
+
+
+async def measure(app, requests: int) -> list:
+    """Time sequential location updates of one trainer."""
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://users") as client:
+        for idx in range(requests):
+            start = time.perf_counter()
+            response = await client.patch("/users/1", json={
+                "coordinates": [-58.0 - idx / 1000, -34.0],
+            })
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+    return samples
+
+
+# pylint: disable=too-many-locals
+def main():
+    """Run both modes and print a small report."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--mongo-latency", type=float, default=0.02)
+    args = parser.parse_args()
+    os.environ["USERS_MONGO_ENABLED"] = "true"
+
+    # pylint: disable=import-outside-toplevel
+    from users.crud import create_user
+    from users.location_helper import LOCATION_RELAY
+    from users.main import app, get_db
+    from users.models import Base
+    from users.mongodb import write_locations
+    from users.outbox import outbox_status
+    from users.schemas import UserBase
+
+    engine = create_engine("sqlite:///./benchmarks/bench.db",
+                           connect_args={"check_same_thread": False})
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        create_user(session, UserBase(
+            email="trainer@fiufit.com", username="trainer", name="name",
+            surname="surname", height=1.8, weight=80,
+            birth_date="1990-01-01", location="",
+            registration_date="2023-01-01", is_athlete=False,
+        ), {"address": "0x1", "privateKey": "key"})
+    collection = SlowCollection(args.mongo_latency)
+    mongo = SimpleNamespace(fiufit=SimpleNamespace(user_location=collection))
+
+    def override_get_db():
+        with factory() as session:
+            yield session
+
+    async def write_now(_, is_athlete, user_id, coordinates, __):
+        if not is_athlete and coordinates:
+            await write_locations(mongo, [(0, user_id, coordinates)])
+
+    async def measure_both():
+        with patch("users.main.outbox_coordinates", return_value=None), \
+                patch("users.main.save_location", write_now):
+            before = await measure(app, args.requests)
+        LOCATION_RELAY.start(factory, mongo)
+        after = await measure(app, args.requests)
+        start = time.perf_counter()
+        while True:
+            with factory() as session:
+                if outbox_status(session)[0] == 0:
+                    break
+            await asyncio.sleep(0.001)
+        caught_up = time.perf_counter() - start
+        await LOCATION_RELAY.stop()
+        return before, after, caught_up
+
+    app.dependency_overrides[get_db] = override_get_db
+    with patch("users.main.get_credentials",
+               return_value={"id": 1, "role": "user"}):
+        before, after, caught_up = asyncio.run(measure_both())
+    print(f"MongoDB latency {args.mongo_latency * 1000:.0f}ms, "
+          f"{collection.writes} documents written")
+    for name, samples in (("mongo", before), ("outbox", after)):
+        cuts = statistics.quantiles(samples, n=100)
+        print(f"{name:>6}: p50={cuts[49] * 1000:.1f}ms "
+              f"p99={cuts[98] * 1000:.1f}ms")
+    print(f"relay caught up {caught_up * 1000:.1f}ms after the last request")
+    os.remove("./benchmarks/bench.db")
+
+
+if __name__ == "__main__":
+    main()
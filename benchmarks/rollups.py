@@ -0,0 +1,77 @@
+"""Aggregate latency from rollups vs the ledger, and the cost of upserts.
+
+Seeds --transactions transfers over a year, builds their rollups, then
+times daily totals of a busy wallet and of the whole ledger read from
+rollups and computed with GROUP BY over transactions. Also times
+add_transaction with and without its rollup upserts.
+
+Usage: python -m benchmarks.rollups [--transactions 1000000]
+           [--db-url postgresql://.../bench]
+"""
+import argparse
+import random
+import time
+from datetime import date, datetime
+from unittest.mock import patch
+
+from sqlalchemy import Date, create_engine, func, or_, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.export import seed
+from benchmarks.transactions import HOT, timed
+from users.crud import add_transaction
+from users.models import Transactions
+from users.rollups import build_rollups, get_aggregates
+
+SINCE, UNTIL = date(2023, 6, 1), date(2023, 7, 1)
+
+
+def ledger_totals(session, address):
+    """Compute daily totals from transactions, like before rollups."""
+    day = func.date(Transactions.date, type_=Date)
+    query = select(day, func.count(), func.sum(Transactions.amount),
+                   func.max(Transactions.amount)).where(
+        Transactions.date >= datetime(2023, 1, 1),
+        Transactions.date < datetime(2024, 1, 1),
+    )
+    if address:
+        query = query.where(or_(Transactions.sender == address,
+                                Transactions.receiver == address))
+    return session.execute(query.group_by(day).order_by(day)).all()
+
+
+def main():
+    """Seed, build rollups and time both ways of aggregating."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=1_000_000)
+    parser.add_argument("--wallets", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--db-url", default="sqlite:///./benchmarks/bench.db")
+    args = parser.parse_args()
+    random.seed(0)
+    engine = create_engine(args.db_url)
+    seed(engine, args.transactions, args.wallets)
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        build_rollups(connection)
+    print(f"built rollups of {args.transactions} transactions in "
+          f"{time.perf_counter() - start:.1f}s")
+    with sessionmaker(bind=engine)() as session:
+        timed("ledger hot wallet year", lambda: ledger_totals(session, HOT),
+              args.runs)
+        timed("rollups hot wallet year", lambda: get_aggregates(
+            session, HOT, date(2023, 1, 1), date(2024, 1, 1)), args.runs)
+        timed("ledger all year", lambda: ledger_totals(session, None),
+              max(args.runs // 10, 2))
+        timed("rollups all year", lambda: get_aggregates(
+            session, None, date(2023, 1, 1), date(2024, 1, 1)),
+            max(args.runs // 10, 2))
+        timed("add_transaction", lambda: add_transaction(
+            session, HOT, "0x1", 1.0), args.runs * 10)
+        with patch("users.crud.record_transaction"):
+            timed("without upserts", lambda: add_transaction(
+                session, HOT, "0x1", 1.0), args.runs * 10)
+
+
+if __name__ == "__main__":
+    main()
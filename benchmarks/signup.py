@@ -0,0 +1,101 @@
+"""Signup latency with remote steps in sequence vs run concurrently.
+
+Starts stub auth and payments services answering after --auth-latency
+and --payments-latency seconds, then times POST /users with an image
+through the ASGI app. The sequential run awaits each remote step in
+turn, like signup did before; the concurrent one uses Signup as is.
+
+Usage: python -m benchmarks.signup [--requests 50] [--auth-latency 0.1]
+           [--payments-latency 0.2]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from unittest.mock import patch
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.stubs import serve_stub
+
+os.environ.setdefault("TESTING", "TRUE")
+
+
+async def measure(app, requests: int, first: int):
+    """Time sequential signups of new users, numbered from first."""
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://users") as client:
+        for idx in range(first, first + requests):
+            start = time.perf_counter()
+            response = await client.post("/users", json={
+                "email": f"user_{idx}@fiufit.com", "password": "secret",
+                "username": f"user_{idx}", "name": "name",
+                "surname": "surname", "height": 1.8, "weight": 80,
+                "birth_date": "1990-01-01", "location": "",
+                "registration_date": "2023-01-01", "is_athlete": True,
+                "image": "aW1hZ2U=",
+            })
+            samples.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+    return samples
+
+
+# pylint: disable=too-many-locals
+def main():
+    """Run both modes and print a small report."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--auth-latency", type=float, default=0.1)
+    parser.add_argument("--payments-latency", type=float, default=0.2)
+    args = parser.parse_args()
+    os.environ["USERS_AUTH_HOST"] = serve_stub(args.auth_latency)
+    os.environ["USERS_PAYMENTS_HOST"] = serve_stub(args.payments_latency)
+    os.environ["USERS_MONGO_ENABLED"] = "false"
+
+    # pylint: disable=import-outside-toplevel
+    from users.main import app, get_db
+    from users.models import Base
+    from users.signup import Signup
+
+    class SequentialSignup(Signup):
+        """Signup awaiting independent steps one after the other."""
+
+        async def concurrently(self, steps):
+            return {name: await self.step(name, *step)
+                    for name, step in steps.items()}
+
+    engine = create_engine("sqlite:///./benchmarks/bench.db")
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        with factory() as session:
+            yield session
+
+    async def measure_both():
+        # One loop for both, pooled clients belong to the loop.
+        with patch("users.main.Signup", SequentialSignup):
+            before = await measure(app, args.requests, 0)
+        return before, await measure(app, args.requests, args.requests)
+
+    app.dependency_overrides[get_db] = override_get_db
+    before, after = asyncio.run(measure_both())
+    slowest = max(args.auth_latency, args.payments_latency)
+    total = 2 * args.auth_latency + args.payments_latency
+    print(f"slowest call {slowest * 1000:.0f}ms, "
+          f"sum of calls {total * 1000:.0f}ms")
+    for name, samples in (("sequential", before), ("concurrent", after)):
+        cuts = statistics.quantiles(samples, n=100)
+        print(f"{name:>10}: p50={cuts[49] * 1000:.1f}ms "
+              f"p99={cuts[98] * 1000:.1f}ms")
+    os.remove("./benchmarks/bench.db")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Local stand-ins for the auth and payments services used by benchmarks."""
+import asyncio
+import itertools
+import socket
+import threading
+import time
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+WALLETS = itertools.count()
+
+
+def build_stub(latency: float = 0.0) -> Starlette:
+    """Build an app answering every auth/payments call after `latency` s."""
+
+    async def answer(request: Request):
+        if latency:
+            await asyncio.sleep(latency)
+        path = request.url.path
+        if path == "/auth/credentials":
+            return JSONResponse({"data": {"role": "admin", "id": 1}})
+        if path == "/payment/wallet" and request.method == "POST":
+            number = next(WALLETS)
+            return JSONResponse({
+                "address": f"0x{number:040x}",
+                "privateKey": f"0x{number:064x}",
+            })
+        return JSONResponse({})
+
+    return Starlette(routes=[
+        Route(
+            "/{path:path}",
+            answer,
+            methods=["GET", "POST", "PATCH", "DELETE"],
+        ),
+    ])
+
+
+def free_port() -> int:
+    """Return a TCP port nobody is listening on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_stub(latency: float = 0.0) -> str:
+    """Start a stub server in a daemon thread and return its host:port."""
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        build_stub(latency), port=port, log_level="error"
+    ))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"127.0.0.1:{port}"
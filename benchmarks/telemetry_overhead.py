@@ -0,0 +1,84 @@
+"""Per-request cost of route metrics.
+
+Calls the same minimal endpoint through the ASGI stack with plain routes
+and with InstrumentedRoute, then times a bare histogram observe() and a
+full registry render for reference.
+
+Usage: python -m benchmarks.telemetry_overhead [--requests 2000] [--rounds 5]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from users.telemetry import REGISTRY, REQUEST_LATENCY, InstrumentedRoute
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    """Return an app with one path parameter endpoint."""
+    app = FastAPI()
+    if instrumented:
+        app.router.route_class = InstrumentedRoute
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: int):
+        return {"id": user_id}
+
+    return app
+
+
+async def time_requests(app: FastAPI, requests: int) -> list:
+    """Return seconds taken by each request."""
+    transport = httpx.ASGITransport(app=app)
+    samples = []
+    async with httpx.AsyncClient(transport=transport,
+                                 base_url="http://bench") as client:
+        for user_id in range(requests):
+            start = time.perf_counter()
+            await client.get(f"/users/{user_id}")
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name: str, samples: list):
+    """Print latency percentiles in microseconds."""
+    cuts = statistics.quantiles(samples, n=100)
+    print(f"{name:>13}: p50={cuts[49] * 1e6:.1f}us "
+          f"p99={cuts[98] * 1e6:.1f}us")
+    return cuts[49]
+
+
+def main():
+    """Time both apps, alternating to even out noise."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    plain, instrumented = build_app(False), build_app(True)
+    asyncio.run(time_requests(plain, 200))
+    asyncio.run(time_requests(instrumented, 200))
+    samples = {False: [], True: []}
+    for _ in range(args.rounds):
+        for flag, app in ((False, plain), (True, instrumented)):
+            samples[flag] += asyncio.run(time_requests(app, args.requests))
+    plain_p50 = report("plain", samples[False])
+    instrumented_p50 = report("instrumented", samples[True])
+    print(f"overhead: {(instrumented_p50 - plain_p50) * 1e6:.1f}us per "
+          "request at p50")
+
+    child = REQUEST_LATENCY.labels("GET", "/bench")
+    start = time.perf_counter()
+    for _ in range(1_000_000):
+        child.observe(0.003)
+    print(f"observe: {(time.perf_counter() - start) * 1000:.0f}ns each")
+    start = time.perf_counter()
+    body = REGISTRY.render()
+    print(f"render: {(time.perf_counter() - start) * 1000:.2f}ms, "
+          f"{len(body)} bytes")
+
+
+if __name__ == "__main__":
+    main()
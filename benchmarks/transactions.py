@@ -0,0 +1,126 @@
+"""Transaction listing latency, former schema vs indexed one.
+
+Seeds --transactions transfers between --wallets wallets over a year,
+one "hot" wallet taking part in 1% of them, into the current table and a
+copy with the former (sender, receiver, amount, date) primary key. Then
+times first pages by wallet (the former OR query vs get_all_transactions),
+a one month range and the newest transactions.
+
+Usage: python -m benchmarks.transactions [--transactions 5000000]
+           [--wallets 100000] [--db-url postgresql://.../bench]
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Float, MetaData, String, Table, \
+    create_engine, insert, or_, select, text
+from sqlalchemy.orm import sessionmaker
+
+from users.crud import get_all_transactions
+from users.models import Base, Transactions
+from users.pagination import NO_TOTAL
+
+START = datetime(2023, 1, 1)
+HOT = "0xhot"
+BATCH = 50_000
+
+FORMER = Table(
+    "transactions_former", MetaData(),
+    Column("sender", String, primary_key=True),
+    Column("receiver", String, primary_key=True),
+    Column("amount", Float, primary_key=True),
+    Column("date", DateTime, primary_key=True),
+)
+
+
+def random_transaction(wallets: int) -> dict:
+    """Return a transfer at a random time of the year."""
+    sender, receiver = (f"0x{random.randrange(wallets)}" for _ in range(2))
+    if random.random() < 0.01:
+        sender = HOT
+    return {"sender": sender, "receiver": receiver,
+            "amount": round(random.uniform(1, 1000), 2),
+            "date": START + timedelta(seconds=random.randrange(31_536_000))}
+
+
+def seed(engine, transactions: int, wallets: int):
+    """Fill both tables with the same rows."""
+    Base.metadata.drop_all(bind=engine)
+    FORMER.drop(engine, checkfirst=True)
+    Base.metadata.create_all(bind=engine)
+    FORMER.create(engine)
+    with engine.begin() as connection:
+        for start in range(0, transactions, BATCH):
+            connection.execute(insert(Transactions), [
+                random_transaction(wallets)
+                for _ in range(min(BATCH, transactions - start))
+            ])
+        connection.execute(text(
+            "INSERT INTO transactions_former "
+            "SELECT DISTINCT sender, receiver, amount, date FROM transactions"
+        ))
+
+
+def former_page(session, address, since=None, until=None, limit=10):
+    """List like before: OR of sender and receiver, sorted by the key."""
+    query = select(FORMER).where(or_(FORMER.c.sender == address,
+                                     FORMER.c.receiver == address))
+    if since:
+        query = query.where(FORMER.c.date >= since, FORMER.c.date < until)
+    return session.execute(query.order_by(*FORMER.primary_key.columns)
+                           .limit(limit + 1)).all()
+
+
+def timed(name: str, function, runs: int):
+    """Print p50/p99 of function over runs calls."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    cuts = statistics.quantiles(samples, n=100) if runs > 1 else samples * 99
+    print(f"{name:>26}: p50={cuts[49] * 1000:8.2f}ms "
+          f"p99={cuts[98] * 1000:8.2f}ms")
+
+
+def main():
+    """Seed and time each listing."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transactions", type=int, default=5_000_000)
+    parser.add_argument("--wallets", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--db-url", default="sqlite:///./benchmarks/bench.db")
+    args = parser.parse_args()
+    random.seed(0)
+    engine = create_engine(args.db_url)
+    start = time.perf_counter()
+    seed(engine, args.transactions, args.wallets)
+    print(f"seeded {args.transactions} transactions in "
+          f"{time.perf_counter() - start:.0f}s")
+    since, until = datetime(2023, 6, 1), datetime(2023, 7, 1)
+    with sessionmaker(bind=engine)() as session:
+        for label, wallet in (("wallet", lambda: "0x1234"),
+                              ("hot wallet", lambda: HOT)):
+            timed(f"former {label}", lambda w=wallet: former_page(
+                session, w()), args.runs)
+            timed(f"indexed {label}", lambda w=wallet: get_all_transactions(
+                session, w(), 0, 10, 0, count=NO_TOTAL), args.runs)
+            timed(f"former {label} month", lambda w=wallet: former_page(
+                session, w(), since, until), args.runs)
+            timed(f"indexed {label} month",
+                  lambda w=wallet: get_all_transactions(
+                      session, w(), 0, 10, 0, count=NO_TOTAL, since=since,
+                      until=until), args.runs)
+        timed("former newest", lambda: session.execute(
+            select(FORMER).order_by(FORMER.c.date.desc()).limit(11)
+        ).all(), args.runs)
+        timed("indexed newest", lambda: get_all_transactions(
+            session, None, 0, 10, 0, count=NO_TOTAL, newest_first=True
+        ), args.runs)
+
+
+if __name__ == "__main__":
+    main()
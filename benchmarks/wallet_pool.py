@@ -0,0 +1,75 @@
+"""Signup latency with wallets created on signup vs taken from the pool.
+
+Starts stub auth and payments services answering after --auth-latency
+and --payments-latency seconds, then times POST /users through the ASGI
+app: first with the pool disabled, then with --pool-size wallets filled
+beforehand and refilled in the background while signups run.
+
+Usage: python -m benchmarks.wallet_pool [--requests 50] [--pool-size 50]
+           [--auth-latency 0.1] [--payments-latency 0.2]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.signup import measure
+from benchmarks.stubs import serve_stub
+
+os.environ.setdefault("TESTING", "TRUE")
+
+
+# pylint: disable=too-many-locals
+def main():
+    """Run both modes and print a small report."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=50)
+    parser.add_argument("--auth-latency", type=float, default=0.1)
+    parser.add_argument("--payments-latency", type=float, default=0.2)
+    args = parser.parse_args()
+    os.environ["USERS_AUTH_HOST"] = serve_stub(args.auth_latency)
+    os.environ["USERS_PAYMENTS_HOST"] = serve_stub(args.payments_latency)
+    os.environ["USERS_MONGO_ENABLED"] = "false"
+
+    # pylint: disable=import-outside-toplevel
+    from users.main import app, get_db
+    from users.models import Base
+    from users.util import WALLET_POOL, create_wallet
+
+    engine = create_engine("sqlite:///./benchmarks/bench.db",
+                           connect_args={"check_same_thread": False})
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+
+    def override_get_db():
+        with factory() as session:
+            yield session
+
+    async def measure_both():
+        # One loop for both, pooled clients belong to the loop.
+        WALLET_POOL.size = 0
+        before = await measure(app, args.requests, 0)
+        WALLET_POOL.size = args.pool_size
+        await WALLET_POOL.refill(factory, create_wallet)
+        WALLET_POOL.start(factory, create_wallet)
+        after = await measure(app, args.requests, args.requests)
+        await WALLET_POOL.stop()
+        return before, after
+
+    app.dependency_overrides[get_db] = override_get_db
+    before, after = asyncio.run(measure_both())
+    for name, samples in (("on signup", before), ("from pool", after)):
+        cuts = statistics.quantiles(samples, n=100)
+        print(f"{name:>9}: p50={cuts[49] * 1000:.1f}ms "
+              f"p99={cuts[98] * 1000:.1f}ms")
+    print(f"pool depth after: {WALLET_POOL.depth}")
+    os.remove("./benchmarks/bench.db")
+
+
+if __name__ == "__main__":
+    main()
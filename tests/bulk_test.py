@@ -0,0 +1,174 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from tests.testing_util import new_wallet, user_1, user_2
+from users.bulk import check_batch, create_many
+from users.crud import create_users, find_conflicts
+from users.models import LocationOutbox, Users, UsersLocations, \
+    UsersWallets
+from users.schemas import UserCreate
+
+
+def config(mongo=True):
+    return MagicMock(**{"bulk.concurrency": 2, "mongo.enabled": mongo,
+                        "geo.index": False})
+
+
+def member(idx, **fields):
+    return UserCreate(**user_2 | {"email": f"member{idx}@gym.com",
+                                  "username": f"member{idx}"} | fields)
+
+
+def test_when_batch_repeats_or_takes_users_expect_only_first_free_kept():
+    users = [member(1), member(2, email="MEMBER1@gym.com"),
+             member(3, username="member1"), member(4), member(5)]
+    results = check_batch(users, {"member4@gym.com"}, {"member5"})
+    assert [result and result["detail"] for result in results] == [
+        None, "Email repeated in batch", "Username repeated in batch",
+        "User with that email already present",
+        "User with that username already present",
+    ]
+
+
+def test_when_finding_conflicts_expect_taken_emails_ignoring_case(factory):
+    with factory() as session:
+        create_users(session, [member(1), member(2)],
+                     [new_wallet(), new_wallet()], [None, None], True)
+        assert find_conflicts(session, ["Member1@GYM.com", "new@gym.com"],
+                              ["member2", "new"]) == \
+            ({"member1@gym.com"}, {"member2"})
+
+
+def test_when_inserting_users_expect_ids_in_order_and_one_row_each(factory):
+    with factory() as session:
+        ids = create_users(session, [member(1), member(2), member(3)],
+                           [new_wallet() for _ in range(3)],
+                           [(1.0, 2.0), None, (3.0, 4.0)], False)
+        assert [session.get(Users, _id).username for _id in ids] == \
+            ["member1", "member2", "member3"]
+        assert len(session.scalars(select(UsersWallets)).all()) == 3
+        assert session.execute(select(UsersLocations.user_id)).scalars() \
+            .all() == [ids[0], ids[2]]
+
+
+def test_when_inserting_taken_users_expect_them_skipped(factory):
+    with factory() as session:
+        create_users(session, [member(1)], [new_wallet()], [None], True)
+        ids = create_users(
+            session, [member(2), member(3, email="MEMBER1@gym.com"),
+                      member(1, email="other@gym.com")],
+            [new_wallet() for _ in range(3)], [(1.0, 2.0)] * 3, True,
+        )
+        assert ids[0] is not None and ids[1:] == [None, None]
+        assert len(session.scalars(select(UsersWallets)).all()) == 2
+        assert session.execute(select(LocationOutbox.user_id)).scalars() \
+            .all() == [ids[0]]
+
+
+@patch("users.bulk.find_conflicts", MagicMock(return_value=(set(), set())))
+@patch("users.bulk.delete_wallet")
+@patch("users.bulk.delete_user_firebase")
+@patch("users.bulk.create_wallet")
+@patch("users.bulk.add_user_firebase", AsyncMock())
+def test_when_user_is_taken_meanwhile_expect_only_it_undone(
+    create_wallet, delete_firebase, delete_wallet, factory
+):
+    create_wallet.side_effect = new_wallet
+    with factory() as session:
+        create_users(session, [member(1)], [new_wallet()], [None], True)
+        results = asyncio.run(create_many(
+            session, [member(2), member(3, email="member1@GYM.com")],
+            config(),
+        ))
+    assert [result["status"] for result in results] == [200, 400]
+    assert results[1]["detail"] == \
+        "User with that email or username already present"
+    delete_firebase.assert_awaited_once_with("member1@GYM.com")
+    delete_wallet.assert_awaited_once()
+
+
+@patch("users.bulk.upload_image", AsyncMock())
+@patch("users.bulk.delete_wallet")
+@patch("users.bulk.delete_user_firebase")
+@patch("users.bulk.create_wallet")
+@patch("users.bulk.add_user_firebase")
+def test_when_creating_many_expect_per_user_results(
+    add_firebase, create_wallet, delete_firebase, delete_wallet, factory
+):
+    create_wallet.side_effect = new_wallet
+
+    async def add(email, _):
+        if email == "member3@gym.com":
+            raise HTTPException(status_code=409, detail="exists in auth")
+
+    add_firebase.side_effect = add
+    users = [member(1, coordinates=(1.0, 2.0)), member(2, email=user_1[
+        "email"]), member(3), member(4, email="MEMBER1@gym.com")]
+    with factory() as session:
+        create_users(session, [UserCreate(**user_1)], [new_wallet()],
+                     [None], True)
+        results = asyncio.run(create_many(session, users, config()))
+        assert [result["status"] for result in results] == \
+            [200, 400, 409, 400]
+        assert results[2]["detail"] == "exists in auth"
+        assert session.get(Users, results[0]["id"]).username == "member1"
+        assert session.execute(select(LocationOutbox.user_id)).scalars() \
+            .all() == [results[0]["id"]]
+    assert add_firebase.await_count == 2
+    delete_firebase.assert_not_awaited()
+    delete_wallet.assert_awaited_once()
+
+
+@patch("users.bulk.create_users")
+@patch("users.bulk.delete_wallet")
+@patch("users.bulk.delete_user_firebase")
+@patch("users.bulk.create_wallet")
+@patch("users.bulk.add_user_firebase")
+# pylint: disable=too-many-arguments
+def test_when_insert_fails_expect_every_user_undone(
+    add_firebase, create_wallet, delete_firebase, delete_wallet,
+    create_users_mock, factory
+):
+    create_wallet.side_effect = new_wallet
+    create_users_mock.side_effect = HTTPException(status_code=400,
+                                                  detail="conflict")
+    with factory() as session, pytest.raises(HTTPException):
+        asyncio.run(create_many(session, [member(1), member(2)], config()))
+    assert add_firebase.await_count == 2
+    assert {call.args[0] for call in delete_firebase.await_args_list} == \
+        {"member1@gym.com", "member2@gym.com"}
+    assert delete_wallet.await_count == 2
+
+
+@patch("users.bulk.delete_wallet", AsyncMock())
+@patch("users.bulk.delete_user_firebase", AsyncMock())
+@patch("users.bulk.create_wallet")
+@patch("users.bulk.add_user_firebase")
+def test_when_creating_many_expect_remote_calls_bounded(
+    add_firebase, create_wallet, factory
+):
+    running = []
+    peak = []
+
+    async def slow(*_):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return new_wallet()
+
+    add_firebase.side_effect = slow
+    create_wallet.side_effect = slow
+    with factory() as session:
+        results = asyncio.run(create_many(
+            session, [member(idx) for idx in range(10)], config(mongo=False)
+        ))
+    assert all(result["status"] == 200 for result in results)
+    # Two users at a time, each with its auth and wallet calls.
+    assert max(peak) == 4
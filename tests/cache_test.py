@@ -0,0 +1,88 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= missing-class-docstring
+from users.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_when_key_is_missing_expect_default_and_miss():
+    cache = TTLCache(2, 10)
+    assert cache.get("banana", "default") == "default"
+    assert cache.misses == 1
+
+
+def test_when_key_is_present_expect_value_and_hit():
+    cache = TTLCache(2, 10)
+    cache.set("banana", 1)
+    assert cache.get("banana") == 1
+    assert cache.hits == 1
+
+
+def test_when_ttl_passed_expect_entry_expired():
+    clock = FakeClock()
+    cache = TTLCache(2, 10, clock)
+    cache.set("banana", 1)
+    clock.now = 10
+    assert cache.get("banana") is None
+    assert not cache
+
+
+def test_when_custom_ttl_expect_it_is_used():
+    clock = FakeClock()
+    cache = TTLCache(2, 10, clock)
+    cache.set("banana", 1, ttl=1)
+    clock.now = 2
+    assert cache.get("banana") is None
+
+
+def test_when_full_expect_least_recently_used_evicted():
+    cache = TTLCache(2, 10)
+    cache.set("banana", 1)
+    cache.set("tomato", 2)
+    cache.get("banana")
+    cache.set("apple", 3)
+    assert cache.get("tomato") is None
+    assert cache.get("banana") == 1
+    assert cache.evictions == 1
+
+
+def test_when_size_is_zero_expect_nothing_stored():
+    cache = TTLCache(0, 10)
+    cache.set("banana", 1)
+    assert not cache
+
+
+def test_when_getting_stats_expect_hit_ratio():
+    cache = TTLCache(2, 10)
+    cache.set("banana", 1)
+    cache.get("banana")
+    cache.get("tomato")
+    assert cache.stats() == {
+        "size": 1,
+        "max_size": 2,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "hit_ratio": 0.5,
+    }
+
+
+def test_when_entries_leave_expect_on_remove_called():
+    clock = FakeClock()
+    removed = []
+    cache = TTLCache(2, 10, clock, lambda *entry: removed.append(entry))
+    cache.set("banana", 1)
+    cache.set("banana", 2)
+    cache.set("apple", 3)
+    cache.set("pear", 4)
+    cache.delete("apple")
+    clock.now = 11
+    cache.get("pear")
+    assert removed == [("banana", 1), ("banana", 2), ("apple", 3),
+                       ("pear", 4)]
@@ -0,0 +1,47 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import asyncio
+from unittest.mock import MagicMock
+
+from users.clients import (
+    AUTH,
+    CLIENTS,
+    PAYMENTS,
+    build_client,
+    close_clients,
+    get_client,
+    start_clients,
+)
+
+SERVICE = MagicMock(
+    timeout=2.0,
+    max_connections=7,
+    max_keepalive_connections=3,
+    keepalive_expiry=1.0,
+)
+
+
+def test_when_building_client_expect_timeout_from_config():
+    client = build_client(SERVICE, "auth")
+    assert client.timeout.read == 2.0
+    asyncio.run(client.aclose())
+
+
+def test_when_starting_clients_expect_one_per_dependency():
+    start_clients(MagicMock(auth=SERVICE, payments=SERVICE))
+    assert set(CLIENTS) == {AUTH, PAYMENTS}
+    asyncio.run(close_clients())
+    assert not CLIENTS
+
+
+def test_when_getting_client_twice_expect_same_client():
+    config = MagicMock(auth=SERVICE)
+    assert get_client(AUTH, config) is get_client(AUTH, config)
+    asyncio.run(close_clients())
+
+
+def test_when_getting_closed_client_expect_new_client():
+    config = MagicMock(auth=SERVICE)
+    client = get_client(AUTH, config)
+    asyncio.run(client.aclose())
+    assert get_client(AUTH, config) is not client
+    asyncio.run(close_clients())
@@ -0,0 +1,75 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from users.compensations import PENDING, RETRIED, CompensationRetrier
+from users.models import FailedCompensations
+from users.signup import Signup
+
+WALLET = {"address": "0x1", "privateKey": "key"}
+
+
+def stored(factory):
+    with factory() as session:
+        return [(row.step, row.payload, row.attempts) for row in
+                session.scalars(select(FailedCompensations)
+                                .order_by(FailedCompensations.id))]
+
+
+def test_when_undo_fails_expect_it_stored_and_signup_still_undone(factory):
+    retrier = CompensationRetrier(60, 10, 3)
+    retrier.session_factory = factory
+    delete_user = AsyncMock(side_effect=HTTPException(status_code=503,
+                                                      detail="auth down"))
+    delete_wallet = AsyncMock()
+
+    async def sign_up():
+        async with Signup() as signup:
+            await signup.step("auth", AsyncMock()(), lambda _: retrier.undo(
+                "auth", delete_user, "member@gym.com"))
+            await signup.step("wallet", AsyncMock(return_value=WALLET)(),
+                              lambda wallet: retrier.undo(
+                                  "wallet", delete_wallet, wallet))
+            raise HTTPException(status_code=400, detail="taken")
+
+    with pytest.raises(HTTPException):
+        asyncio.run(sign_up())
+    delete_wallet.assert_awaited_once_with(WALLET)
+    assert stored(factory) == [("auth", '"member@gym.com"', 0)]
+
+
+def test_when_retrying_expect_done_removed_and_failed_counted(factory):
+    retrier = CompensationRetrier(60, 2, 3)
+    retrier.session_factory = factory
+    for payload in ["a@gym.com", "b@gym.com", "c@gym.com"]:
+        asyncio.run(retrier.record("auth", payload, RuntimeError("down")))
+    asyncio.run(retrier.record("wallet", WALLET, RuntimeError("down")))
+
+    async def delete_user(email):
+        if email == "b@gym.com":
+            raise RuntimeError("still down")
+
+    retrier.undoers = {"auth": delete_user, "wallet": AsyncMock()}
+    done = RETRIED.labels("auth", "done")
+    before = done.value
+    asyncio.run(retrier.retry_all())
+    assert done.value == before + 2
+    retrier.undoers["wallet"].assert_awaited_once_with(WALLET)
+    assert stored(factory) == [("auth", '"b@gym.com"', 1)]
+    assert PENDING.labels().value == 1
+
+
+def test_when_retries_run_out_expect_row_left_alone(factory):
+    retrier = CompensationRetrier(60, 10, 2)
+    retrier.session_factory = factory
+    asyncio.run(retrier.record("auth", "a@gym.com", RuntimeError("down")))
+    retrier.undoers = {"auth": AsyncMock(side_effect=RuntimeError("down"))}
+    for _ in range(3):
+        asyncio.run(retrier.retry_all())
+    assert retrier.undoers["auth"].await_count == 2
+    assert stored(factory) == [("auth", '"a@gym.com"', 2)]
@@ -23,6 +23,40 @@ def test_when_environment_has_prometheus_port_9004_expect_9004():
     assert cnf.prometheus_port == 9004
 
 
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_one_day_locations_max_age():
+    cnf = to_config(AppConfig)
+    assert cnf.locations_max_age == 86400
+
+
+@patch.dict(environ, {"USERS_LEDGER_KEEP_MONTHS": "6"}, clear=True)
+def test_when_environment_has_ledger_keep_months_expect_6():
+    cnf = to_config(AppConfig)
+    assert cnf.ledger.keep_months == 6
+    assert cnf.ledger.archive_dir == "archive"
+
+
+@patch.dict(environ, {"USERS_WALLET_POOL_SIZE": "0"}, clear=True)
+def test_when_environment_has_wallet_pool_size_expect_0():
+    cnf = to_config(AppConfig)
+    assert cnf.wallet_pool.size == 0
+    assert cnf.wallet_pool.max_backoff == 300.0
+
+
+@patch.dict(environ, {"USERS_OUTBOX_BATCH_SIZE": "100"}, clear=True)
+def test_when_environment_has_outbox_batch_size_expect_100():
+    cnf = to_config(AppConfig)
+    assert cnf.outbox.batch_size == 100
+    assert cnf.outbox.poll_interval == 1.0
+
+
+@patch.dict(environ, {"USERS_BULK_CONCURRENCY": "10"}, clear=True)
+def test_when_environment_has_bulk_concurrency_expect_10():
+    cnf = to_config(AppConfig)
+    assert cnf.bulk.concurrency == 10
+    assert cnf.bulk.max_users == 10000
+
+
 @patch.dict(environ, {"USERS_LOG_LEVEL": "DEBUG"}, clear=True)
 def test_when_environment_debug_log_level_expect_debug():
     cnf = to_config(AppConfig)
@@ -95,6 +129,44 @@ def test_when_mongo_enabled_env_variable_is_false_expect_false():
     assert not cnf.mongo.enabled
 
 
+@patch.dict(environ, clear=True)
+def test_when_mongo_pool_not_set_expect_defaults():
+    cnf = to_config(AppConfig)
+    assert not cnf.mongo.asynchronous
+    assert cnf.mongo.max_pool_size == 100
+    assert cnf.mongo.min_pool_size == 0
+    assert cnf.mongo.max_idle_time == 60.0
+    assert cnf.mongo.server_selection_timeout == 5.0
+
+
+@patch.dict(environ, {"USERS_MONGO_ASYNCHRONOUS": "True",
+                      "USERS_MONGO_MAX_POOL_SIZE": "20"}, clear=True)
+def test_when_mongo_pool_set_expect_values():
+    cnf = to_config(AppConfig)
+    assert cnf.mongo.asynchronous
+    assert cnf.mongo.max_pool_size == 20
+
+
+@patch.dict(environ, clear=True)
+def test_when_geo_index_not_set_expect_defaults():
+    cnf = to_config(AppConfig)
+    assert not cnf.geo.index
+    assert cnf.geo.cell_size == 0.01
+    assert cnf.geo.refresh_interval == 300.0
+    assert cnf.geo.cache_size == 10000
+    assert cnf.geo.cache_ttl == 30.0
+    assert cnf.geo.cache_cell_size == 0.005
+    assert cnf.geo.cache_radius_step == 250
+
+
+@patch.dict(environ, {"USERS_GEO_INDEX": "True",
+                      "USERS_GEO_CELL_SIZE": "0.05"}, clear=True)
+def test_when_geo_index_set_expect_values():
+    cnf = to_config(AppConfig)
+    assert cnf.geo.index
+    assert cnf.geo.cell_size == 0.05
+
+
 @patch.dict(environ, clear=True)
 def test_when_environment_mongo_driver_expect_mongodb():
     cnf = to_config(AppConfig)
@@ -155,6 +227,21 @@ def test_when_environment_mongo_database_expect_locations():
     assert cnf.mongo.database == "locations"
 
 
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_redis_batching_defaults():
+    cnf = to_config(AppConfig)
+    assert cnf.redis.timeout == 5.0
+    assert cnf.redis.flush_interval == 0.5
+    assert cnf.redis.batch_size == 500
+    assert cnf.redis.buffer_size == 10000
+
+
+@patch.dict(environ, {"USERS_REDIS_FLUSH_INTERVAL": "2"}, clear=True)
+def test_when_environment_redis_flush_interval_expect_float():
+    cnf = to_config(AppConfig)
+    assert cnf.redis.flush_interval == 2.0
+
+
 @patch.dict(environ, {}, clear=True)
 def test_when_environment_is_empty_expect_redis_host_localhost():
     cnf = to_config(AppConfig)
@@ -177,3 +264,75 @@ def test_when_environment_is_empty_expect_redis_port_6379():
 def test_when_environment_redis_port_is_6677_expect_6677():
     cnf = to_config(AppConfig)
     assert cnf.redis.port == 6677
+
+
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_auth_timeout_5():
+    cnf = to_config(AppConfig)
+    assert cnf.auth.timeout == 5.0
+
+
+@patch.dict(environ, {"USERS_AUTH_MAX_CONNECTIONS": "10"}, clear=True)
+def test_when_environment_auth_max_connections_is_10_expect_10():
+    cnf = to_config(AppConfig)
+    assert cnf.auth.max_connections == 10
+
+
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_payments_keepalive_20():
+    cnf = to_config(AppConfig)
+    assert cnf.payments.max_keepalive_connections == 20
+
+
+@patch.dict(environ, {"USERS_PAYMENTS_TIMEOUT": "1.5"}, clear=True)
+def test_when_environment_payments_timeout_is_1_5_expect_1_5():
+    cnf = to_config(AppConfig)
+    assert cnf.payments.timeout == 1.5
+
+
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_credentials_cache_ttl_30():
+    cnf = to_config(AppConfig)
+    assert cnf.auth.credentials_cache_ttl == 30.0
+
+
+@patch.dict(environ, {"USERS_AUTH_CREDENTIALS_CACHE_SIZE": "5"}, clear=True)
+def test_when_environment_credentials_cache_size_is_5_expect_5():
+    cnf = to_config(AppConfig)
+    assert cnf.auth.credentials_cache_size == 5
+
+
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_remote_verification():
+    cnf = to_config(AppConfig)
+    assert cnf.auth.verification == "remote"
+
+
+@patch.dict(environ, {"USERS_AUTH_VERIFICATION": "local"}, clear=True)
+def test_when_environment_verification_is_local_expect_local():
+    cnf = to_config(AppConfig)
+    assert cnf.auth.verification == "local"
+
+
+@patch.dict(environ, {}, clear=True)
+def test_when_environment_is_empty_expect_db_pool_size_5():
+    cnf = to_config(AppConfig)
+    assert cnf.db.pool_size == 5
+
+
+@patch.dict(environ, {"USERS_DB_MAX_OVERFLOW": "2"}, clear=True)
+def test_when_environment_db_max_overflow_is_2_expect_2():
+    cnf = to_config(AppConfig)
+    assert cnf.db.max_overflow == 2
+
+
+@patch.dict(environ, {"USERS_DB_POOL_TIMEOUT": "2.5"}, clear=True)
+def test_when_environment_db_pool_timeout_is_2_5_expect_2_5():
+    cnf = to_config(AppConfig)
+    assert cnf.db.pool_timeout == 2.5
+
+
+@patch.dict(environ, {"USERS_DB_POOL_RECYCLE": "1800"}, clear=True)
+def test_when_environment_db_pool_recycle_is_1800_expect_1800():
+    cnf = to_config(AppConfig)
+    assert cnf.db.pool_recycle == 1800
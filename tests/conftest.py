@@ -0,0 +1,30 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from tests.testing_util import ledger_transactions
+from users.models import Base
+
+
+@pytest.fixture
+def engine():
+    """Empty in-memory database with every table."""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def factory(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def ledger(engine):
+    """Return engine holding ledger_transactions."""
+    with sessionmaker(bind=engine)() as session:
+        session.add_all(ledger_transactions())
+        session.commit()
+    return engine
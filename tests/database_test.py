@@ -0,0 +1,175 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= unused-argument, redefined-outer-name
+# pylint: disable= duplicate-code
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, \
+    create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from tests.testing_util import user_1, new_wallet, equal_dicts
+from users.admin.dao import create_admin, get_all
+from users.admin.dto import AdminCreationDTO
+from users.database import POOL_STATS, TimedAsyncQueuePool, \
+    TimedQueuePool, build_engine, build_session_factory, create_tables, \
+    is_async, run
+from users.main import app, get_db
+from users.models import Base
+
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./tests/async_test.db"
+
+# Each TestClient request runs in its own event loop, connections can't be
+# shared between them.
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+ASYNC_SESSION = build_session_factory(engine)
+
+
+async def override_get_db():
+    async with ASYNC_SESSION() as database:
+        yield database
+
+
+@pytest.fixture
+def async_db():
+    asyncio.run(create_tables(engine, Base.metadata))
+    previous_override = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
+    yield
+    if previous_override is None:
+        app.dependency_overrides.pop(get_db)
+    else:
+        app.dependency_overrides[get_db] = previous_override
+
+    async def drop():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.drop_all)
+
+    asyncio.run(drop())
+
+
+client = TestClient(app)
+
+
+def test_when_driver_is_asyncpg_expect_async():
+    assert is_async(MagicMock(**{"db.driver": "postgresql+asyncpg"}))
+
+
+def test_when_driver_is_postgresql_expect_sync():
+    assert not is_async(MagicMock(**{"db.driver": "postgresql"}))
+
+
+def test_when_building_engine_for_async_driver_expect_async_engine():
+    config = MagicMock(**{
+        "db.driver": "sqlite+aiosqlite",
+        "db.user": None,
+        "db.password": None,
+        "db.host": None,
+        "db.port": None,
+        "db.database": "./tests/async_test.db",
+    })
+    assert isinstance(build_engine(config), AsyncEngine)
+
+
+def build_config(driver):
+    return MagicMock(**{
+        "db.driver": driver,
+        "db.user": "postgres",
+        "db.password": "postgres",
+        "db.host": "localhost",
+        "db.port": 5432,
+        "db.database": "postgres",
+        "db.pool_size": 3,
+        "db.max_overflow": 1,
+        "db.pool_timeout": 0.1,
+        "db.pool_recycle": 60,
+    })
+
+
+def test_when_building_sync_engine_expect_sized_timed_pool():
+    pool = build_engine(build_config("postgresql")).pool
+    assert isinstance(pool, TimedQueuePool)
+    assert pool.size() == 3
+    assert pool.timeout() == 0.1
+
+
+def test_when_building_async_engine_expect_sized_timed_pool():
+    pool = build_engine(build_config("postgresql+asyncpg")).pool
+    assert isinstance(pool, TimedAsyncQueuePool)
+    assert pool.size() == 3
+
+
+def test_when_pool_is_exhausted_expect_timeout_counted():
+    sqlite_engine = create_engine(
+        "sqlite:///./tests/test.db",
+        poolclass=TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.01,
+    )
+    checkouts = POOL_STATS.checkouts
+    timeouts = POOL_STATS.timeouts
+    with sqlite_engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            sqlite_engine.connect()
+    assert POOL_STATS.checkouts == checkouts + 2
+    assert POOL_STATS.timeouts == timeouts + 1
+    assert POOL_STATS.stats()["wait_max"] >= 0.01
+    sqlite_engine.dispose()
+
+
+def test_when_running_with_sync_session_expect_direct_call():
+    function = MagicMock(return_value="banana")
+    session = Session()
+    assert asyncio.run(run(session, function, 1, a=2)) == "banana"
+    function.assert_called_once_with(session, 1, a=2)
+
+
+def test_when_running_with_async_session_expect_queries_work(async_db):
+    async def create_and_list():
+        async with ASYNC_SESSION() as session:
+            assert isinstance(session, AsyncSession)
+            dto = AdminCreationDTO(
+                username="admin", password="secret", email="a@b.c"
+            )
+            await run(session, create_admin, dto)
+            return await run(session, get_all)
+
+    admins = asyncio.run(create_and_list())
+    assert [admin.email for admin in admins] == ["a@b.c"]
+
+
+def test_when_admin_email_is_taken_in_other_case_expect_400(async_db):
+    async def create_twice():
+        async with ASYNC_SESSION() as session:
+            await run(session, create_admin, AdminCreationDTO(
+                username="admin", password="secret", email="a@b.c"
+            ))
+            await run(session, create_admin, AdminCreationDTO(
+                username="other", password="secret", email="A@B.C"
+            ))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(create_twice())
+    assert error.value.status_code == 400
+
+
+@patch('users.main.create_wallet')
+@patch('users.main.add_user_firebase')
+@patch('users.main.save_location', AsyncMock())
+def test_when_using_async_session_expect_users_stored(add_mock,
+                                                      create_wallet,
+                                                      async_db):
+    add_mock.return_value = None
+    create_wallet.side_effect = new_wallet
+    response = client.post("users", json=user_1)
+    assert response.status_code == 200, response.json()
+    response = client.get("users")
+    assert response.status_code == 200
+    assert equal_dicts(response.json()["items"][0], user_1,
+                       {"id", "password", "is_blocked"})
@@ -0,0 +1,69 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+import csv
+import json
+from datetime import datetime
+from unittest.mock import patch
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from tests.testing_util import async_ledger
+from users.export import export_transactions
+from users.ledger import archive
+
+TODAY = datetime(2023, 4, 15)
+
+
+# pylint: disable=too-many-arguments
+def export(engine, directory, export_format="ndjson", address=None,
+           minimum=0, since=None, until=None):
+    with sessionmaker(bind=engine)() as session:
+        return "".join(export_transactions(
+            session, directory, address, minimum, since, until, export_format
+        ))
+
+
+def test_when_exporting_ndjson_expect_one_object_per_line(ledger, tmp_path):
+    lines = export(ledger, str(tmp_path)).splitlines()
+    assert len(lines) == 8
+    assert json.loads(lines[0]) == {
+        "id": 1, "sender": "0x2", "receiver": "0x3", "amount": 0.0,
+        "date": "2023-01-01T00:00:00",
+    }
+
+
+def test_when_exporting_csv_expect_header_and_filtered_rows(ledger,
+                                                            tmp_path):
+    rows = list(csv.DictReader(export(
+        ledger, str(tmp_path), "csv", "0x1", 2, datetime(2023, 1, 20),
+        datetime(2023, 4, 1),
+    ).splitlines()))
+    assert [row["amount"] for row in rows] == ["3.0", "5.0"]
+    assert rows[0]["date"] == "2023-02-15T00:00:00"
+
+
+@patch("users.export.BATCH_SIZE", 3)
+def test_when_since_is_archived_expect_archive_then_database(ledger,
+                                                             tmp_path):
+    directory = str(tmp_path)
+    asyncio.run(archive(ledger, directory, 1, TODAY))
+    lines = export(ledger, directory, since=datetime(2023, 1, 10))
+    assert [json.loads(line)["amount"] for line in lines.splitlines()] == \
+        [1, 2, 3, 4, 5, 6, 7]
+    assert len(export(ledger, directory).splitlines()) == 4
+
+
+def test_when_exporting_with_async_session_expect_same_rows(tmp_path):
+    async def export_async():
+        engine = await async_ledger()
+        async with AsyncSession(engine) as session:
+            chunks = [chunk async for chunk in export_transactions(
+                session, str(tmp_path), "0x1", 0, None, None, "csv"
+            )]
+        await engine.dispose()
+        return "".join(chunks)
+
+    rows = list(csv.DictReader(asyncio.run(export_async()).splitlines()))
+    assert [row["amount"] for row in rows] == ["1.0", "3.0", "5.0", "7.0"]
@@ -5,13 +5,14 @@ from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
-from tests.testing_util import test_wallet_1, user_1, \
+from tests.testing_util import new_wallet, user_1, \
     user_2, user_3, equal_dicts
+from users.crud import get_followers, get_users_followed_by
 from users.main import app, get_db
-from users.models import Base
+from users.models import Base, FollowedUsers, Users
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./tests/test.db"
 
@@ -62,15 +63,18 @@ def test_followed_users_get_updated_correctly(save_mock,
                                               test_db):
     add_mock.return_value = None
     save_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet_1
+    create_wallet_mock.side_effect = new_wallet
     client.post("users", json=user_1)
     client.post("users", json=user_2)
     client.post("users", json=user_3)
     get_creds_mock.return_value = {"id": 1, "role": "user"}
     client.post("users/1/followed/2")
     post_response = client.post("users/1/followed/3")
+    assert post_response.json() == \
+        {"id": 1, "followed_id": 3, "following": True}
     get_response = client.get("users/1/followed")
-    assert post_response.json() == get_response.json()
+    assert [user["id"] for user in get_response.json()["items"]] == [2, 3]
+    assert get_response.json()["total"] == 2
 
 
 @patch('users.main.get_credentials')
@@ -84,7 +88,7 @@ def test_followers_get_updated_correctly(save_mock,
                                          test_db):
     add_mock.return_value = None
     save_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet_1
+    create_wallet_mock.side_effect = new_wallet
     client.post("users", json=user_1)
     client.post("users", json=user_2)
     client.post("users", json=user_3)
@@ -93,9 +97,9 @@ def test_followers_get_updated_correctly(save_mock,
     get_creds_mock.return_value = {"id": 3, "role": "user"}
     client.post("users/3/followed/2")
     get_response = client.get("users/2/followers")
-    assert equal_dicts(get_response.json()[0],
+    assert equal_dicts(get_response.json()["items"][0],
                        user_1, {"id", "password", "is_blocked"})
-    assert equal_dicts(get_response.json()[1],
+    assert equal_dicts(get_response.json()["items"][1],
                        user_3, {"id", "password", "is_blocked"})
 
 
@@ -110,7 +114,7 @@ def test_deleted_followers_get_updated_correctly(save_mock,
                                                  test_db):
     add_mock.return_value = None
     save_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet_1
+    create_wallet_mock.side_effect = new_wallet
     client.post("users", json=user_1)
     client.post("users", json=user_2)
     client.post("users", json=user_3)
@@ -122,10 +126,77 @@ def test_deleted_followers_get_updated_correctly(save_mock,
     post_response = client.post("users/2/followed/3")
     get_creds_mock.return_value = {"id": 2, "role": "user"}
     assert len(post_response.json()) == 1
-    client.delete("users/2/followed/3")
+    response = client.delete("users/2/followed/3")
+    assert response.json() == \
+        {"id": 2, "followed_id": 3, "following": False}
     get_creds_mock.return_value = {"id": 3, "role": "user"}
     response = client.get("users/3/followers")
-    assert len(response.json()) == 0
+    assert len(response.json()["items"]) == 0
     get_creds_mock.return_value = {"id": 2, "role": "user"}
     response = client.get("users/2/followed")
-    assert len(response.json()) == 0
+    assert len(response.json()["items"]) == 0
+
+
+@pytest.fixture
+def many_followers(test_db):
+    with TestingSessionLocal() as database:
+        database.add_all(
+            Users(email=f"user_{idx}", username=f"user_{idx}")
+            for idx in range(1, 52)
+        )
+        database.add_all(
+            FollowedUsers(id=idx, followed_id=1) for idx in range(2, 52)
+        )
+        database.add_all(
+            FollowedUsers(id=1, followed_id=idx) for idx in range(2, 52)
+        )
+        database.commit()
+        yield database
+
+
+def count_queries(function, *args, **kwargs):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        result = function(*args, **kwargs)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return result, len(statements)
+
+
+def test_listing_followers_runs_constant_queries(many_followers):
+    page, queries = count_queries(get_followers, many_followers, 1,
+                                  limit=100, count="none")
+    assert len(page["items"]) == 50
+    assert queries == 1
+    page, queries = count_queries(get_users_followed_by, many_followers, 1,
+                                  limit=100)
+    assert page["total"] == 50
+    assert queries == 2
+
+
+def test_followers_are_paged_by_cursor(many_followers):
+    page = get_followers(many_followers, 1, limit=20)
+    seen = [user.id for user in page["items"]]
+    while page["next_cursor"]:
+        page = get_followers(many_followers, 1, 20, page["next_cursor"])
+        seen.extend(user.id for user in page["items"])
+    assert seen == list(range(2, 52))
+
+
+def test_followed_projection_returns_requested_columns(many_followers):
+    response = client.get("users/1/followed",
+                          params={"fields": ["username"], "limit": 2})
+    assert response.json()["items"] == [
+        {"id": 2, "username": "user_2"},
+        {"id": 3, "username": "user_3"},
+    ]
+
+
+def test_followed_projection_rejects_unknown_columns(many_followers):
+    response = client.get("users/1/followed", params={"fields": ["nope"]})
+    assert response.status_code == 400
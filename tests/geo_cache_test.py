@@ -0,0 +1,96 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import time
+
+from users.geo_cache import GeoCache
+from users.geo_index import distance_m
+
+LOCATION = (-58.3816, -34.6037)
+
+
+def trainers(*user_ids):
+    return [(user_id, LOCATION) for user_id in user_ids]
+
+
+def test_when_close_searches_expect_same_area():
+    cache = GeoCache(0.005, 250, 100, 30)
+    assert cache.search_area(LOCATION, 1000) == \
+        cache.search_area((LOCATION[0] + 0.0001, LOCATION[1] - 0.0001), 900)
+
+
+def test_when_searching_expect_area_covering_whole_cell():
+    cache = GeoCache(0.005, 250, 100, 30)
+    center, radius = cache.search_area(LOCATION, 1001)
+    assert abs(center[0] - LOCATION[0]) <= 0.0025
+    assert abs(center[1] - LOCATION[1]) <= 0.0025
+    corner = (center[0] - 0.0025, center[1] - 0.0025)
+    assert radius >= 1250 + distance_m(center, corner)
+    assert radius < 1250 + 400
+
+
+def test_when_disabled_expect_exact_search_area():
+    cache = GeoCache(0.005, 250, 0, 30)
+    assert cache.search_area(LOCATION, 1001) == (LOCATION, 1001)
+    cache.set(cache.search_area(LOCATION, 1001), trainers())
+    assert cache.get(cache.search_area(LOCATION, 1001)) is None
+
+
+def test_when_trainer_moves_into_area_expect_invalidated():
+    cache = GeoCache(0.005, 250, 100, 30)
+    area = cache.search_area(LOCATION, 1000)
+    cache.set(area, trainers(1, 2))
+    cache.invalidate(3, None, (LOCATION[0] + 0.001, LOCATION[1]))
+    assert cache.get(area) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_when_held_trainer_moves_away_expect_invalidated():
+    cache = GeoCache(0.005, 250, 100, 30)
+    area = cache.search_area(LOCATION, 1000)
+    cache.set(area, trainers(1, 2))
+    cache.invalidate(2, None, (0.0, 0.0))
+    assert cache.get(area) is None
+
+
+def test_when_trainer_moves_far_away_expect_kept():
+    cache = GeoCache(0.005, 250, 100, 30)
+    area = cache.search_area(LOCATION, 1000)
+    cache.set(area, trainers(1, 2))
+    cache.invalidate(3, (1.0, 1.0), (0.0, 0.0))
+    assert cache.get(area) == trainers(1, 2)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["invalidations"] == 0
+
+
+def test_when_entries_leave_expect_reverse_indexes_emptied():
+    cache = GeoCache(0.005, 250, 1, 30)
+    cache.set(cache.search_area(LOCATION, 1000), trainers(1, 2))
+    cache.set(cache.search_area((0.0, 0.0), 1000), trainers(3))
+    assert set(cache.holding) == {3}
+    cache.invalidate(3, None)
+    assert not cache.holding and not cache.cells
+
+
+def test_when_area_is_crowded_expect_cached_as_none():
+    cache = GeoCache(0.005, 250, 100, 30, max_trainers=1)
+    area = cache.search_area(LOCATION, 1000)
+    cache.set(area, None)
+    assert cache.get(area, "missing") is None
+    cache.invalidate(7, LOCATION)
+    assert cache.get(area, "missing") == "missing"
+
+
+def test_when_cache_is_full_expect_invalidation_only_near_trainer():
+    cache = GeoCache(0.005, 250, 10000, 30)
+    for idx in range(10000):
+        location = (-58 + idx % 100 * 0.01, -34 + idx // 100 * 0.01)
+        cache.set(cache.search_area(location, 1000),
+                  [(idx * 200 + trainer, location) for trainer in range(200)])
+    points = [(-58.0, -34.0), (-57.0, -33.0)]
+    expected = {area for area, (_, held) in cache.results.entries.items()
+                if any(distance_m(area[0], point) <= area[1]
+                       for point in points) or (10, held[0][1]) in held}
+    start = time.perf_counter()
+    cache.invalidate(10, *points)
+    assert time.perf_counter() - start < 0.02
+    assert cache.stats()["invalidations"] == len(expected) == 3
+    assert not expected & set(cache.results.entries)
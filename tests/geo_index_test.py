@@ -0,0 +1,105 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+
+from users.geo_index import GeoIndex, distance_m
+from users.pagination import decode_values
+
+# Obelisco, Buenos Aires.
+CENTER = (-58.3816, -34.6037)
+# About 111m north for every step.
+STEP = 0.001
+
+
+@pytest.fixture
+def trainers():
+    geo_index = GeoIndex(0.01)
+    geo_index.load(
+        (idx, (CENTER[0], CENTER[1] + idx * STEP)) for idx in range(1, 21)
+    )
+    return geo_index
+
+
+def test_when_measuring_one_thousandth_of_degree_expect_about_111m():
+    assert 110 < distance_m(CENTER, (CENTER[0], CENTER[1] + STEP)) < 112
+
+
+def test_when_searching_expect_users_in_radius_closest_first(trainers):
+    page = trainers.within(CENTER, 950, 20, 0)
+    assert [item["user_id"] for item in page["items"]] == list(range(1, 9))
+    assert page["total"] == 8
+    assert page["next_cursor"] is None
+
+
+def test_when_searching_across_cells_expect_every_user(trainers):
+    page = trainers.within((CENTER[0], CENTER[1] + 0.01), 2500, 30, 0)
+    assert page["total"] == 20
+
+
+def test_when_paging_by_offset_expect_next_users(trainers):
+    page = trainers.within(CENTER, 950, 3, 3)
+    assert [item["user_id"] for item in page["items"]] == [4, 5, 6]
+    assert decode_values(page["next_cursor"], 2)[1] == 6
+
+
+def test_when_following_cursor_expect_every_user_once(trainers):
+    page = trainers.within(CENTER, 950, 3, 0, with_total=False)
+    seen = [item["user_id"] for item in page["items"]]
+    while page["next_cursor"]:
+        page = trainers.within(CENTER, 950, 3, 0, page["next_cursor"],
+                               False)
+        seen.extend(item["user_id"] for item in page["items"])
+    assert seen == list(range(1, 9))
+    assert page["total"] is None
+
+
+def test_when_moving_user_expect_found_in_new_place(trainers):
+    moved = (CENTER[0] + 1, CENTER[1])
+    trainers.set(1, moved)
+    page = trainers.within(CENTER, 1000, 20, 0)
+    assert 1 not in [item["user_id"] for item in page["items"]]
+    assert trainers.within(moved, 10, 20, 0)["total"] == 1
+    assert len(trainers) == 20
+
+
+def test_when_removing_user_expect_cell_dropped():
+    geo_index = GeoIndex(0.01)
+    geo_index.set(1, CENTER)
+    geo_index.remove(1)
+    geo_index.remove(2)
+    assert not geo_index.cells
+    assert not geo_index.points
+
+
+def test_when_started_expect_loaded_from_loader():
+    async def start_and_stop():
+        geo_index = GeoIndex(0.01)
+        loader = AsyncMock(return_value=[(1, CENTER)])
+        geo_index.start(loader)
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await geo_index.stop()
+        return geo_index
+
+    geo_index = asyncio.run(start_and_stop())
+    assert geo_index.ready
+    assert geo_index.within(CENTER, 10, 10, 0)["total"] == 1
+
+
+def test_when_getting_users_around_expect_points_in_radius(trainers):
+    assert sorted(trainers.around(CENTER, 350)) == [
+        (idx, (CENTER[0], CENTER[1] + idx * STEP)) for idx in range(1, 4)
+    ]
+
+
+def test_when_radius_spans_more_cells_than_populated_expect_same_users(
+    trainers
+):
+    start = time.perf_counter()
+    page = trainers.within(CENTER, 5_000_000, 30, 0)
+    assert time.perf_counter() - start < 0.1
+    assert [item["user_id"] for item in page["items"]] == list(range(1, 21))
@@ -6,7 +6,7 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from tests.testing_util import test_wallet, idp_user_1, idp_user_2, equal_dicts
+from tests.testing_util import new_wallet, idp_user_1, idp_user_2, equal_dicts
 
 from users.main import app, get_db
 from users.models import Base
@@ -50,7 +50,7 @@ def test_can_create_idp_user(validate_idp_mock,
                              create_wallet_mock, test_db):
     user = idp_user_1
     validate_idp_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet
+    create_wallet_mock.side_effect = new_wallet
     response = client.post("users/usersIDP", json=user)
     assert response.status_code == 200
     assert equal_dicts(response.json(), user, ignored_keys)
@@ -62,7 +62,7 @@ def test_cant_create_two_users_with_same_username(validate_idp_mock,
                                                   create_wallet_mock, test_db):
     user1 = idp_user_1
     validate_idp_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet
+    create_wallet_mock.side_effect = new_wallet
     client.post("users/usersIDP", json=user1)
     user2 = idp_user_2
     user2["username"] = "jorgitogroso"
@@ -78,7 +78,7 @@ def test_cant_create_two_users_with_same_email(validate_idp_mock,
                                                create_wallet_mock, test_db):
     user1 = idp_user_1
     validate_idp_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet
+    create_wallet_mock.side_effect = new_wallet
     client.post("users/usersIDP", json=user1)
     user2 = idp_user_2
     user2["email"] = "jorgitodd@asddbcdd.com"
@@ -88,6 +88,41 @@ def test_cant_create_two_users_with_same_email(validate_idp_mock,
     assert response.json() == error_msg
 
 
+@patch('users.main.create_wallet')
+@patch('users.main.validate_idp_token')
+def test_cant_create_two_users_with_same_email_in_other_case(
+    validate_idp_mock, create_wallet_mock, test_db
+):
+    validate_idp_mock.return_value = None
+    create_wallet_mock.side_effect = new_wallet
+    client.post("users/usersIDP", json=idp_user_1)
+    response = client.post("users/usersIDP", json=idp_user_2 | {
+        "email": idp_user_1["email"].upper()
+    })
+    assert response.status_code == 400
+    assert response.json() == {
+        'detail': 'User with that email already present'
+    }
+
+
+@patch('users.main.find_conflict')
+@patch('users.main.create_wallet')
+@patch('users.main.validate_idp_token')
+def test_when_user_is_created_concurrently_expect_400(validate_idp_mock,
+                                                      create_wallet_mock,
+                                                      find_conflict_mock,
+                                                      test_db):
+    validate_idp_mock.return_value = None
+    create_wallet_mock.side_effect = new_wallet
+    find_conflict_mock.return_value = None
+    client.post("users/usersIDP", json=idp_user_1)
+    response = client.post("users/usersIDP", json=idp_user_1)
+    assert response.status_code == 400
+    assert response.json() == {
+        'detail': 'User with that email or username already present'
+    }
+
+
 @patch('users.main.validate_idp_token')
 def test_cant_log_in_if_theres_no_user_with_that_email(validate_idp_mock,
                                                        test_db):
@@ -109,7 +144,7 @@ def test_log_in_returns_token_if_user_exists_and_had_valid_token(
         test_db):
     user1 = idp_user_1
     validate_idp_mock.return_value = None
-    create_wallet_mock.return_value = test_wallet
+    create_wallet_mock.side_effect = new_wallet
     client.post("users/usersIDP", json=user1)
     body = {"email": "jorgitodd@asddbcdd.com"}
     get_token_mock.return_value = "token"
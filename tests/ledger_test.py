@@ -0,0 +1,151 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from tests.testing_util import async_ledger
+from users.ledger import PartitionKeeper, add_months, archive, \
+    archive_boundary, create_partitions, list_transactions, month_start, \
+    naive_utc, read_archive, read_month
+from users.models import Transactions
+from users.pagination import NO_TOTAL
+
+TODAY = datetime(2023, 4, 15)
+
+
+def amounts(page):
+    return [item.amount for item in page["items"]]
+
+
+def test_when_adding_months_expect_start_of_month():
+    assert month_start(datetime(2023, 2, 14, 10)) == datetime(2023, 2, 1)
+    assert add_months(datetime(2023, 11, 1), 2) == datetime(2024, 1, 1)
+    assert add_months(datetime(2023, 1, 1), -1) == datetime(2022, 12, 1)
+
+
+def test_when_dates_have_an_offset_expect_naive_utc():
+    assert naive_utc(None) is None
+    assert naive_utc(datetime(2023, 1, 5)) == datetime(2023, 1, 5)
+    assert naive_utc(datetime(2023, 1, 5, tzinfo=timezone(
+        timedelta(hours=-3)
+    ))) == datetime(2023, 1, 5, 3)
+
+
+def test_when_creating_partitions_expect_rows_moved_out_of_default():
+    connection = MagicMock()
+    # November has a partition already.
+    connection.execute.return_value.scalar.side_effect = [
+        "transactions_2023_11", None, None,
+    ]
+    create_partitions(connection, datetime(2023, 11, 5), datetime(2024, 1, 1))
+    statements = [str(call.args[0])
+                  for call in connection.execute.call_args_list]
+    assert len(statements) == 3 + 2 * 4
+    assert statements[2:6] == [
+        "ALTER TABLE transactions DETACH PARTITION transactions_default",
+        "CREATE TABLE IF NOT EXISTS transactions_2023_12 PARTITION OF "
+        "transactions FOR VALUES FROM ('2023-12-01') TO ('2024-01-01')",
+        "WITH moved AS (DELETE FROM transactions_default WHERE "
+        "date >= '2023-12-01' AND date < '2024-01-01' RETURNING id, sender, "
+        "receiver, amount, date) INSERT INTO transactions (id, sender, "
+        "receiver, amount, date) SELECT id, sender, receiver, amount, date "
+        "FROM moved",
+        "ALTER TABLE transactions ATTACH PARTITION transactions_default "
+        "DEFAULT",
+    ]
+    assert "transactions_2024_01" in statements[8]
+
+
+@patch("users.ledger.asyncio.sleep")
+@patch("users.ledger.add_partitions")
+def test_when_adding_partitions_fails_expect_kept_trying(add, sleep):
+    sleep.side_effect = [None, None, asyncio.CancelledError()]
+    add.side_effect = [RuntimeError("database down"), None]
+    keeper = PartitionKeeper(3600)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(keeper.keep_forever(MagicMock()))
+    assert add.await_count == 2
+    sleep.assert_called_with(3600)
+
+
+def test_when_archiving_expect_closed_months_moved_to_files(ledger, tmp_path):
+    archived = asyncio.run(archive(ledger, str(tmp_path), 2, TODAY))
+    assert archived == {"2023-01": 3}
+    assert asyncio.run(archive(ledger, str(tmp_path), 2, TODAY)) == {}
+    assert archive_boundary(str(tmp_path)) == datetime(2023, 2, 1)
+    assert [row.amount for row in read_archive(
+        str(tmp_path), datetime(2023, 1, 1)
+    )] == [0, 1, 2]
+    with sessionmaker(bind=ledger)() as session:
+        assert session.query(Transactions).count() == 5
+
+
+def test_when_since_is_archived_expect_archive_then_database(ledger,
+                                                             tmp_path):
+    directory = str(tmp_path)
+    asyncio.run(archive(ledger, directory, 1, TODAY))
+    since = datetime(2023, 1, 10)
+    with sessionmaker(bind=ledger)() as session:
+        for newest_first, expected in ((False, [1, 2, 3, 4, 5, 6, 7]),
+                                       (True, [7, 6, 5, 4, 3, 2, 1])):
+            page = asyncio.run(list_transactions(
+                session, directory, None, 0, 3, 0, since=since,
+                newest_first=newest_first,
+            ))
+            assert page["total"] == 7
+            seen = amounts(page)
+            while page["next_cursor"]:
+                page = asyncio.run(list_transactions(
+                    session, directory, None, 0, 3, 0, page["next_cursor"],
+                    NO_TOTAL, since, newest_first=newest_first,
+                ))
+                seen.extend(amounts(page))
+            assert seen == expected
+
+
+def test_when_filtering_archived_listing_expect_same_filters(
+    ledger, tmp_path
+):
+    directory = str(tmp_path)
+    asyncio.run(archive(ledger, directory, 1, TODAY))
+    with sessionmaker(bind=ledger)() as session:
+        page = asyncio.run(list_transactions(
+            session, directory, "0x1", 2, 2, 1, since=datetime(2023, 1, 1),
+            until=datetime(2023, 4, 1),
+        ))
+    assert amounts(page) == [5]
+    assert page["total"] == 2
+    assert page["page"] == 2
+
+
+def test_when_listing_with_async_session_expect_files_read_off_loop(
+    tmp_path
+):
+    directory = str(tmp_path)
+    threads = set()
+
+    def record_thread(path):
+        threads.add(threading.current_thread())
+        return read_month(path)
+
+    async def list_async():
+        engine = await async_ledger()
+        await archive(engine, directory, 1, TODAY)
+        async with AsyncSession(engine) as session:
+            with patch("users.ledger.read_month", record_thread):
+                page = await list_transactions(session, directory, None, 0,
+                                               3, 2,
+                                               since=datetime(2023, 1, 10))
+        await engine.dispose()
+        return page
+
+    page = asyncio.run(list_async())
+    assert amounts(page) == [3, 4, 5]
+    assert page["total"] == 7
+    assert threads and threading.main_thread() not in threads
@@ -1,45 +1,106 @@
 # pylint: disable= missing-module-docstring, missing-function-docstring
-from unittest.mock import ANY, MagicMock, patch
+import asyncio
+from unittest.mock import MagicMock, patch
 from fastapi import HTTPException
 
 from pytest import raises
-from users.location_helper import get_coordinates, get_user_ids, save_location
+from users.geo_cache import GeoCache
+from users.location_helper import LOCATION_RELAY, get_coordinates, \
+    get_user_ids, index_serves, nearby_page, outbox_coordinates, \
+    save_location
+from users.models import Users
 
 
-@patch("users.location_helper.edit_location")
-@patch("users.location_helper.get_mongodb_connection")
+@patch("users.location_helper.LOCATION_RELAY")
+@patch("users.location_helper.set_location")
 def test_when_saving_location_for_athlete_expect_no_call(
-    mock_get_mongodb_connection: MagicMock,
-    mock_edit_location: MagicMock,
+    mock_set_location: MagicMock,
+    mock_relay: MagicMock,
 ):
-    config = MagicMock(**{"mongo.enabled": True})
-    save_location("url", True, 1, (1.1, 1.2), config)
-    mock_get_mongodb_connection.assert_not_called()
-    mock_edit_location.assert_not_called()
+    config = MagicMock(**{"mongo.enabled": True, "geo.index": False})
+    asyncio.run(save_location(MagicMock(), True, 1, (1.1, 1.2), config))
+    mock_set_location.assert_not_called()
+    mock_relay.wanted.set.assert_not_called()
 
 
-@patch("users.location_helper.edit_location")
-@patch("users.location_helper.get_mongodb_connection")
-def test_when_saving_location_for_trainer_expect_call(
-    mock_get_mongodb_connection: MagicMock,
-    mock_edit_location: MagicMock,
+@patch("users.location_helper.LOCATION_RELAY")
+@patch("users.location_helper.set_location")
+def test_when_saving_location_for_trainer_expect_relay_woken(
+    mock_set_location: MagicMock,
+    mock_relay: MagicMock,
 ):
-    config = MagicMock(**{"mongo.enabled": True})
-    save_location("url", False, 1, (1.1, 1.2), config)
-    mock_get_mongodb_connection.assert_called_once_with("url")
-    mock_edit_location.assert_called_once_with(ANY, 1, (1.1, 1.2))
+    config = MagicMock(**{"mongo.enabled": True, "geo.index": False})
+    asyncio.run(save_location(MagicMock(), False, 1, (1.1, 1.2), config))
+    mock_set_location.assert_not_called()
+    mock_relay.wanted.set.assert_called_once_with()
+
+
+@patch("users.location_helper.GEO_INDEX")
+@patch("users.location_helper.set_location")
+@patch("users.location_helper.LOCATION_RELAY")
+def test_when_coordinates_disabled_expect_saved_in_db_and_index(
+    mock_relay: MagicMock,
+    mock_set_location: MagicMock,
+    mock_geo_index: MagicMock,
+):
+    config = MagicMock(**{"mongo.enabled": False})
+    session = MagicMock()
+    asyncio.run(save_location(session, False, 1, (1.1, 1.2), config))
+    mock_relay.wanted.set.assert_not_called()
+    mock_set_location.assert_called_once_with(session, 1, (1.1, 1.2))
+    mock_geo_index.set.assert_called_once_with(1, (1.1, 1.2))
+
+
+@patch("users.location_helper.GEO_INDEX")
+@patch("users.location_helper.LOCATION_RELAY")
+def test_when_index_in_front_of_mongo_expect_both_updated(
+    mock_relay: MagicMock,
+    mock_geo_index: MagicMock,
+):
+    config = MagicMock(**{"mongo.enabled": True, "geo.index": True})
+    asyncio.run(save_location(MagicMock(), False, 1, (1.1, 1.2), config))
+    mock_relay.wanted.set.assert_called_once_with()
+    mock_geo_index.set.assert_called_once_with(1, (1.1, 1.2))
 
 
-@patch("users.location_helper.edit_location")
-@patch("users.location_helper.get_mongodb_connection")
-def test_when_coordinates_disabled_expect_false(
-    mock_get_mongodb_connection: MagicMock,
-    mock_edit_location: MagicMock,
+@patch("users.location_helper.GEO_INDEX")
+def test_when_relay_sent_locations_expect_searches_dropped_again(
+    mock_index: MagicMock,
 ):
-    config = MagicMock(**{"mongo.enabled": False})
-    save_location("url", False, 1, (1.1, 1.2), config)
-    mock_get_mongodb_connection.assert_not_called()
-    mock_edit_location.assert_not_called()
+    cache = GeoCache(0.005, 250, 100, 30)
+    # Cached by a search made before MongoDB took the new location.
+    cache.set(cache.search_area((1.1, 1.2), 1000), [(1, (5.0, 5.0))])
+    cache.set(cache.search_area((5.0, 5.0), 1000), [(1, (5.0, 5.0))])
+    with patch("users.location_helper.GEO_CACHE", cache):
+        LOCATION_RELAY.on_sent([(1, (1.1, 1.2))])
+    assert len(cache.results) == 0
+    mock_index.set.assert_not_called()
+
+
+@patch("users.location_helper.LOCATION_RELAY")
+def test_when_trainer_has_no_coordinates_expect_no_call(
+    mock_relay: MagicMock,
+):
+    config = MagicMock(**{"mongo.enabled": True, "geo.index": False})
+    asyncio.run(save_location(MagicMock(), False, 1, None, config))
+    mock_relay.wanted.set.assert_not_called()
+
+
+def test_when_queueing_coordinates_expect_only_trainers_with_mongo():
+    mongo = MagicMock(**{"mongo.enabled": True})
+    assert outbox_coordinates(False, (1.1, 1.2), mongo) == (1.1, 1.2)
+    assert outbox_coordinates(True, (1.1, 1.2), mongo) is None
+    assert outbox_coordinates(False, None, mongo) is None
+    assert outbox_coordinates(
+        False, (1.1, 1.2), MagicMock(**{"mongo.enabled": False})
+    ) is None
+
+
+@patch("users.location_helper.GEO_INDEX", MagicMock(ready=False))
+def test_when_index_not_loaded_expect_mongo_serves():
+    assert not index_serves(MagicMock(**{"mongo.enabled": True,
+                                         "geo.index": True}))
+    assert index_serves(MagicMock(**{"mongo.enabled": False}))
 
 
 def test_when_coordinates_are_none_expect_none():
@@ -66,3 +127,19 @@ def test_when_list_has_documents_expect_list_of_ids():
 
 def test_when_list_is_empty_expect_empty_list():
     assert not get_user_ids([])
+
+
+def test_when_building_nearby_page_expect_distances_in_order():
+    nearby = {
+        "items": [{"user_id": 2, "distance": 1.5},
+                  {"user_id": 1, "distance": 8.0}],
+        "total": 5,
+        "next_cursor": "next",
+    }
+    users = [Users(id=2, username="two"), Users(id=1, username="one")]
+    page = nearby_page(nearby, users, 2, 2)
+    assert [(user["username"], user["distance_m"])
+            for user in page["items"]] == [("two", 1.5), ("one", 8.0)]
+    assert page["page"] == 2
+    assert page["pages"] == 3
+    assert page["next_cursor"] == "next"
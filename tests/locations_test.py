@@ -0,0 +1,70 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from users.locations import LocationCatalog
+from users.schemas import Location
+
+BANANA = Location(location="banana", coordinates=(-58.4, -34.6))
+
+
+def test_when_loading_expect_validated_locations(tmp_path):
+    path = tmp_path / "locations.json"
+    path.write_text(json.dumps([{"location": "banana",
+                                 "coordinates": [-58.4, -34.6]}]))
+    catalog = LocationCatalog.load(str(path), 60)
+    assert catalog.locations == [BANANA]
+    assert json.loads(catalog.body) == [
+        {"location": "banana", "coordinates": [-58.4, -34.6]}
+    ]
+
+
+def test_when_loading_invalid_location_expect_error(tmp_path):
+    path = tmp_path / "locations.json"
+    path.write_text(json.dumps([{"location": "banana"}]))
+    with pytest.raises(ValidationError):
+        LocationCatalog.load(str(path), 60)
+
+
+def test_when_catalog_changes_expect_new_etag():
+    tomato = Location(location="tomato", coordinates=(-58.5, -34.6))
+    assert LocationCatalog([BANANA], 60).etag != \
+        LocationCatalog([BANANA, tomato], 60).etag
+
+
+def test_when_client_has_catalog_expect_not_modified():
+    catalog = LocationCatalog([BANANA], 60)
+    for header in (catalog.etag, f'"tomato", W/{catalog.etag}', "*"):
+        response = catalog.response(header)
+        assert response.status_code == 304
+        assert response.body == b""
+        assert response.headers["cache-control"] == "public, max-age=60"
+
+
+def test_when_client_has_no_catalog_expect_body():
+    catalog = LocationCatalog([BANANA], 60)
+    response = catalog.response(None)
+    assert response.status_code == 200
+    assert response.body == catalog.body
+    assert response.headers["etag"] == catalog.etag
+
+
+def test_when_finding_nearest_expect_closest_location_and_distance():
+    tomato = Location(location="tomato", coordinates=(-58.5, -34.6))
+    catalog = LocationCatalog([BANANA, tomato], 60)
+    location, distance = catalog.nearest((-58.49, -34.6))
+    assert location == tomato
+    assert 900 < distance < 925
+
+
+def test_when_catalog_is_empty_expect_no_nearest():
+    assert LocationCatalog([], 60).nearest((-58.4, -34.6)) is None
+
+
+def test_when_coordinates_are_far_expect_location_kept():
+    catalog = LocationCatalog([BANANA], 60)
+    assert catalog.normalize("Tomato", (-58.41, -34.6), 1000) == "banana"
+    assert catalog.normalize("Tomato", (-60.0, -34.6), 1000) == "Tomato"
+    assert catalog.normalize("Tomato", None, 1000) == "Tomato"
@@ -1,57 +1,143 @@
 # pylint: disable= missing-module-docstring, missing-function-docstring
-from unittest.mock import ANY, MagicMock, patch
+import asyncio
+from ast import literal_eval
+from unittest.mock import MagicMock, patch
 
-from users.metrics import get_redis_connection, queue
+import pytest
+from fakeredis import FakeAsyncRedis
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from users.metrics import MetricsFlusher, get_redis_connection, queue
+
+
+def build_flusher(client=None, batch_size=100, buffer_size=10):
+    return MetricsFlusher(client or FakeAsyncRedis(), 0.01, batch_size,
+                          buffer_size)
+
+
+async def read_messages(client):
+    return [literal_eval(message.decode())
+            for message in await client.lrange("metrics", 0, -1)]
 
 
-@patch("users.metrics.BlockingConnectionPool")
 @patch("users.metrics.Redis")
-def test_when_creating_connection_expect_parameters(
-    redis_mock: MagicMock,
-    blocking_connection_pool_mock: MagicMock,
-):
-    expected_pool = MagicMock()
-    blocking_connection_pool_mock.return_value = expected_pool
+def test_when_creating_connection_expect_parameters(redis_mock: MagicMock):
     expected_client = MagicMock()
     redis_mock.return_value = expected_client
-    assert get_redis_connection(
-        MagicMock(**{"redis.host": "localhost", "redis.port": 6379})
-    ) == expected_client
-    blocking_connection_pool_mock.assert_called_once_with(
-        host='localhost', port=6379, db=0, timeout=10
+    assert get_redis_connection(MagicMock(**{
+        "redis.host": "localhost", "redis.port": 6379, "redis.timeout": 2.0
+    })) == expected_client
+    redis_mock.assert_called_once_with(
+        host='localhost', port=6379, db=0, socket_timeout=2.0,
+        socket_connect_timeout=2.0
     )
-    redis_mock.assert_called_once_with(connection_pool=expected_pool)
 
 
-@patch("users.metrics.get_redis_connection")
-def test_when_name_and_label_are_defined_expect_them_in_message(
-    get_redis_connection_mock: MagicMock,
-):
-    expected_config = MagicMock()
-    expected_client = MagicMock()
-    expected_client.rpush = MagicMock()
-    get_redis_connection_mock.return_value = expected_client
-    queue(expected_config, "banana", "tomato")
-    get_redis_connection_mock.assert_called_once_with(expected_config)
-    expected_client.rpush.assert_called_once_with("metrics", ANY)
+def test_when_same_metric_and_label_expect_one_message_with_count():
+    async def add_and_flush():
+        flusher = build_flusher()
+        for _ in range(3):
+            flusher.add("banana", "tomato")
+        flusher.add("banana", None)
+        await flusher.flush()
+        return await read_messages(flusher.client), flusher.stats()
+
+    messages, stats = asyncio.run(add_and_flush())
+    assert [(message["metric"], message.get("label"), message["value"])
+            for message in messages] == \
+        [("banana", "tomato", 3), ("banana", None, 1)]
+    assert "label" not in messages[1]
+    assert stats["flushed"] == 2
+    assert stats["buffered"] == 0
+
+
+def test_when_batch_is_full_expect_flushed_before_interval():
+    async def fill_batch():
+        flusher = MetricsFlusher(FakeAsyncRedis(), 60, 5, 10)
+        flusher.start()
+        for _ in range(5):
+            flusher.add("banana")
+        for _ in range(10):
+            await asyncio.sleep(0)
+        messages = await read_messages(flusher.client)
+        await flusher.stop()
+        return messages
+
+    assert [message["value"] for message in asyncio.run(fill_batch())] == [5]
+
+
+def test_when_stopped_expect_pending_flushed():
+    async def stop_with_pending():
+        flusher = MetricsFlusher(FakeAsyncRedis(), 60, 100, 10)
+        flusher.start()
+        flusher.add("banana")
+        await flusher.stop()
+        return await read_messages(flusher.client)
 
+    assert len(asyncio.run(stop_with_pending())) == 1
 
-@patch("users.metrics.get_redis_connection")
-def test_when_label_is_none_expect_no_key(
-    get_redis_connection_mock: MagicMock,
-):
+
+def test_when_redis_is_down_expect_buffered_then_dropped():
+    async def fail_then_recover():
+        client = FakeAsyncRedis()
+        flusher = build_flusher(client, buffer_size=2)
+        flusher.add("banana")
+        flusher.add("tomato")
+        with patch.object(client, "pipeline") as pipeline:
+            pipeline.return_value.execute.side_effect = RedisConnectionError
+            with pytest.raises(RedisConnectionError):
+                await flusher.flush()
+        flusher.add("banana")
+        flusher.add("potato")
+        await flusher.flush()
+        return await read_messages(client), flusher.stats()
+
+    messages, stats = asyncio.run(fail_then_recover())
+    assert {message["metric"]: message["value"] for message in messages} == \
+        {"banana": 2, "tomato": 1}
+    assert stats["failures"] == 1
+    assert stats["dropped"] == 1
+
+
+@patch("users.tasks.asyncio.sleep")
+def test_when_redis_stays_down_expect_backoff_without_waking(sleep):
+    async def flush_while_down():
+        client = FakeAsyncRedis()
+        flusher = MetricsFlusher(client, 10, 1, 10, 60)
+        flusher.add("banana")
+        with patch.object(client, "pipeline") as pipeline:
+            pipeline.return_value.execute.side_effect = RedisConnectionError
+            with pytest.raises(asyncio.CancelledError):
+                await flusher.flush_forever()
+        return flusher
+
+    sleep.side_effect = [None, None, None, asyncio.CancelledError()]
+    flusher = asyncio.run(flush_while_down())
+    assert [call.args[0] for call in sleep.call_args_list] == \
+        [20, 40, 60, 60]
+    assert not flusher.wake.is_set()
+    assert flusher.stats()["pending_events"] == 1
+
+
+def test_when_redis_is_down_on_stop_expect_no_error():
+    async def stop_while_down():
+        client = FakeAsyncRedis()
+        flusher = build_flusher(client)
+        flusher.start()
+        flusher.add("banana")
+        with patch.object(client, "pipeline") as pipeline:
+            pipeline.return_value.execute.side_effect = RedisConnectionError
+            await flusher.stop()
+        return flusher.stats()
+
+    assert asyncio.run(stop_while_down())["pending_events"] == 1
+
+
+@patch("users.metrics.get_flusher")
+def test_when_queueing_expect_added_to_flusher(get_flusher_mock: MagicMock):
     expected_config = MagicMock()
-    expected_client = MagicMock()
-    expected_client.rpush = MagicMock()
-    get_redis_connection_mock.return_value = expected_client
-    queue(expected_config, "banana", None)
-    get_redis_connection_mock.assert_called_once_with(expected_config)
-    expected_client.rpush.assert_called_once_with("metrics", ANY)
-
-
-@patch("users.metrics.get_redis_connection")
-def test_when_redis_raises_expect_no_error(
-    get_redis_connection_mock: MagicMock,
-):
-    get_redis_connection_mock.side_effect = Exception
-    queue(MagicMock(), "banana", None)
+    queue(expected_config, "banana", "tomato")
+    get_flusher_mock.assert_called_once_with(expected_config)
+    get_flusher_mock.return_value.add.assert_called_once_with(
+        "banana", "tomato"
+    )
@@ -0,0 +1,87 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import asyncio
+
+from sqlalchemy import create_engine, text
+
+from users.migrations import migrate
+from users.models import Base
+
+LOOKUP_INDEXES = [
+    "ix_users_email_lower",
+    "ix_users_username",
+    "ix_usersFollowed_followed_id",
+    "ix_usersWallets_address",
+    "ix_admin_email_lower",
+]
+
+
+def build_old_database():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for name in LOOKUP_INDEXES:
+            connection.execute(text(f'DROP INDEX "{name}"'))
+    return engine
+
+
+def index_names(engine):
+    with engine.connect() as connection:
+        return set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )).scalars())
+
+
+def insert_users(engine, *rows):
+    with engine.begin() as connection:
+        for email, username in rows:
+            connection.execute(text(
+                "INSERT INTO users (email, username) VALUES (:email, :name)"
+            ), {"email": email, "name": username})
+
+
+def test_when_migrating_old_database_expect_lookup_indexes():
+    engine = build_old_database()
+    assert not index_names(engine) & set(LOOKUP_INDEXES)
+    asyncio.run(migrate(engine))
+    asyncio.run(migrate(engine))
+    assert set(LOOKUP_INDEXES) <= index_names(engine)
+
+
+def test_when_migrating_with_duplicates_expect_index_created_once_fixed():
+    engine = build_old_database()
+    insert_users(engine, ("banana@fiufit.com", "banana"),
+                 ("BANANA@fiufit.com", "tomato"))
+    asyncio.run(migrate(engine))
+    assert "ix_users_email_lower" not in index_names(engine)
+    assert "ix_users_username" in index_names(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "UPDATE users SET email = 'tomato@fiufit.com' "
+            "WHERE username = 'tomato'"
+        ))
+    asyncio.run(migrate(engine))
+    assert "ix_users_email_lower" in index_names(engine)
+
+
+def test_when_migrating_old_transactions_expect_ids_by_date():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE transactions"))
+        connection.execute(text(
+            "CREATE TABLE transactions (sender VARCHAR, receiver VARCHAR, "
+            "amount FLOAT, date DATETIME, "
+            "PRIMARY KEY (sender, receiver, amount, date))"
+        ))
+        connection.execute(text(
+            "INSERT INTO transactions VALUES "
+            "('0x1', '0x2', 2.0, '2023-06-02 00:00:00.000000'), "
+            "('0x2', '0x1', 1.0, '2023-06-01 00:00:00.000000')"
+        ))
+    asyncio.run(migrate(engine))
+    asyncio.run(migrate(engine))
+    with engine.connect() as connection:
+        assert connection.execute(text(
+            "SELECT id, amount FROM transactions ORDER BY id"
+        )).all() == [(1, 1.0), (2, 2.0)]
+    assert "ix_transactions_sender_date" in index_names(engine)
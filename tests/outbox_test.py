@@ -0,0 +1,83 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from users.outbox import OUTBOX_DEPTH, OUTBOX_LAG, RELAYED, LocationRelay, \
+    outbox_status, pending_locations, record_location
+
+
+def queue(factory, *changes):
+    with factory() as session:
+        for user_id, coordinates in changes:
+            record_location(session, user_id, coordinates)
+        session.commit()
+
+
+def mongo(bulk_write):
+    return MagicMock(**{"fiufit.user_location.bulk_write": bulk_write})
+
+
+def test_when_queueing_without_commit_expect_nothing_pending(factory):
+    with factory() as session:
+        record_location(session, 1, (1.1, 1.2))
+        session.rollback()
+        assert pending_locations(session, 10) == []
+
+
+def test_when_draining_expect_batches_written_and_outbox_emptied(factory):
+    queue(factory, (1, (1.1, 1.2)), (2, (2.1, 2.2)), (1, (3.1, 3.2)))
+    bulk_write = MagicMock()
+    relay = LocationRelay(2, 1, 60)
+    sent = RELAYED.labels("sent")
+    before = sent.value
+    asyncio.run(relay.drain(factory, mongo(bulk_write)))
+    assert bulk_write.call_count == 2
+    assert [len(call.args[0]) for call in bulk_write.call_args_list] == [2, 1]
+    assert sent.value == before + 3
+    with factory() as session:
+        assert outbox_status(session) == (0, None)
+    assert OUTBOX_DEPTH.labels().value == 0
+    assert OUTBOX_LAG.labels().value == 0
+
+
+def test_when_batch_is_sent_expect_on_sent_called_after_write(factory):
+    queue(factory, (1, (1.1, 1.2)), (2, (2.1, 2.2)))
+    written = []
+    bulk_write = MagicMock(side_effect=lambda *_, **__: written.append(1))
+    relay = LocationRelay(10, 1, 60, on_sent=written.append)
+    asyncio.run(relay.drain(factory, mongo(bulk_write)))
+    assert written == [1, [(1, (1.1, 1.2)), (2, (2.1, 2.2))]]
+
+
+def test_when_mongo_fails_expect_changes_kept_and_lag_reported(factory):
+    queue(factory, (1, (1.1, 1.2)))
+    relay = LocationRelay(10, 1, 60)
+    failed = RELAYED.labels("failed")
+    before = failed.value
+    with pytest.raises(RuntimeError):
+        asyncio.run(relay.drain(
+            factory, mongo(MagicMock(side_effect=RuntimeError("mongo down")))
+        ))
+    assert failed.value == before + 1
+    assert OUTBOX_DEPTH.labels().value == 1
+    assert OUTBOX_LAG.labels().value >= 0
+    with factory() as session:
+        assert pending_locations(session, 10)[0][1:] == (1, (1.1, 1.2))
+
+
+@patch("users.tasks.asyncio.sleep")
+def test_when_relay_keeps_failing_expect_backoff_doubling_up_to_max(
+    sleep, factory
+):
+    sleep.side_effect = [None, None, None, asyncio.CancelledError()]
+    queue(factory, (1, (1.1, 1.2)))
+    relay = LocationRelay(10, 10, 60)
+    bulk_write = MagicMock(side_effect=RuntimeError("mongo down"))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(relay.relay_forever(factory, mongo(bulk_write)))
+    assert [call.args[0] for call in sleep.call_args_list] == \
+        [20, 40, 60, 60]
+    assert bulk_write.call_count == 4
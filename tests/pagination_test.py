@@ -0,0 +1,160 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= unused-argument, redefined-outer-name
+# pylint: disable= duplicate-code
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from users.crud import TRANSACTIONS_KEY, USERS_KEY, get_all_transactions, \
+    get_all_users
+from users.models import Base, Transactions, Users
+from users.pagination import COUNTS_CACHE, ESTIMATED, NO_TOTAL, \
+    count_strategy, decode_cursor, encode_cursor
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./tests/test.db"
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+)
+SESSION = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+START = datetime(2023, 6, 1)
+
+
+@pytest.fixture
+def session():
+    Base.metadata.create_all(bind=engine)
+    with SESSION() as database:
+        database.add_all(
+            Users(email=f"user_{idx}", username=f"user_{idx}")
+            for idx in range(7)
+        )
+        database.add_all(
+            Transactions(sender="0x1", receiver="0x2", amount=idx,
+                         date=START + timedelta(hours=idx % 3))
+            for idx in range(7)
+        )
+        database.commit()
+        yield database
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_when_decoding_encoded_cursor_expect_same_values():
+    cursor = encode_cursor([START, 5])
+    assert decode_cursor(cursor, TRANSACTIONS_KEY) == [START, 5]
+
+
+def test_when_cursor_is_garbage_expect_bad_request():
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("banana", USERS_KEY)
+    assert error.value.status_code == 400
+
+
+def test_when_cursor_has_wrong_length_expect_bad_request():
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor([1, 2]), USERS_KEY)
+
+
+def test_when_paging_users_by_cursor_expect_every_user_once(session):
+    page = get_all_users(session, 3, 0)
+    seen = [user.id for user in page["items"]]
+    while page["next_cursor"]:
+        page = get_all_users(session, 3, 0, page["next_cursor"])
+        seen.extend(user.id for user in page["items"])
+    assert seen == list(range(1, 8))
+
+
+def test_when_last_offset_page_expect_no_cursor(session):
+    assert get_all_users(session, 3, 6)["next_cursor"] is None
+    assert get_all_users(session, 7, 0)["next_cursor"] is None
+
+
+def test_when_paging_transactions_by_cursor_expect_date_order(session):
+    page = get_all_transactions(session, None, 0, 2, 0)
+    seen = list(page["items"])
+    while page["next_cursor"]:
+        page = get_all_transactions(session, None, 0, 2, 0,
+                                    page["next_cursor"])
+        seen.extend(page["items"])
+    assert len(seen) == 7
+    assert len({item.amount for item in seen}) == 7
+    assert [item.date for item in seen] == sorted(item.date for item in seen)
+
+
+def add_wallet_transactions(session):
+    session.add_all([
+        Transactions(sender="0x3", receiver="0x1", amount=10, date=START),
+        Transactions(sender="0x3", receiver="0x3", amount=11,
+                     date=START + timedelta(hours=1)),
+        Transactions(sender="0x2", receiver="0x3", amount=12,
+                     date=START + timedelta(hours=1)),
+        Transactions(sender="0x3", receiver="0x2", amount=13,
+                     date=START + timedelta(hours=5)),
+    ])
+    session.commit()
+
+
+def all_pages(session, *args, **kwargs):
+    page = get_all_transactions(session, *args, **kwargs)
+    seen = [item.amount for item in page["items"]]
+    while page["next_cursor"]:
+        page = get_all_transactions(session, *args, page["next_cursor"],
+                                    **kwargs)
+        seen.extend(item.amount for item in page["items"])
+    return seen
+
+
+def test_when_paging_by_wallet_expect_sent_and_received_once(session):
+    add_wallet_transactions(session)
+    assert all_pages(session, "0x3", 0, 1, 0) == [10, 11, 12, 13]
+    assert all_pages(session, "0x3", 0, 3, 0, newest_first=True) == \
+        [13, 12, 11, 10]
+
+
+def test_when_paging_by_wallet_with_offset_expect_page_and_total(session):
+    add_wallet_transactions(session)
+    page = get_all_transactions(session, "0x3", 0, 2, 2)
+    assert [item.amount for item in page["items"]] == [12, 13]
+    assert page["total"] == 4
+    assert page["pages"] == 2
+    assert page["next_cursor"] is None
+
+
+def test_when_filtering_by_dates_expect_since_included_until_excluded(
+    session
+):
+    add_wallet_transactions(session)
+    since, until = START + timedelta(hours=1), START + timedelta(hours=5)
+    page = get_all_transactions(session, "0x3", 0, 10, 0, since=since,
+                                until=until)
+    assert [item.amount for item in page["items"]] == [11, 12]
+    page = get_all_transactions(session, None, 11, 10, 0, since=since)
+    assert [item.amount for item in page["items"]] == [11, 12, 13]
+
+
+def test_when_mapping_count_parameters_expect_strategy():
+    assert count_strategy(True, False) == "exact"
+    assert count_strategy(True, True) == ESTIMATED
+    assert count_strategy(False, True) == NO_TOTAL
+
+
+def test_when_total_not_included_expect_no_total_or_pages(session):
+    page = get_all_users(session, 3, 0, count=NO_TOTAL)
+    assert page["total"] is None
+    assert page["pages"] is None
+    assert page["size"] == 3
+    assert page["next_cursor"] is not None
+
+
+def test_when_total_estimated_on_sqlite_expect_cached_count(session):
+    COUNTS_CACHE.clear()
+    page = get_all_users(session, 3, 0, count=ESTIMATED)
+    assert page["total"] == 7
+    assert page["pages"] == 3
+    session.add(Users(email="user_7", username="user_7"))
+    session.commit()
+    assert get_all_users(session, 3, 0, count=ESTIMATED)["total"] == 7
+    COUNTS_CACHE.clear()
+    assert get_all_users(session, 3, 0, count=ESTIMATED)["total"] == 8
@@ -0,0 +1,109 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+from datetime import date, datetime
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from users.crud import add_transaction
+from users.migrations import migrate
+from users.models import TransactionRollups, Transactions
+from users.rollups import DAYS, WALLETS, check, get_aggregates, \
+    rebuild, stored
+
+TRANSFERS = [
+    ("0x1", "0x2", 1.0, datetime(2023, 6, 1, 10)),
+    ("0x1", "0x3", 4.0, datetime(2023, 6, 1, 12)),
+    ("0x2", "0x1", 2.0, datetime(2023, 6, 2, 9)),
+    ("0x3", "0x3", 8.0, datetime(2023, 6, 3, 9)),
+]
+
+
+@pytest.fixture
+def engine(engine):
+    with sessionmaker(bind=engine)() as session:
+        for sender, receiver, amount, day in TRANSFERS:
+            with patch("users.crud.datetime") as clock:
+                clock.now.return_value = day
+                add_transaction(session, sender, receiver, amount)
+    return engine
+
+
+def test_when_adding_transactions_expect_rollups_of_both_wallets(engine):
+    with sessionmaker(bind=engine)() as session:
+        rollup = session.get(TransactionRollups, ("0x1", date(2023, 6, 1)))
+        assert (rollup.sent_count, rollup.sent_total, rollup.sent_max) == \
+            (2, 5.0, 4.0)
+        assert (rollup.received_count, rollup.received_max) == (0, None)
+        rollup = session.get(TransactionRollups, ("0x3", date(2023, 6, 3)))
+        assert (rollup.sent_count, rollup.received_count) == (1, 1)
+        assert rebuild(session) == {table: stored(session, table)
+                                    for table in (WALLETS, DAYS)}
+
+
+def test_when_aggregating_wallet_expect_sent_and_received_by_day(engine):
+    with sessionmaker(bind=engine)() as session:
+        aggregates = get_aggregates(session, "0x1", None, date(2023, 6, 3))
+    assert [item["day"] for item in aggregates["items"]] == \
+        [date(2023, 6, 1), date(2023, 6, 2)]
+    assert aggregates["items"][1]["received_total"] == 2.0
+    assert aggregates["totals"] == {
+        "sent_count": 2, "sent_total": 5.0, "sent_max": 4.0,
+        "received_count": 1, "received_total": 2.0, "received_max": 2.0,
+    }
+
+
+def test_when_aggregating_ledger_expect_every_transaction_once(engine):
+    with sessionmaker(bind=engine)() as session:
+        aggregates = get_aggregates(session, None, date(2023, 6, 1), None)
+    assert [(item["count"], item["total"], item["max"])
+            for item in aggregates["items"]] == \
+        [(2, 5.0, 4.0), (1, 2.0, 2.0), (1, 8.0, 8.0)]
+    assert aggregates["totals"] == {"count": 4, "total": 15.0, "max": 8.0}
+
+
+def test_when_rollups_drift_expect_check_reports_and_fixes(engine):
+    with engine.begin() as connection:
+        connection.execute(
+            TransactionRollups.__table__.update()
+            .where(TransactionRollups.wallet == "0x2")
+            .values(received_total=100.0)
+        )
+        connection.execute(Transactions.__table__.insert().values(
+            sender="0x4", receiver="0x1", amount=3.0,
+            date=datetime(2023, 6, 3),
+        ))
+    differences = asyncio.run(check(engine))
+    assert [(table, key) for table, key, _, _ in differences] == [
+        ("transactionRollups", ("0x1", date(2023, 6, 3))),
+        ("transactionRollups", ("0x2", date(2023, 6, 1))),
+        ("transactionRollups", ("0x2", date(2023, 6, 2))),
+        ("transactionRollups", ("0x4", date(2023, 6, 3))),
+        ("transactionDailyRollups", (date(2023, 6, 3),)),
+    ]
+    assert differences[3][3] is None
+    asyncio.run(check(engine, fix=True))
+    assert asyncio.run(check(engine)) == []
+
+
+def test_when_checking_after_archive_expect_older_rollups_kept(engine):
+    with engine.begin() as connection:
+        connection.execute(Transactions.__table__.delete().where(
+            Transactions.date < datetime(2023, 6, 2)
+        ))
+    assert asyncio.run(check(engine, fix=True)) == []
+    with sessionmaker(bind=engine)() as session:
+        assert get_aggregates(session, None, None, None)["totals"]["count"] \
+            == 4
+
+
+def test_when_migrating_database_without_rollups_expect_built(engine):
+    with engine.begin() as connection:
+        connection.execute(WALLETS.delete())
+        connection.execute(DAYS.delete())
+    asyncio.run(migrate(engine))
+    with engine.connect() as connection:
+        assert len(stored(connection, WALLETS)) == 6
+        assert len(stored(connection, DAYS)) == 3
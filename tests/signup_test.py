@@ -0,0 +1,93 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import asyncio
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+from fastapi import HTTPException
+
+from users.signup import COMPENSATIONS, STEP_LATENCY, Signup
+
+
+async def answer(value, delay=0.05):
+    await asyncio.sleep(delay)
+    return value
+
+
+async def fail(delay=0.0):
+    await asyncio.sleep(delay)
+    raise HTTPException(status_code=409, detail="taken")
+
+
+def test_when_steps_are_independent_expect_run_together():
+    async def sign_up():
+        async with Signup() as signup:
+            return signup, await signup.concurrently({
+                "auth": (answer("uid"), None),
+                "wallet": (answer("0x1"), None),
+                "image": (answer(None), None),
+            })
+
+    start = time.perf_counter()
+    signup, results = asyncio.run(sign_up())
+    elapsed = time.perf_counter() - start
+    assert results == {"auth": "uid", "wallet": "0x1", "image": None}
+    assert elapsed < 0.12
+    assert set(signup.timings) == {"auth", "wallet", "image"}
+    assert STEP_LATENCY.labels("wallet").counts
+
+
+def test_when_a_step_fails_expect_finished_ones_undone_newest_first():
+    order = []
+    delete_user = AsyncMock(side_effect=lambda _: order.append("auth"))
+    delete_wallet = AsyncMock(side_effect=lambda _: order.append("wallet"))
+
+    async def sign_up():
+        async with Signup() as signup:
+            await signup.concurrently({
+                "auth": (answer("uid", 0), delete_user),
+                "wallet": (answer("0x1", 0.01), delete_wallet),
+            })
+            await signup.step("database", fail())
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(sign_up())
+    assert error.value.status_code == 409
+    assert order == ["wallet", "auth"]
+    delete_wallet.assert_awaited_once_with("0x1")
+
+
+def test_when_concurrent_step_fails_expect_others_cancelled_and_undone():
+    delete_user = AsyncMock()
+    delete_wallet = AsyncMock()
+
+    async def sign_up():
+        async with Signup() as signup:
+            await signup.concurrently({
+                "auth": (answer("uid", 0), delete_user),
+                "wallet": (answer("0x1", 1), delete_wallet),
+                "image": (fail(0.01), None),
+            })
+
+    with pytest.raises(HTTPException):
+        asyncio.run(sign_up())
+    delete_user.assert_awaited_once_with("uid")
+    delete_wallet.assert_not_awaited()
+
+
+def test_when_compensation_fails_expect_rest_still_undone():
+    delete_user = AsyncMock()
+    failures = COMPENSATIONS.labels("wallet", "failed")
+    before = failures.value
+
+    async def sign_up():
+        async with Signup() as signup:
+            await signup.step("auth", answer("uid", 0), delete_user)
+            await signup.step("wallet", answer("0x1", 0),
+                              AsyncMock(side_effect=RuntimeError))
+            await fail()
+
+    with pytest.raises(HTTPException):
+        asyncio.run(sign_up())
+    delete_user.assert_awaited_once()
+    assert failures.value == before + 1
@@ -0,0 +1,121 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import asyncio
+import socket
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from users.telemetry import (
+    DEPENDENCY_LATENCY,
+    Counter,
+    Gauge,
+    Histogram,
+    InstrumentedRoute,
+    REGISTRY,
+    REQUESTS,
+    Registry,
+    build_httpx_hooks,
+    instrument_dependencies,
+    start_metrics_server,
+    stop_metrics_server,
+)
+
+
+def test_when_rendering_counter_expect_text_format():
+    registry = Registry()
+    counter = registry.register(
+        Counter("banana_total", "Bananas.", ("color",))
+    )
+    counter.labels("yel\"low").inc(2)
+    assert registry.render() == (
+        "# HELP banana_total Bananas.\n"
+        "# TYPE banana_total counter\n"
+        'banana_total{color="yel\\"low"} 2.0\n'
+    )
+
+
+def test_when_observing_expect_cumulative_buckets():
+    histogram = Histogram("tomato_seconds", "Tomatoes.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.labels().observe(value)
+    assert histogram.samples() == [
+        'tomato_seconds_bucket{le="0.1"} 2',
+        'tomato_seconds_bucket{le="1.0"} 3',
+        'tomato_seconds_bucket{le="+Inf"} 4',
+        "tomato_seconds_sum 3.65",
+        "tomato_seconds_count 4",
+    ]
+
+
+def test_when_collector_fails_expect_other_metrics_rendered():
+    registry = Registry()
+    gauge = registry.register(Gauge("potato", "Potatoes."))
+
+    def collect():
+        gauge.labels().set(3)
+        raise ValueError
+
+    registry.add_collector(collect)
+    assert "potato 3" in registry.render()
+
+
+def test_when_route_is_called_expect_counted_by_template():
+    app = FastAPI()
+    app.router.route_class = InstrumentedRoute
+
+    @app.get("/bananas/{banana_id}")
+    def get_banana(banana_id: int):
+        return {"id": banana_id}
+
+    before = REQUESTS.labels("GET", "/bananas/{banana_id}", 200).value
+    client = TestClient(app)
+    client.get("/bananas/1")
+    client.get("/bananas/2")
+    client.get("/bananas/tomato")
+    assert REQUESTS.labels("GET", "/bananas/{banana_id}", 200).value == \
+        before + 2
+    assert REQUESTS.labels("GET", "/bananas/{banana_id}", 422).value >= 1
+    assert 'route="/bananas/{banana_id}"' in REGISTRY.render()
+
+
+def test_when_calling_dependency_expect_latency_observed():
+    async def call():
+        transport = httpx.MockTransport(lambda request: httpx.Response(503))
+        async with httpx.AsyncClient(
+            transport=transport, event_hooks=build_httpx_hooks("bananas")
+        ) as client:
+            await client.get("http://bananas/")
+
+    asyncio.run(call())
+    assert sum(DEPENDENCY_LATENCY.labels("bananas", "GET").counts) == 1
+    assert "dependency_errors_total" \
+        '{dependency="bananas",operation="GET"} 1.0' in REGISTRY.render()
+
+
+def test_when_executing_sql_expect_latency_observed():
+    instrument_dependencies()
+    before = sum(DEPENDENCY_LATENCY.labels("postgres", "SELECT").counts)
+    with create_engine("sqlite://").connect() as connection:
+        connection.execute(text("select 1"))
+    assert sum(DEPENDENCY_LATENCY.labels("postgres", "SELECT").counts) == \
+        before + 1
+
+
+def test_when_scraping_expect_metrics_served():
+    async def scrape(path):
+        server = await start_metrics_server(0)
+        port = next(sock.getsockname()[1] for sock in server.sockets
+                    if sock.family == socket.AF_INET)
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        await stop_metrics_server(server)
+        return response.decode()
+
+    response = asyncio.run(scrape("/metrics"))
+    assert response.startswith("HTTP/1.1 200 OK")
+    assert "# TYPE http_requests_total counter" in response
+    assert asyncio.run(scrape("/")).startswith("HTTP/1.1 404")
@@ -1,5 +1,13 @@
 """Constants to use for testing."""
 
+from datetime import datetime, timedelta
+from itertools import count
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, \
+    create_async_engine
+
+from users.models import Base, Transactions
+
 user_1 = {
     "password": "jorgito_pw",
     "username": "jorgitogroso",
@@ -135,6 +143,35 @@ test_wallet_2 = {
     "privateKey": "test_key_2"
 }
 
+WALLET_IDS = count()
+
+
+def new_wallet():
+    """Return a wallet whose address no other test wallet has."""
+    return {"address": f"new_address_{next(WALLET_IDS)}",
+            "privateKey": "test_key"}
+
+
+def ledger_transactions():
+    """Return two transactions a month, from January to April 2023."""
+    return [
+        Transactions(sender="0x1" if idx % 2 else "0x2", receiver="0x3",
+                     amount=idx,
+                     date=datetime(2023, 1, 1) + timedelta(days=15 * idx))
+        for idx in range(8)
+    ]
+
+
+async def async_ledger() -> AsyncEngine:
+    """Return an in-memory async database holding ledger_transactions."""
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        session.add_all(ledger_transactions())
+        await session.commit()
+    return engine
+
 
 def equal_dicts(dict1, dict2, ignore_keys):
     """Return true if dict1 equals dict2 minus ignore_keys."""
@@ -0,0 +1,116 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from pytest import raises
+
+from users.tokens import TokenVerifier, get_bearer_token
+from users.util import CREDENTIALS_CACHE, get_credentials
+
+PRIVATE_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+OTHER_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def build_jwks(private_key, key_id="key-1"):
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(
+        private_key.public_key(), as_dict=True
+    )
+    return {"keys": [jwk | {"kid": key_id, "alg": "RS256", "use": "sig"}]}
+
+
+def sign(claims, private_key=PRIVATE_KEY, key_id="key-1"):
+    return jwt.encode(
+        claims, private_key, algorithm="RS256", headers={"kid": key_id}
+    )
+
+
+def build_verifier():
+    verifier = TokenVerifier("http://auth/keys", 300)
+    verifier.load(build_jwks(PRIVATE_KEY))
+    return verifier
+
+
+def test_when_token_is_signed_with_known_key_expect_claims():
+    token = sign({"role": "user", "id": 3})
+    assert build_verifier().verify(token) == {"role": "user", "id": 3}
+
+
+def test_when_key_id_is_unknown_expect_none():
+    token = sign({"role": "user", "id": 3}, key_id="key-2")
+    assert build_verifier().verify(token) is None
+
+
+def test_when_signature_is_wrong_expect_error():
+    token = sign({"role": "admin", "id": 3}, private_key=OTHER_KEY)
+    with raises(HTTPException) as error:
+        build_verifier().verify(token)
+    assert error.value.status_code == 401
+
+
+def test_when_token_expired_expect_error():
+    token = sign({"role": "user", "id": 3, "exp": int(time.time()) - 10})
+    with raises(HTTPException) as error:
+        build_verifier().verify(token)
+    assert error.value.status_code == 401
+
+
+def test_when_token_is_garbage_expect_error():
+    with raises(HTTPException) as error:
+        build_verifier().verify("banana")
+    assert error.value.status_code == 401
+
+
+def test_when_claims_are_missing_expect_format_error():
+    with raises(HTTPException) as error:
+        build_verifier().verify(sign({"role": "user"}))
+    assert error.value.detail == "Token format error"
+
+
+def test_when_refreshing_expect_keys_from_auth_service():
+    response = MagicMock(**{"json.return_value": build_jwks(PRIVATE_KEY)})
+    client = MagicMock(get=AsyncMock(return_value=response))
+    verifier = TokenVerifier("http://auth/keys", 300)
+    asyncio.run(verifier.refresh(client))
+    client.get.assert_called_once_with("http://auth/keys")
+    assert list(verifier.keys) == ["key-1"]
+
+
+def test_when_header_has_bearer_scheme_expect_token_only():
+    assert get_bearer_token({"Authorization": "Bearer banana"}) == "banana"
+
+
+@patch("users.util.fetch_credentials")
+@patch("users.util.CONFIGURATION")
+@patch("users.util.TOKEN_VERIFIER", build_verifier())
+def test_when_local_verification_expect_no_remote_call(
+    config_mock: MagicMock,
+    fetch_mock: AsyncMock,
+):
+    CREDENTIALS_CACHE.clear()
+    config_mock.auth.verification = "local"
+    token = sign({"role": "admin", "id": 1})
+    request = MagicMock(headers={"Authorization": "Bearer " + token})
+    assert asyncio.run(get_credentials(request)) == {"role": "admin", "id": 1}
+    fetch_mock.assert_not_called()
+    CREDENTIALS_CACHE.clear()
+
+
+@patch("users.util.fetch_credentials")
+@patch("users.util.CONFIGURATION")
+@patch("users.util.TOKEN_VERIFIER", build_verifier())
+def test_when_local_verification_and_unknown_key_expect_remote_call(
+    config_mock: MagicMock,
+    fetch_mock: AsyncMock,
+):
+    CREDENTIALS_CACHE.clear()
+    config_mock.auth.verification = "local"
+    fetch_mock.return_value = {"role": "user", "id": 2}
+    token = sign({"role": "admin", "id": 1}, key_id="key-2")
+    request = MagicMock(headers={"Authorization": "Bearer " + token})
+    assert asyncio.run(get_credentials(request)) == {"role": "user", "id": 2}
+    fetch_mock.assert_called_once()
+    CREDENTIALS_CACHE.clear()
@@ -1,6 +1,9 @@
 # pylint: disable= missing-module-docstring, missing-function-docstring
 # pylint: disable= unused-argument, redefined-outer-name
 # pylint: disable= duplicate-code
+import asyncio
+import json
+from datetime import datetime, timezone
 from unittest.mock import patch
 
 import pytest
@@ -10,8 +13,10 @@ from sqlalchemy.orm import sessionmaker
 
 from tests.testing_util import test_wallet_1, user_1, \
     test_wallet_2, user_2, equal_dicts
+from users.crud import add_transaction
+from users.ledger import archive
 from users.main import app, get_db
-from users.models import Base
+from users.models import Base, Transactions
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./tests/test.db"
 
@@ -71,10 +76,140 @@ def test_can_get_transactions_with_admin_token(get_creds_mock, test_db):
     response = client.get("users/transactions")
     assert response.status_code == 200
     transactions = {'items': [], 'page': 1, 'pages': 0,
-                    'size': 0, 'total': 0}
+                    'size': 0, 'total': 0, 'next_cursor': None}
     assert response.json() == transactions
 
 
+@patch('users.main.get_credentials')
+def test_when_getting_transactions_by_wallet_and_date_expect_filtered(
+    get_creds_mock, test_db
+):
+    with TestingSessionLocal() as session:
+        session.add_all([
+            Transactions(sender="0x1", receiver="0x2", amount=1,
+                         date=datetime(2023, 6, 1)),
+            Transactions(sender="0x2", receiver="0x1", amount=2,
+                         date=datetime(2023, 6, 2)),
+            Transactions(sender="0x2", receiver="0x3", amount=3,
+                         date=datetime(2023, 6, 3)),
+        ])
+        session.commit()
+    get_creds_mock.return_value = {"id": 1, "role": "admin"}
+    response = client.get("users/transactions", params={
+        "wallet_address": "0x1", "since": "2023-06-01T12:00:00",
+        "newest_first": True,
+    })
+    assert response.status_code == 200, response.json()
+    assert [item["amount"] for item in response.json()["items"]] == [2]
+    response = client.get("users/transactions", params={
+        "wallet_address": "0x2", "newest_first": True,
+    })
+    assert [item["amount"] for item in response.json()["items"]] == \
+        [3, 2, 1]
+
+
+@patch('users.main.get_credentials')
+def test_when_dates_have_an_offset_expect_archive_read_in_utc(
+    get_creds_mock, test_db, tmp_path
+):
+    with TestingSessionLocal() as session:
+        session.add_all([
+            Transactions(sender="0x1", receiver="0x2", amount=1,
+                         date=datetime(2023, 1, 5, 1)),
+            Transactions(sender="0x1", receiver="0x2", amount=2,
+                         date=datetime(2023, 1, 5, 4)),
+            Transactions(sender="0x1", receiver="0x2", amount=3,
+                         date=datetime(2023, 6, 3)),
+        ])
+        session.commit()
+    asyncio.run(archive(engine, str(tmp_path), 1, datetime(2023, 6, 15)))
+    get_creds_mock.return_value = {"id": 1, "role": "admin"}
+    params = {"since": "2023-01-05T00:00:00-03:00",
+              "until": "2023-12-01T00:00:00Z"}
+    with patch('users.main.CONFIGURATION.ledger.archive_dir', str(tmp_path)):
+        response = client.get("users/transactions", params=params)
+        export = client.get("users/transactions/export", params=params)
+    assert response.status_code == 200, response.json()
+    assert [item["amount"] for item in response.json()["items"]] == [2, 3]
+    assert export.status_code == 200
+    assert [json.loads(line)["amount"]
+            for line in export.text.splitlines()] == [2, 3]
+
+
+@patch('users.main.get_credentials')
+def test_cant_get_transaction_aggregates_with_user_token(get_creds_mock,
+                                                         test_db):
+    get_creds_mock.return_value = {"id": 1, "role": "user"}
+    response = client.get("users/transactions/aggregates")
+    assert response.status_code == 403
+
+
+def test_when_adding_transaction_expect_naive_utc_date(test_db):
+    before = datetime.now(timezone.utc).replace(tzinfo=None)
+    with TestingSessionLocal() as session:
+        add_transaction(session, "0x1", "0x2", 1.5)
+        stored = session.query(Transactions).one().date
+    assert stored.tzinfo is None
+    assert before <= stored <= datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+@patch('users.main.get_credentials')
+def test_when_getting_wallet_aggregates_expect_daily_totals(get_creds_mock,
+                                                            test_db):
+    with TestingSessionLocal() as session:
+        add_transaction(session, "0x1", "0x2", 1.5)
+        add_transaction(session, "0x2", "0x1", 2.0)
+    today = str(datetime.now(timezone.utc).date())
+    get_creds_mock.return_value = {"id": 1, "role": "admin"}
+    response = client.get("users/transactions/aggregates",
+                          params={"wallet_address": "0x1"})
+    assert response.status_code == 200
+    assert response.json()["items"] == [{
+        "day": today,
+        "sent_count": 1, "sent_total": 1.5, "sent_max": 1.5,
+        "received_count": 1, "received_total": 2.0, "received_max": 2.0,
+    }]
+    response = client.get("users/transactions/aggregates",
+                          params={"since": today})
+    assert response.json()["totals"] == {"count": 2, "total": 3.5,
+                                         "max": 2.0}
+
+
+@patch('users.main.get_credentials')
+def test_cant_export_transactions_with_user_token(get_creds_mock, test_db):
+    get_creds_mock.return_value = {"id": 1, "role": "user"}
+    response = client.get("users/transactions/export")
+    assert response.status_code == 403
+
+
+@patch('users.main.get_credentials')
+def test_when_exporting_transactions_as_csv_expect_streamed_file(
+    get_creds_mock, test_db
+):
+    with TestingSessionLocal() as session:
+        session.add_all([
+            Transactions(sender="0x1", receiver="0x2", amount=1,
+                         date=datetime(2023, 6, 1)),
+            Transactions(sender="0x2", receiver="0x3", amount=3,
+                         date=datetime(2023, 6, 3)),
+        ])
+        session.commit()
+    get_creds_mock.return_value = {"id": 1, "role": "admin"}
+    response = client.get("users/transactions/export", params={
+        "wallet_address": "0x1", "format": "csv",
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert "transactions.csv" in response.headers["content-disposition"]
+    assert response.text.splitlines() == [
+        "id,sender,receiver,amount,date",
+        "1,0x1,0x2,1.0,2023-06-01T00:00:00",
+    ]
+    response = client.get("users/transactions/export",
+                          params={"format": "xml"})
+    assert response.status_code == 422
+
+
 @patch('users.main.get_credentials')
 def test_cant_transfer_money_between_users_with_wrong_creds(get_creds_mock,
                                                             test_db):
@@ -0,0 +1,60 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+from pytest import fixture, raises
+
+from users.util import CREDENTIALS_CACHE, get_credentials
+
+REQUEST = MagicMock(headers={"Authorization": "Bearer banana"})
+
+
+@fixture(autouse=True)
+def empty_cache():
+    CREDENTIALS_CACHE.clear()
+    yield
+    CREDENTIALS_CACHE.clear()
+
+
+@patch("users.util.fetch_credentials")
+def test_when_token_is_reused_expect_one_remote_call(fetch_mock: AsyncMock):
+    fetch_mock.return_value = {"role": "user", "id": 1}
+    assert asyncio.run(get_credentials(REQUEST)) == {"role": "user", "id": 1}
+    assert asyncio.run(get_credentials(REQUEST)) == {"role": "user", "id": 1}
+    fetch_mock.assert_called_once_with({"Authorization": "Bearer banana"})
+
+
+@patch("users.util.fetch_credentials")
+def test_when_token_is_invalid_expect_cached_error(fetch_mock: AsyncMock):
+    fetch_mock.side_effect = HTTPException(status_code=401, detail="Expired")
+    for _ in range(2):
+        with raises(HTTPException) as error:
+            asyncio.run(get_credentials(REQUEST))
+        assert error.value.status_code == 401
+        assert error.value.detail == "Expired"
+    fetch_mock.assert_called_once()
+
+
+@patch("users.util.fetch_credentials")
+def test_when_auth_service_fails_expect_no_cached_error(fetch_mock: AsyncMock):
+    fetch_mock.side_effect = HTTPException(status_code=500, detail="Down")
+    for _ in range(2):
+        with raises(HTTPException):
+            asyncio.run(get_credentials(REQUEST))
+    assert fetch_mock.call_count == 2
+
+
+@patch("users.util.fetch_credentials")
+def test_when_no_token_expect_error(fetch_mock: AsyncMock):
+    with raises(HTTPException) as error:
+        asyncio.run(get_credentials(MagicMock(headers={})))
+    assert error.value.detail == "No token"
+    fetch_mock.assert_not_called()
+
+
+@patch("users.util.fetch_credentials")
+def test_when_credentials_are_cached_expect_token_hashed(fetch_mock):
+    fetch_mock.return_value = {"role": "user", "id": 1}
+    asyncio.run(get_credentials(REQUEST))
+    assert all("banana" not in key for key in CREDENTIALS_CACHE.entries)
@@ -0,0 +1,70 @@
+# pylint: disable= missing-module-docstring, missing-function-docstring
+# pylint: disable= redefined-outer-name
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from tests.testing_util import new_wallet
+from users.wallet_pool import POOL_DEPTH, WALLETS_HANDED, WalletPool, \
+    add_wallet, count_wallets, take_wallet
+
+
+def test_when_pool_is_empty_expect_none(factory):
+    with factory() as session:
+        assert take_wallet(session) is None
+
+
+def test_when_taking_wallets_expect_oldest_first_and_removed(factory):
+    with factory() as session:
+        add_wallet(session, {"address": "0x1", "privateKey": "key1"})
+        add_wallet(session, {"address": "0x2", "privateKey": "key2"})
+        assert take_wallet(session) == {"address": "0x1",
+                                        "privateKey": "key1"}
+        assert count_wallets(session) == 1
+
+
+def test_when_refilling_expect_pool_filled_to_size(factory):
+    pool = WalletPool(3, 10, 60)
+    create = AsyncMock(side_effect=new_wallet)
+    with factory() as session:
+        add_wallet(session, new_wallet())
+    asyncio.run(pool.refill(factory, create))
+    assert create.await_count == 2
+    assert pool.depth == 3
+    assert POOL_DEPTH.labels().value == 3
+    with factory() as session:
+        assert count_wallets(session) == 3
+
+
+def test_when_taking_from_pool_expect_counted_and_refill_wanted(factory):
+    pool = WalletPool(3, 10, 60)
+    taken = WALLETS_HANDED.labels("pool")
+    created = WALLETS_HANDED.labels("payments")
+    before = taken.value, created.value
+    with factory() as session:
+        add_wallet(session, new_wallet())
+        assert asyncio.run(pool.take(session)) is not None
+        assert asyncio.run(pool.take(session)) is None
+    assert (taken.value, created.value) == (before[0] + 1, before[1] + 1)
+    assert pool.wanted.is_set()
+
+
+def test_when_pool_size_is_zero_expect_no_query():
+    pool = WalletPool(0, 10, 60)
+    with patch("users.wallet_pool.run") as run:
+        assert asyncio.run(pool.take(object())) is None
+    run.assert_not_called()
+
+
+@patch("users.tasks.asyncio.sleep")
+def test_when_refill_keeps_failing_expect_backoff_doubling_up_to_max(
+    sleep, factory
+):
+    sleep.side_effect = [None, None, None, asyncio.CancelledError()]
+    pool = WalletPool(3, 10, 60)
+    create = AsyncMock(side_effect=RuntimeError("payments down"))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(pool.refill_forever(factory, create))
+    assert [call.args[0] for call in sleep.call_args_list] == \
+        [20, 40, 60, 60]
@@ -1,5 +1,8 @@
 """DAO for admin."""
 
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from users.admin.dto import AdminCreationDTO
 from users.models import Admin as AdminTable
@@ -9,14 +12,21 @@ def create_admin(session: Session, dto: AdminCreationDTO):
     """Create a new user in the users table, using the id as primary key."""
     admin = AdminTable(email=dto.email, username=dto.username)
     session.add(admin)
-    session.commit()
+    try:
+        session.commit()
+    except IntegrityError as exc:
+        session.rollback()
+        raise HTTPException(
+            status_code=400, detail="Admin with that email already present"
+        ) from exc
     session.refresh(admin)
     return admin
 
 
 def get_admin_by_email(session: Session, email: str):
     """Return all admins in the database."""
-    return session.query(AdminTable).filter(AdminTable.email == email).first()
+    return session.query(AdminTable) \
+        .filter(func.lower(AdminTable.email) == email.lower()).first()
 
 
 def get_all(session: Session):
@@ -0,0 +1,173 @@
+"""Create many users at once, for migrations and partner onboarding.
+
+The whole batch is checked for taken or repeated emails and usernames in
+one query. Auth users and wallets are then created for the rest, at most
+concurrency users at a time, and every user that got both goes in with
+multi-row inserts in a single transaction. Users whose email or username
+got taken meanwhile are skipped and only their remote steps are undone,
+unless the whole transaction fails. Results are reported per user, in
+request order.
+"""
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from newrelic.agent import record_custom_metric as record_metric
+
+from users.compensations import COMPENSATION_RETRIER
+from users.config import AppConfig
+from users.crud import create_users, find_conflicts
+from users.database import AnySession, run
+from users.location_helper import LOCATION_RELAY, locations_saved
+from users.schemas import UserCreate
+from users.signup import Signup
+from users.telemetry import REGISTRY, Counter
+from users.util import add_user_firebase, create_wallet, \
+    delete_user_firebase, delete_wallet, upload_image
+
+BULK_USERS = REGISTRY.register(Counter(
+    "bulk_users_total", "Users in bulk creations, by outcome.",
+    ("outcome",),
+))
+
+
+def rejection(status_code: int, detail) -> dict:
+    """Build the result of a user that was not created."""
+    return {"status": status_code, "detail": detail}
+
+
+def check_batch(users: List[UserCreate], taken_emails: Set[str],
+                taken_usernames: Set[str]) -> List[Optional[dict]]:
+    """Return a rejection for each user that can't be created, else None.
+
+    Emails are compared ignoring case. Of users repeating an email or
+    username, only the first one is kept.
+    """
+    emails: Set[str] = set()
+    usernames: Set[str] = set()
+    results: List[Optional[dict]] = []
+    for user in users:
+        email = user.email.lower()
+        if email in taken_emails:
+            detail = "User with that email already present"
+        elif user.username in taken_usernames:
+            detail = "User with that username already present"
+        elif email in emails:
+            detail = "Email repeated in batch"
+        elif user.username in usernames:
+            detail = "Username repeated in batch"
+        else:
+            emails.add(email)
+            usernames.add(user.username)
+            results.append(None)
+            continue
+        results.append(rejection(400, detail))
+    return results
+
+
+# pylint: disable=broad-exception-caught
+async def prepare(user: UserCreate, limit: asyncio.Semaphore
+                  ) -> Tuple[Signup, Optional[dict], Optional[dict]]:
+    """Create the auth user and wallet of one user, and upload its image.
+
+    Returns its signup, to be undone later, with the wallet, or with a
+    rejection if a step failed, in which case the others are undone.
+    """
+    signup = Signup()
+    async with limit:
+        try:
+            async with signup:
+                steps = {
+                    "auth": (add_user_firebase(user.email, user.password),
+                             lambda _: COMPENSATION_RETRIER.undo(
+                                 "auth", delete_user_firebase, user.email)),
+                    "wallet": (create_wallet(), lambda wallet: (
+                        COMPENSATION_RETRIER.undo("wallet", delete_wallet,
+                                                  wallet)
+                    )),
+                }
+                if user.image:
+                    steps["image"] = (upload_image(user.image,
+                                                   user.username), None)
+                results = await signup.concurrently(steps)
+        except HTTPException as error:
+            return signup, None, rejection(error.status_code, error.detail)
+        except Exception:
+            logging.exception("Could not create user %s.", user.email)
+            return signup, None, rejection(500, "Error when creating user")
+    return signup, results["wallet"], None
+
+
+async def undo(signups: List[Signup], limit: asyncio.Semaphore):
+    """Compensate signups, at most as many at a time as they were made."""
+    async def compensate(signup: Signup):
+        async with limit:
+            await signup.compensate()
+
+    await asyncio.gather(*(compensate(signup) for signup in signups))
+
+
+async def insert(session: AnySession, ready: List[tuple],
+                 limit: asyncio.Semaphore,
+                 config: AppConfig) -> List[Optional[int]]:
+    """Save (user, signup, wallet) in one transaction, returning the ids.
+
+    Signups of users skipped for a conflict, with None as id, are undone,
+    and every signup if the transaction fails.
+    """
+    users = [user for user, _, _ in ready]
+    locations = [None if user.is_athlete else user.coordinates
+                 for user in users]
+    try:
+        ids = await run(session, create_users, users,
+                        [wallet for _, _, wallet in ready], locations,
+                        config.mongo.enabled)
+    except Exception:
+        logging.warning("Bulk insert failed, undoing %d users.", len(ready))
+        await undo([signup for _, signup, _ in ready], limit)
+        raise
+    skipped = [signup for (_, signup, _), _id in zip(ready, ids)
+               if _id is None]
+    if skipped:
+        logging.warning("%d users taken meanwhile, undoing them.",
+                        len(skipped))
+        await undo(skipped, limit)
+    locations_saved([(_id, coordinates)
+                     for _id, coordinates in zip(ids, locations)
+                     if _id is not None and coordinates is not None],
+                    config)
+    if config.mongo.enabled:
+        LOCATION_RELAY.wanted.set()
+    return ids
+
+
+async def create_many(session: AnySession, users: List[UserCreate],
+                      config: AppConfig) -> List[dict]:
+    """Create users, returning each one's id or why it was not created."""
+    results = check_batch(users, *await run(
+        session, find_conflicts, [user.email for user in users],
+        [user.username for user in users]
+    ))
+    limit = asyncio.Semaphore(config.bulk.concurrency)
+    accepted = [idx for idx, result in enumerate(results) if result is None]
+    prepared = await asyncio.gather(*(prepare(users[idx], limit)
+                                      for idx in accepted))
+    ready = []
+    for idx, (signup, wallet, result) in zip(accepted, prepared):
+        results[idx] = result
+        if result is None:
+            ready.append((idx, (users[idx], signup, wallet)))
+    if ready:
+        ids = await insert(session, [entry for _, entry in ready], limit,
+                           config)
+        for (idx, _), _id in zip(ready, ids):
+            results[idx] = {"status": 200, "id": _id} if _id is not None \
+                else rejection(400, "User with that email or username "
+                                    "already present")
+    created = sum(result["status"] == 200 for result in results)
+    BULK_USERS.labels("created").inc(created)
+    BULK_USERS.labels("rejected").inc(len(users) - created)
+    record_metric("Custom/users-bulk/created", created)
+    return [{"email": user.email} | result
+            for user, result in zip(users, results)]
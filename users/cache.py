@@ -0,0 +1,78 @@
+"""In-process caches with LRU eviction and time based expiration."""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+# pylint: disable=too-many-instance-attributes
+class TTLCache:
+    """Bounded mapping whose entries expire after some seconds.
+
+    Least recently used entries are evicted once max_size is reached.
+    on_remove, if given, is called with the key and value of every entry
+    that expires, is evicted, replaced or deleted, but not on clear.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+        on_remove: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.on_remove = on_remove
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return cached value, or default if missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= self.clock():
+            if entry is not None:
+                self.delete(key)
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store value, using the cache ttl unless another one is given."""
+        if self.max_size <= 0:
+            return
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        self.delete(key)
+        self.entries[key] = (expires, value)
+        while len(self.entries) > self.max_size:
+            self.delete(next(iter(self.entries)))
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Remove key if present."""
+        entry = self.entries.pop(key, None)
+        if entry is not None and self.on_remove is not None:
+            self.on_remove(key, entry[1])
+
+    def clear(self):
+        """Remove every entry, keeping counters."""
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        """Return size and hit/miss/eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,53 @@
+"""Pooled HTTP clients for the services this one depends on."""
+import logging
+from typing import Dict
+
+import httpx
+
+from users.config import AppConfig
+from users.telemetry import build_httpx_hooks
+
+AUTH = "auth"
+PAYMENTS = "payments"
+
+CLIENTS: Dict[str, httpx.AsyncClient] = {}
+
+
+def build_client(service, name: str) -> httpx.AsyncClient:
+    """Create a keep-alive client from a service configuration group.
+
+    Requests are timed as calls to dependency name.
+    """
+    limits = httpx.Limits(
+        max_connections=service.max_connections,
+        max_keepalive_connections=service.max_keepalive_connections,
+        keepalive_expiry=service.keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(service.timeout),
+        event_hooks=build_httpx_hooks(name),
+    )
+
+
+def start_clients(config: AppConfig):
+    """Create one client per dependency."""
+    logging.info("Creating HTTP clients...")
+    CLIENTS[AUTH] = build_client(config.auth, AUTH)
+    CLIENTS[PAYMENTS] = build_client(config.payments, PAYMENTS)
+
+
+async def close_clients():
+    """Close every client, releasing pooled connections."""
+    logging.info("Closing HTTP clients...")
+    for name in list(CLIENTS):
+        await CLIENTS.pop(name).aclose()
+
+
+def get_client(name: str, config: AppConfig) -> httpx.AsyncClient:
+    """Return client for a dependency, creating it if not started yet."""
+    client = CLIENTS.get(name)
+    if client is None or client.is_closed:
+        client = build_client(getattr(config, name), name)
+        CLIENTS[name] = client
+    return client
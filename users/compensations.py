@@ -0,0 +1,194 @@
+"""Signup compensations that failed, kept to be retried.
+
+When undoing a signup, deleting its auth user or wallet can fail, for
+example while the auth or payments service is down, leaving them behind.
+Those deletes are stored in failedCompensations with what they were given,
+and a background task replays them every retry_interval seconds, removing
+rows once they succeed. Rows that failed max_attempts times are left for
+an operator. Batches are locked with SELECT ... FOR UPDATE SKIP LOCKED, so
+replicas retry different rows.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from environ import to_config
+from newrelic.agent import record_custom_metric as record_metric
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.orm import Session
+
+from users.config import AppConfig
+from users.database import AnySession, close, run
+from users.models import FailedCompensations
+from users.tasks import cancel
+from users.telemetry import REGISTRY, Counter, Gauge
+
+CONFIGURATION = to_config(AppConfig)
+PENDING = REGISTRY.register(Gauge(
+    "failed_compensations_pending",
+    "Signup compensations waiting to be retried.",
+))
+RETRIED = REGISTRY.register(Counter(
+    "failed_compensations_retried_total",
+    "Retries of failed signup compensations, by step and outcome.",
+    ("step", "outcome"),
+))
+
+
+def add_failure(session: Session, step: str, payload: Any, error: str):
+    """Store a compensation to retry, with the argument it was given."""
+    session.add(FailedCompensations(step=step, payload=json.dumps(payload),
+                                    error=error, attempts=0,
+                                    created_at=datetime.now()))
+    session.commit()
+
+
+def due_failures(session: Session, after: int, limit: int,
+                 max_attempts: int) -> List[Tuple[int, str, Any]]:
+    """Lock the oldest compensations past id after, as (id, step, payload).
+
+    Rows locked by other replicas are skipped. They stay locked until
+    retried commits or the session rolls back.
+    """
+    rows = session.execute(
+        select(FailedCompensations.id, FailedCompensations.step,
+               FailedCompensations.payload)
+        .where(FailedCompensations.id > after,
+               FailedCompensations.attempts < max_attempts)
+        .order_by(FailedCompensations.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not rows:
+        session.rollback()
+    return [(_id, step, json.loads(payload)) for _id, step, payload in rows]
+
+
+def retried(session: Session, done: List[int], failed: Dict[int, str]):
+    """Remove compensations that went through, count the failed ones."""
+    if done:
+        session.execute(delete(FailedCompensations)
+                        .where(FailedCompensations.id.in_(done)))
+    for _id, error in failed.items():
+        session.execute(
+            update(FailedCompensations)
+            .where(FailedCompensations.id == _id)
+            .values(attempts=FailedCompensations.attempts + 1, error=error)
+        )
+    session.commit()
+
+
+def count_failures(session: Session) -> int:
+    """Return how many compensations wait to be retried."""
+    return session.execute(
+        select(func.count()).select_from(FailedCompensations)
+    ).scalar()
+
+
+class CompensationRetrier:
+    """Stores failed compensations and retries them in a background task."""
+
+    def __init__(self, retry_interval: float, batch_size: int,
+                 max_attempts: int):
+        self.retry_interval = retry_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.session_factory: Optional[Callable] = None
+        self.undoers: Dict[str, Callable[[Any], Awaitable]] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    # pylint: disable=broad-exception-caught
+    async def record(self, step: str, payload: Any, error: Exception):
+        """Store a failed compensation, logging it if that fails too."""
+        if self.session_factory is None:
+            logging.error("Not retrying %s compensation of %s, no database.",
+                          step, payload)
+            return
+        session = self.session_factory()
+        try:
+            await run(session, add_failure, step, payload, repr(error))
+        except Exception:
+            logging.exception("Could not store %s compensation of %s.",
+                              step, payload)
+        finally:
+            await close(session)
+
+    async def undo(self, step: str, undo: Callable[[Any], Awaitable],
+                   payload: Any):
+        """Undo a step given payload, storing it to retry if that fails."""
+        try:
+            await undo(payload)
+        except Exception as error:
+            await self.record(step, payload, error)
+            raise
+
+    async def retry(self, session: AnySession, after: int = 0) -> List[int]:
+        """Retry one batch of compensations past id after.
+
+        Returns the ids it had, successful or not.
+        """
+        failures = await run(session, due_failures, after, self.batch_size,
+                             self.max_attempts)
+        done: List[int] = []
+        failed: Dict[int, str] = {}
+        for _id, step, payload in failures:
+            try:
+                await self.undoers[step](payload)
+            except Exception as error:
+                logging.warning("Retrying %s compensation of %s failed: %r",
+                                step, payload, error)
+                RETRIED.labels(step, "failed").inc()
+                failed[_id] = repr(error)
+                continue
+            RETRIED.labels(step, "done").inc()
+            done.append(_id)
+        if failures:
+            await run(session, retried, done, failed)
+        return [_id for _id, _, _ in failures]
+
+    async def retry_all(self):
+        """Retry batches until every due compensation was tried once."""
+        session = self.session_factory()
+        try:
+            ids = await self.retry(session)
+            while len(ids) == self.batch_size:
+                ids = await self.retry(session, ids[-1])
+            pending = await run(session, count_failures)
+        finally:
+            await close(session)
+        PENDING.labels().set(pending)
+        record_metric("Custom/failed-compensations/pending", pending)
+
+    async def retry_forever(self):
+        """Retry compensations every retry_interval seconds."""
+        while True:
+            try:
+                await self.retry_all()
+            except Exception:
+                logging.exception("Error when retrying compensations, "
+                                  "retrying in %.0fs.", self.retry_interval)
+            await asyncio.sleep(self.retry_interval)
+
+    def start(self, session_factory: Callable,
+              undoers: Dict[str, Callable[[Any], Awaitable]]):
+        """Store failures with session_factory and retry them with undoers.
+
+        undoers map each step name to the function that undoes it.
+        """
+        self.session_factory = session_factory
+        self.undoers = undoers
+        self.task = asyncio.create_task(self.retry_forever())
+
+    async def stop(self):
+        """Cancel the retry task, stored compensations wait for next start."""
+        await cancel(self.task)
+        self.task = None
+        self.session_factory = None
+
+
+COMPENSATION_RETRIER = CompensationRetrier(
+    CONFIGURATION.compensations.retry_interval,
+    CONFIGURATION.compensations.batch_size,
+    CONFIGURATION.compensations.max_attempts,
+)
@@ -8,6 +8,8 @@ class AppConfig:
 
     log_level = var("WARNING")
     prometheus_port = var(9001, converter=int)
+    locations_max_age = var(86400, converter=int)
+    locations_max_distance = var(3000.0, converter=float)
 
     @config
     class DB:
@@ -19,6 +21,10 @@ class AppConfig:
         host = var("user_db")
         port = var(5432, converter=int)
         database = var("postgres")
+        pool_size = var(5, converter=int)
+        max_overflow = var(10, converter=int)
+        pool_timeout = var(30.0, converter=float)
+        pool_recycle = var(-1, converter=int)
 
     @config(prefix="MONGO")
     class Mongo:
@@ -30,18 +36,51 @@ class AppConfig:
         password = var("fiufit")
         host = var("cluster.mongodb.net")
         database = var("fiufit")
+        asynchronous = bool_var(False)
+        max_pool_size = var(100, converter=int)
+        min_pool_size = var(0, converter=int)
+        max_idle_time = var(60.0, converter=float)
+        server_selection_timeout = var(5.0, converter=float)
+
+    @config(prefix="GEO")
+    class Geo:
+        """Trainer location index and search cache configuration."""
+
+        index = bool_var(False)
+        cell_size = var(0.01, converter=float)
+        refresh_interval = var(300.0, converter=float)
+        cache_size = var(10000, converter=int)
+        cache_ttl = var(30.0, converter=float)
+        cache_cell_size = var(0.005, converter=float)
+        cache_radius_step = var(250, converter=int)
+        cache_max_trainers = var(500, converter=int)
+        max_radius = var(50000, converter=int)
 
     @config
     class AUTH:
         """Authentication service configuration."""
 
         host = var("auth-svc")
+        timeout = var(5.0, converter=float)
+        max_connections = var(100, converter=int)
+        max_keepalive_connections = var(20, converter=int)
+        keepalive_expiry = var(5.0, converter=float)
+        credentials_cache_size = var(10000, converter=int)
+        credentials_cache_ttl = var(30.0, converter=float)
+        credentials_negative_ttl = var(5.0, converter=float)
+        verification = var("remote")
+        jwks_path = var("/auth/.well-known/jwks.json")
+        jwks_refresh = var(300.0, converter=float)
 
     @config
     class PAYMENTS:
         """Payment service configuration."""
 
         host = var("localhost:8020")
+        timeout = var(5.0, converter=float)
+        max_connections = var(100, converter=int)
+        max_keepalive_connections = var(20, converter=int)
+        keepalive_expiry = var(5.0, converter=float)
 
     @config(prefix="REDIS")
     class Redis:
@@ -49,9 +88,60 @@ class AppConfig:
 
         host = var("localhost")
         port = var(6379, converter=int)
+        timeout = var(5.0, converter=float)
+        flush_interval = var(0.5, converter=float)
+        batch_size = var(500, converter=int)
+        buffer_size = var(10000, converter=int)
+        max_backoff = var(60.0, converter=float)
+
+    @config(prefix="LEDGER")
+    class Ledger:
+        """Transactions partitioning and archival configuration."""
+
+        archive_dir = var("archive")
+        keep_months = var(12, converter=int)
+        months_ahead = var(2, converter=int)
+        partition_interval = var(86400.0, converter=float)
+
+    @config(prefix="WALLET_POOL")
+    class WalletPool:
+        """Wallets created ahead of signups configuration."""
+
+        size = var(20, converter=int)
+        refill_interval = var(10.0, converter=float)
+        max_backoff = var(300.0, converter=float)
+
+    @config(prefix="OUTBOX")
+    class Outbox:
+        """Location changes relay to MongoDB configuration."""
+
+        batch_size = var(500, converter=int)
+        poll_interval = var(1.0, converter=float)
+        max_backoff = var(60.0, converter=float)
+
+    @config(prefix="BULK")
+    class Bulk:
+        """Bulk user creation configuration."""
+
+        max_users = var(10000, converter=int)
+        concurrency = var(20, converter=int)
+
+    @config(prefix="COMPENSATIONS")
+    class Compensations:
+        """Retries of failed signup compensations configuration."""
+
+        retry_interval = var(60.0, converter=float)
+        batch_size = var(100, converter=int)
+        max_attempts = var(10, converter=int)
 
     db = group(DB)  # type: ignore
     mongo = group(Mongo)
+    geo = group(Geo)
     payments = group(PAYMENTS)  # type: ignore
     auth = group(AUTH)  # type: ignore
     redis = group(Redis)  # type: ignore
+    ledger = group(Ledger)
+    wallet_pool = group(WalletPool)
+    outbox = group(Outbox)
+    bulk = group(Bulk)
+    compensations = group(Compensations)
@@ -1,19 +1,31 @@
 """Handles CRUD database operations."""
-import math
 import logging
-from datetime import datetime
-from typing import List
-
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-from users.models import Users, FollowedUsers, UsersWallets, Transactions
+from datetime import datetime, timezone
+from typing import List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, insert, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, Session
+from users.models import Users, FollowedUsers, UsersWallets, Transactions, \
+    UsersLocations
+from users.outbox import record_location, record_locations
+from users.pagination import EXACT, paginate, paginate_union
+from users.rollups import record_transaction
 from users.schemas import UserUpdate, UserBase
 
 BANNED_FIELDS_FOR_UPDATE = ["coordinates"]
+USERS_KEY = [Users.id]
+TRANSACTIONS_KEY = [Transactions.date, Transactions.id]
+
 
+def create_user(session: Session, user: UserBase, wallet,
+                coordinates: Optional[Tuple[float, float]] = None):
+    """Create a new user in the users table, using the id as primary key.
 
-def create_user(session: Session, user: UserBase, wallet):
-    """Create a new user in the users table, using the id as primary key."""
+    Coordinates, if given, are queued for MongoDB in the same transaction.
+    """
     db_user = Users(email=user.email, username=user.username,
                     name=user.name, surname=user.surname,
                     height=user.height, weight=user.weight,
@@ -21,13 +33,111 @@ def create_user(session: Session, user: UserBase, wallet):
                     registration_date=user.registration_date,
                     is_athlete=user.is_athlete, is_blocked=False)
     session.add(db_user)
-    session.commit()
+    try:
+        session.flush()
+        session.add(UsersWallets(user_id=db_user.id,
+                                 address=wallet["address"],
+                                 private_key=wallet["privateKey"]))
+        if coordinates is not None:
+            record_location(session, db_user.id, coordinates)
+        session.commit()
+    except IntegrityError as exc:
+        session.rollback()
+        logging.warning("Conflict when creating user: %s", exc.orig)
+        raise HTTPException(
+            status_code=400,
+            detail="User with that email or username already present",
+        ) from exc
     session.refresh(db_user)
-    new_wallet = UsersWallets(user_id=db_user.id, address=wallet["address"],
-                              private_key=wallet["privateKey"])
-    session.add(new_wallet)
-    session.commit()
-    return get_user_by_email(session, user.email)
+    return db_user
+
+
+def create_users(session: Session, users: List[UserBase], wallets: List[dict],
+                 locations: List[Optional[Tuple[float, float]]],
+                 outbox: bool) -> List[Optional[int]]:
+    """Create users with their wallets and locations in one transaction.
+
+    Each table gets a single multi-row insert. Users whose email or
+    username got taken meanwhile are skipped, with None as id. Locations,
+    None for users without one, go to locationOutbox if outbox, else to
+    usersLocations. Returns ids in the order of users, whose usernames
+    must differ.
+    """
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" \
+        else sqlite
+    try:
+        created = dict(session.execute(
+            dialect.insert(Users.__table__).on_conflict_do_nothing()
+            .returning(Users.username, Users.id),
+            [{"email": user.email, "username": user.username,
+              "name": user.name, "surname": user.surname,
+              "height": user.height, "weight": user.weight,
+              "birth_date": user.birth_date, "location": user.location,
+              "registration_date": user.registration_date,
+              "is_athlete": user.is_athlete, "is_blocked": False}
+             for user in users]
+        ).all())
+        ids = [created.get(user.username) for user in users]
+        if created:
+            session.execute(insert(UsersWallets), [
+                {"user_id": _id, "address": wallet["address"],
+                 "private_key": wallet["privateKey"]}
+                for _id, wallet in zip(ids, wallets) if _id is not None
+            ])
+        changes = [(_id, coordinates)
+                   for _id, coordinates in zip(ids, locations)
+                   if _id is not None and coordinates is not None]
+        if changes and outbox:
+            record_locations(session, changes)
+        elif changes:
+            session.execute(insert(UsersLocations), [
+                {"user_id": _id, "longitude": coordinates[0],
+                 "latitude": coordinates[1]}
+                for _id, coordinates in changes
+            ])
+        session.commit()
+    except IntegrityError as exc:
+        session.rollback()
+        logging.warning("Conflict when creating users: %s", exc.orig)
+        raise HTTPException(
+            status_code=400,
+            detail="User with that email or username already present",
+        ) from exc
+    return ids
+
+
+def find_conflict(session: Session, email: Optional[str],
+                  username: Optional[str]) -> Optional[str]:
+    """Return "email" or "username" if a user already has it, else None.
+
+    Emails are compared ignoring case, like the unique index does.
+    """
+    conflict = session.query(Users.email, Users.username).filter(or_(
+        func.lower(Users.email) == (email or "").lower(),
+        Users.username == username,
+    )).first()
+    if conflict is None:
+        return None
+    if email and (conflict.email or "").lower() == email.lower():
+        return "email"
+    return "username"
+
+
+def find_conflicts(session: Session, emails: List[str],
+                   usernames: List[str]) -> Tuple[Set[str], Set[str]]:
+    """Return the emails, lowercased, and usernames already taken.
+
+    Checks a whole batch in one query.
+    """
+    lowered = {email.lower() for email in emails}
+    rows = session.query(Users.email, Users.username).filter(or_(
+        func.lower(Users.email).in_(lowered),
+        Users.username.in_(usernames),
+    )).all()
+    return (
+        {(row.email or "").lower() for row in rows} & lowered,
+        {row.username for row in rows} & set(usernames),
+    )
 
 
 def get_user_by_id(session: Session, user_id: int):
@@ -57,71 +167,67 @@ def get_user_by_username(session: Session, username: str):
 
 def add_transaction(session: Session, sender: str,
                     receiver: str, amount: float):
-    """Store transactions details."""
-    date = datetime.now()
+    """Store transactions details, along with their rollups.
+
+    Dates are stored as naive UTC, like the ledger expects.
+    """
+    date = datetime.now(timezone.utc).replace(tzinfo=None)
     new_transaction = Transactions(sender=sender,
                                    receiver=receiver,
                                    amount=amount,
                                    date=date)
     session.add(new_transaction)
+    record_transaction(session, new_transaction)
     session.commit()
     session.refresh(new_transaction)
 
 
+# pylint: disable=too-many-arguments
 def get_all_transactions(session: Session, address: str,
-                         minimum: float, limit: int, offset: int):
-    """Return details from a user identified by a certain username."""
+                         minimum: float, limit: int, offset: int,
+                         cursor: Optional[str] = None, count: str = EXACT,
+                         since: Optional[datetime] = None,
+                         until: Optional[datetime] = None,
+                         newest_first: bool = False):
+    """Return transactions, by offset or after a cursor if there is one.
+
+    Sorted by date, filtered by wallet address as sender or receiver, and
+    by date from since (included) to until (excluded).
+    """
+    transactions = session.query(Transactions) \
+        .filter(Transactions.amount >= minimum)
+    if since:
+        transactions = transactions.filter(Transactions.date >= since)
+    if until:
+        transactions = transactions.filter(Transactions.date < until)
     if address:
-        transactions = session.query(Transactions). \
-            filter(or_(Transactions.sender == address,
-                       Transactions.receiver == address
-                       )
-                   ).filter(Transactions.amount >= minimum)
-    else:
-        transactions = session.query(Transactions) \
-            .filter(Transactions.amount >= minimum)
-    items = transactions.limit(limit).offset(offset).all()
-    size = len(items)
-    total = transactions.count()
-    pages = math.ceil(total / limit)
-    page = 1 + math.ceil(offset / limit)
-    return {"items": items, "total": total,
-            "page": page, "size": size, "pages": pages}
+        return paginate_union(
+            transactions,
+            [Transactions.sender == address, Transactions.receiver == address],
+            TRANSACTIONS_KEY, limit, offset, cursor, count, newest_first,
+        )
+    return paginate(transactions, TRANSACTIONS_KEY, limit, offset,
+                    cursor, count, newest_first)
 
 
 def get_user_by_email(session: Session, email: str):
     """Return details from a user identified by a certain username."""
-    return session.query(Users).filter(Users.email == email).first()
+    return session.query(Users) \
+        .filter(func.lower(Users.email) == email.lower()).first()
 
 
-def get_all_users(session: Session, limit: int, offset: int):
+def get_all_users(session: Session, limit: int, offset: int,
+                  cursor: Optional[str] = None, count: str = EXACT):
     """Return all users currently present in the session with pagination."""
-    total = session.query(Users).count()
-    items = session.query(Users).limit(limit).offset(offset).all()
-    size = len(items)
-    pages = math.ceil(total / limit)
-    page = 1 + math.ceil(offset / limit)
-    return {"items": items, "total": total,
-            "page": page, "size": size, "pages": pages}
-
-
-def get_users_by_id(
-    session: Session, user_ids: List[int], limit: int, offset: int
-) -> List:
-    """Get user data by id."""
-    query = session.query(Users).filter(Users.id.in_(user_ids))
-    total = query.count()
-    items = query.limit(limit).offset(offset).all()
-    size = len(items)
-    pages = math.ceil(total / limit)
-    page = 1 + math.ceil(offset / limit)
-    return {
-        "items": items,
-        "total": total,
-        "page": page,
-        "size": size,
-        "pages": pages
-    }
+    return paginate(session.query(Users), USERS_KEY, limit, offset,
+                    cursor, count)
+
+
+def get_users_in_order(session: Session, user_ids: List[int]) -> List:
+    """Get users by id, in the same order as user_ids."""
+    users = session.query(Users).filter(Users.id.in_(user_ids)).all()
+    by_id = {user.id: user for user in users}
+    return [by_id[_id] for _id in user_ids if _id in by_id]
 
 
 def change_blocked_status(session: Session, user_id: int):
@@ -145,16 +251,23 @@ def delete_user(session: Session, user_id: int):
     session.commit()
 
 
-def update_user(session: Session, _id: int, user: UserUpdate):
-    """Update an existing user."""
+def update_user(session: Session, _id: int, user: UserUpdate,
+                coordinates: Optional[Tuple[float, float]] = None):
+    """Update an existing user.
+
+    Coordinates, if given, are queued for MongoDB in the same transaction.
+    """
     columns_to_update = {
         col: value for col, value in user.__dict__.items() if
         value is not None and col not in BANNED_FIELDS_FOR_UPDATE
     }
     logging.debug("Updating %s", columns_to_update)
-    session.query(Users) \
-        .filter(Users.id == _id) \
-        .update(values=columns_to_update)
+    if columns_to_update:
+        session.query(Users) \
+            .filter(Users.id == _id) \
+            .update(values=columns_to_update)
+    if coordinates is not None:
+        record_location(session, _id, coordinates)
     session.commit()
 
 
@@ -170,42 +283,86 @@ def get_details_with_id(session: Session, user_id: int):
     return user.email, user.username
 
 
-def get_users_followed_by(session: Session, _id: int):
-    """Get all users followed by specified id."""
-    vec = []
-    users = session.query(FollowedUsers).filter(FollowedUsers.id == _id).all()
-    for pair in users:
-        vec.append(get_user_by_id(session, pair.followed_id))
-    return vec
-
-
-def get_followers(session: Session, _id: int):
-    """Get all users who follow the specified id."""
-    vec = []
-    users = session.query(FollowedUsers) \
-        .filter(FollowedUsers.followed_id == _id).all()
-    for pair in users:
-        vec.append(get_user_by_id(session, pair.id))
-    return vec
-
-
-def follow_new_user(session: Session, user_id: int, _id: int):
+def select_fields(query: Query, fields: Optional[List[str]]) -> Query:
+    """Restrict a users query to some columns, id is always included.
+
+    Raises HTTPException for unknown column names.
+    """
+    if not fields:
+        return query
+    columns = Users.__table__.columns
+    unknown = set(fields) - set(columns.keys())
+    if unknown:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown fields: {sorted(unknown)}")
+    names = ["id"] + [name for name in fields if name != "id"]
+    return query.with_entities(*(getattr(Users, name) for name in names))
+
+
+def paginate_users(query: Query, fields: Optional[List[str]], limit: int,
+                   cursor: Optional[str], count: str) -> dict:
+    """Return a page of a users query, with rows as dicts if projected."""
+    page = paginate(select_fields(query, fields), USERS_KEY, limit, 0,
+                    cursor, count)
+    if fields:
+        page["items"] = [row._asdict() for row in page["items"]]
+    return page
+
+
+# pylint: disable=too-many-arguments
+def get_users_followed_by(session: Session, _id: int, limit: int = 100,
+                          cursor: Optional[str] = None,
+                          fields: Optional[List[str]] = None,
+                          count: str = EXACT):
+    """Get users followed by specified id, in a single query."""
+    query = session.query(Users) \
+        .join(FollowedUsers, FollowedUsers.followed_id == Users.id) \
+        .filter(FollowedUsers.id == _id)
+    return paginate_users(query, fields, limit, cursor, count)
+
+
+# pylint: disable=too-many-arguments
+def get_followers(session: Session, _id: int, limit: int = 100,
+                  cursor: Optional[str] = None,
+                  fields: Optional[List[str]] = None,
+                  count: str = EXACT):
+    """Get users who follow the specified id, in a single query."""
+    query = session.query(Users) \
+        .join(FollowedUsers, FollowedUsers.id == Users.id) \
+        .filter(FollowedUsers.followed_id == _id)
+    return paginate_users(query, fields, limit, cursor, count)
+
+
+def follow_new_user(session: Session, user_id: int, _id: int) -> dict:
     """Add new followed user to specified user."""
-    if session.query(FollowedUsers).filter(FollowedUsers.id == user_id,
-                                           FollowedUsers.followed_id == _id) \
-            .first() is not None:
-        return get_users_followed_by(session, user_id)
-    new_follow = FollowedUsers(id=user_id, followed_id=_id)
-    session.add(new_follow)
+    follow = {"id": user_id, "followed_id": _id, "following": True}
+    if session.get(FollowedUsers, (user_id, _id)) is not None:
+        return follow
+    session.add(FollowedUsers(id=user_id, followed_id=_id))
     session.commit()
-    session.refresh(new_follow)
-    return get_users_followed_by(session, user_id)
+    return follow
 
 
-def unfollow_user(session: Session, user_id: int, _id: int):
+def unfollow_user(session: Session, user_id: int, _id: int) -> dict:
     """Unfollow specified user."""
     session.query(FollowedUsers).filter(FollowedUsers.id == user_id,
                                         FollowedUsers.followed_id == _id) \
         .delete()
     session.commit()
-    return get_users_followed_by(session, user_id)
+    return {"id": user_id, "followed_id": _id, "following": False}
+
+
+def set_location(session: Session, user_id: int,
+                 coordinates: Tuple[float, float]):
+    """Save coordinates for a user. Creates if does not exist."""
+    session.merge(UsersLocations(user_id=user_id, longitude=coordinates[0],
+                                 latitude=coordinates[1]))
+    session.commit()
+
+
+def get_trainer_locations(session: Session) -> List:
+    """Return (user_id, (longitude, latitude)) for every saved location."""
+    rows = session.query(UsersLocations.user_id, UsersLocations.longitude,
+                         UsersLocations.latitude).all()
+    return [(user_id, (longitude, latitude))
+            for user_id, longitude, latitude in rows]
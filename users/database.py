@@ -1,7 +1,94 @@
 """Handles database connection."""
-from sqlalchemy import URL
+import time
+from typing import Callable, Union
+
+from newrelic.agent import record_custom_metric as record_metric
+from sqlalchemy import URL, MetaData, create_engine, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from users.config import AppConfig
+from users.telemetry import REGISTRY, Gauge
+
+ASYNC_DRIVERS = {"asyncpg", "aiosqlite"}
+
+AnySession = Union[Session, AsyncSession]
+
+
+class PoolStats:
+    """Connection pool checkout counters."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.checked_out = 0
+
+    def record(self, waited: float, checked_out: int):
+        """Account for one checkout that took waited seconds."""
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.checked_out = checked_out
+        record_metric("Custom/db-pool/checkout-wait", waited)
+        record_metric("Custom/db-pool/checked-out", checked_out)
+
+    def stats(self) -> dict:
+        """Return counters, with average wait in seconds."""
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "checked_out": self.checked_out,
+            "wait_avg": self.wait_total / self.checkouts
+            if self.checkouts else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+POOL_STATS = PoolStats()
+POOL_GAUGE = REGISTRY.register(Gauge(
+    "db_pool", "Connection pool checkout counters.", ("stat",)
+))
+
+
+def collect_pool_stats():
+    """Copy pool counters into POOL_GAUGE."""
+    for stat, value in POOL_STATS.stats().items():
+        POOL_GAUGE.labels(stat).set(value)
+
+
+REGISTRY.add_collector(collect_pool_stats)
+
+
+class TimedPoolMixin:
+    """Measure how long getting a connection from the pool takes."""
+
+    def connect(self):
+        """Check out a connection, recording wait time and timeouts."""
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_STATS.timeouts += 1
+            raise
+        finally:
+            POOL_STATS.record(time.perf_counter() - start, self.checkedout())
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    """Queue pool for sync engines, with checkout metrics."""
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    """Queue pool for async engines, with checkout metrics."""
 
 
 def get_database_url(config: AppConfig) -> URL:
@@ -14,3 +101,90 @@ def get_database_url(config: AppConfig) -> URL:
         port=config.db.port,
         database=config.db.database,
     )
+
+
+def is_async(config: AppConfig) -> bool:
+    """Return true if the configured driver is asyncio based.
+
+    For example, "postgresql+asyncpg" instead of "postgresql".
+    """
+    return config.db.driver.partition("+")[2] in ASYNC_DRIVERS
+
+
+def get_pool_arguments(config: AppConfig) -> dict:
+    """Return pool sizing for the engine.
+
+    SQLite picks its own pool, which can't be sized.
+    """
+    if config.db.driver.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": TimedAsyncQueuePool if is_async(config)
+        else TimedQueuePool,
+        "pool_size": config.db.pool_size,
+        "max_overflow": config.db.max_overflow,
+        "pool_timeout": config.db.pool_timeout,
+        "pool_recycle": config.db.pool_recycle,
+    }
+
+
+def build_engine(config: AppConfig) -> Union[Engine, AsyncEngine]:
+    """Create a sync or async engine, depending on the driver."""
+    if is_async(config):
+        return create_async_engine(
+            get_database_url(config),
+            pool_pre_ping=True,
+            **get_pool_arguments(config),
+        )
+    return create_engine(
+        get_database_url(config),
+        pool_pre_ping=True,
+        **get_pool_arguments(config),
+    )
+
+
+def build_session_factory(engine: Union[Engine, AsyncEngine]) -> Callable:
+    """Create sessions bound to engine, async ones for async engines."""
+    if isinstance(engine, AsyncEngine):
+        # Objects are used after commit, and async sessions can't lazy load.
+        return async_sessionmaker(
+            engine, autoflush=False, expire_on_commit=False
+        )
+    return sessionmaker(engine, autoflush=False)
+
+
+async def create_tables(engine: Union[Engine, AsyncEngine],
+                        metadata: MetaData):
+    """Create missing tables."""
+    if isinstance(engine, AsyncEngine):
+        async with engine.begin() as connection:
+            await connection.run_sync(metadata.create_all)
+    else:
+        metadata.create_all(bind=engine)
+
+
+async def dispose(engine: Union[Engine, AsyncEngine]):
+    """Close every pooled connection."""
+    if isinstance(engine, AsyncEngine):
+        await engine.dispose()
+    else:
+        engine.dispose()
+
+
+async def run(session: AnySession, function: Callable, *args, **kwargs):
+    """Call a CRUD function with session as first argument.
+
+    Async sessions run it through run_sync, so queries go through the async
+    driver and never block the event loop.
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(function, *args, **kwargs)
+    return function(session, *args, **kwargs)
+
+
+async def close(session: AnySession):
+    """Close a sync or async session."""
+    if isinstance(session, AsyncSession):
+        await session.close()
+    else:
+        session.close()
@@ -0,0 +1,126 @@
+"""Streaming exports of the transactions ledger, as NDJSON or CSV.
+
+Rows are read through a server-side cursor, yield_per rows at a time,
+and each batch is sent before the next one is fetched, so memory stays
+constant however many transactions match. Archived months are streamed
+from their files first when since falls in them, like list_transactions.
+"""
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Iterator, List, Optional, Union
+
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from users.crud import TRANSACTIONS_KEY
+from users.ledger import ARCHIVE_COLUMNS, archive_boundary, matches, \
+    read_archive
+from users.models import Transactions
+
+# Media type of each export format.
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Rows fetched per round trip, and sent per chunk.
+BATCH_SIZE = 1000
+
+
+def transactions_query(address: Optional[str], minimum: float,
+                       since: Optional[datetime], until: Optional[datetime]):
+    """Return the filtered transactions columns, sorted by (date, id)."""
+    columns = [getattr(Transactions, name) for name in ARCHIVE_COLUMNS]
+    query = select(*columns).where(Transactions.amount >= minimum)
+    if address:
+        query = query.where(or_(Transactions.sender == address,
+                                Transactions.receiver == address))
+    if since:
+        query = query.where(Transactions.date >= since)
+    if until:
+        query = query.where(Transactions.date < until)
+    return query.order_by(*TRANSACTIONS_KEY) \
+        .execution_options(yield_per=BATCH_SIZE)
+
+
+def render(rows: List, export_format: str) -> str:
+    """Serialize a batch of rows, one line each."""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [row.id, row.sender, row.receiver, row.amount,
+             row.date.isoformat()] for row in rows
+        )
+        return buffer.getvalue()
+    return "".join(json.dumps({
+        "id": row.id, "sender": row.sender, "receiver": row.receiver,
+        "amount": row.amount, "date": row.date.isoformat(),
+    }) + "\n" for row in rows)
+
+
+def header(export_format: str) -> str:
+    """Return what comes before the first row."""
+    if export_format == "csv":
+        return ",".join(ARCHIVE_COLUMNS) + "\r\n"
+    return ""
+
+
+def archived(directory: str, address: Optional[str], minimum: float,
+             since: Optional[datetime],
+             until: Optional[datetime]) -> Iterator[Transactions]:
+    """Yield matching archived rows, if since falls in archived months."""
+    boundary = archive_boundary(directory)
+    if boundary is None or since is None or since >= boundary:
+        return
+    for row in read_archive(directory, since, until):
+        if matches(row, address, minimum):
+            yield row
+
+
+# pylint: disable=too-many-arguments
+def stream_sync(session: Session, directory: str, address: Optional[str],
+                minimum: float, since: Optional[datetime],
+                until: Optional[datetime],
+                export_format: str) -> Iterator[str]:
+    """Yield the export in chunks, through a sync session."""
+    yield header(export_format)
+    rows = archived(directory, address, minimum, since, until)
+    while batch := list(islice(rows, BATCH_SIZE)):
+        yield render(batch, export_format)
+    result = session.execute(transactions_query(address, minimum, since,
+                                                until))
+    for batch in result.partitions():
+        yield render(batch, export_format)
+
+
+# pylint: disable=too-many-arguments
+async def stream_async(session: AsyncSession, directory: str,
+                       address: Optional[str], minimum: float,
+                       since: Optional[datetime], until: Optional[datetime],
+                       export_format: str) -> AsyncIterator[str]:
+    """Yield the export in chunks, through an async session.
+
+    Archive files are read in a worker thread, to keep the loop free.
+    """
+    yield header(export_format)
+    rows = archived(directory, address, minimum, since, until)
+    while batch := await asyncio.to_thread(list, islice(rows, BATCH_SIZE)):
+        yield render(batch, export_format)
+    result = await session.stream(transactions_query(address, minimum,
+                                                     since, until))
+    async for batch in result.partitions():
+        yield render(batch, export_format)
+
+
+# pylint: disable=too-many-arguments
+def export_transactions(
+    session: Union[Session, AsyncSession], directory: str,
+    address: Optional[str], minimum: float, since: Optional[datetime],
+    until: Optional[datetime], export_format: str
+) -> Union[Iterator[str], AsyncIterator[str]]:
+    """Return the chunks of an export of matching transactions."""
+    stream = stream_async if isinstance(session, AsyncSession) \
+        else stream_sync
+    return stream(session, directory, address, minimum, since, until,
+                  export_format)
@@ -0,0 +1,150 @@
+"""Cache of trainers around geo cells, shared by close by searches."""
+import math
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from users.cache import TTLCache
+from users.geo_index import Cell, Point, cell_of, cells_around, distance_m
+
+# A cell center and the radius covering searches from the whole cell.
+Area = Tuple[Point, int]
+
+
+class GeoCache:
+    """Trainers and their points, keyed by geo cell and radius bucket.
+
+    Searches are keyed by the cell_size degrees cell holding their
+    location, and their radius rounded up to a multiple of radius_step
+    meters, so users in the same neighborhood share entries. An entry
+    holds every trainer closer to the cell center than that radius plus
+    half the cell's diagonal, which covers searches from anywhere in the
+    cell. Searches measure distances from their own location and page
+    them, see users.geo_index.nearest. Areas with more than max_trainers
+    trainers are cached as None, for searches to page them in the
+    database instead. Entries are dropped when a trainer moves in or out
+    of their area, and expire after ttl seconds for changes made by other
+    replicas.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, cell_size: float, radius_step: int, max_size: int,
+                 ttl: float, max_trainers: int = 500):
+        self.cell_size = cell_size
+        self.radius_step = radius_step
+        self.max_trainers = max_trainers
+        self.results = TTLCache(max_size, ttl, on_remove=self.forget)
+        self.invalidations = 0
+        # Cached areas by trainer they hold, and by radius bucket and cell,
+        # so invalidations only look at the areas they may affect.
+        self.holding: Dict[int, Set[Area]] = {}
+        self.cells: Dict[int, Dict[Cell, int]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Return false if the cache can't hold any entry."""
+        return self.results.max_size > 0
+
+    @property
+    def max_padding(self) -> int:
+        """Return the most an area's radius exceeds its bucket."""
+        # Cells are widest at the equator.
+        return math.ceil(self.half_diagonal(
+            (self.cell_size / 2, self.cell_size / 2)
+        ))
+
+    def half_diagonal(self, center: Point) -> float:
+        """Return meters from a cell center to its farthest corner."""
+        half = self.cell_size / 2
+        return max(distance_m(center, (center[0] + half, center[1] + lat))
+                   for lat in (-half, half))
+
+    def search_area(self, location: Point, radius: int) -> Tuple[Point, int]:
+        """Return cell center and radius covering searches like this one."""
+        if not self.enabled:
+            return location, radius
+        center = self.center_of(cell_of(location, self.cell_size))
+        bucket = math.ceil(radius / self.radius_step) * self.radius_step
+        return center, bucket + math.ceil(self.half_diagonal(center))
+
+    def center_of(self, cell: Cell) -> Point:
+        """Return the center of a cell."""
+        return ((cell[0] + 0.5) * self.cell_size,
+                (cell[1] + 0.5) * self.cell_size)
+
+    def bucket_of(self, area: Area) -> int:
+        """Return the radius bucket an area was built from."""
+        center, radius = area
+        return radius - math.ceil(self.half_diagonal(center))
+
+    def get(self, area: Area, default: Any = None) -> Optional[List]:
+        """Return (user_id, point) of trainers in a search area.
+
+        None if there were too many, default if not cached.
+        """
+        return self.results.get(area, default)
+
+    def set(self, area: Area, trainers: Optional[List]):
+        """Store (user_id, point) of every trainer in a search area.
+
+        None marks areas with more than max_trainers of them.
+        """
+        if not self.enabled:
+            return
+        self.results.set(area, trainers)
+        center, radius = area
+        self.cells.setdefault(self.bucket_of(area), {})[
+            cell_of(center, self.cell_size)] = radius
+        for user_id, _ in trainers or ():
+            self.holding.setdefault(user_id, set()).add(area)
+
+    def forget(self, area: Area, trainers: Optional[List]):
+        """Remove an area leaving the cache from the reverse indexes."""
+        bucket = self.bucket_of(area)
+        cells = self.cells.get(bucket, {})
+        cells.pop(cell_of(area[0], self.cell_size), None)
+        if not cells:
+            self.cells.pop(bucket, None)
+        for user_id, _ in trainers or ():
+            areas = self.holding.get(user_id, set())
+            areas.discard(area)
+            if not areas:
+                self.holding.pop(user_id, None)
+
+    def areas_containing(self, point: Point) -> List[Area]:
+        """Return cached areas whose circle contains point."""
+        found = []
+        for bucket, cells in self.cells.items():
+            for cell in cells_around(point, bucket + self.max_padding,
+                                     self.cell_size, cells):
+                center = self.center_of(cell)
+                if distance_m(center, point) <= cells[cell]:
+                    found.append((center, cells[cell]))
+        return found
+
+    def invalidate(self, user_id: int, *points: Optional[Point]):
+        """Drop searches a trainer moved into or out of.
+
+        Those holding the trainer, or whose area contains any of points,
+        usually the previous and new location.
+        """
+        stale = set(self.holding.get(user_id, ()))
+        for point in points:
+            if point is not None:
+                stale.update(self.areas_containing(point))
+        for area in stale:
+            self.results.delete(area)
+            self.invalidations += 1
+
+    def clear(self):
+        """Remove every entry."""
+        self.results.clear()
+        self.holding.clear()
+        self.cells.clear()
+
+    def stats(self) -> dict:
+        """Return cache counters, with invalidations."""
+        return self.results.stats() | {
+            "invalidations": self.invalidations,
+            "cell_size": self.cell_size,
+            "radius_step": self.radius_step,
+            "max_trainers": self.max_trainers,
+        }
@@ -0,0 +1,203 @@
+"""In-memory spatial index over trainer locations."""
+import asyncio
+import logging
+import math
+from itertools import islice
+from typing import Callable, Collection, Dict, Iterable, List, Optional, \
+    Tuple
+
+from users.pagination import decode_values, encode_cursor
+from users.tasks import cancel
+
+# Same radius MongoDB uses for spherical distances.
+EARTH_RADIUS_M = 6378100
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+Point = Tuple[float, float]
+Cell = Tuple[int, int]
+
+
+def distance_m(origin: Point, target: Point) -> float:
+    """Return great circle distance in meters between (lon, lat) points."""
+    lon_1, lat_1 = map(math.radians, origin)
+    lon_2, lat_2 = map(math.radians, target)
+    half_chord = math.sin((lat_2 - lat_1) / 2) ** 2 + \
+        math.cos(lat_1) * math.cos(lat_2) * \
+        math.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(half_chord)))
+
+
+def cell_of(point: Point, cell_size: float) -> Cell:
+    """Return the cell_size degrees cell containing a (lon, lat) point."""
+    return (math.floor(point[0] / cell_size),
+            math.floor(point[1] / cell_size))
+
+
+def cells_around(center: Point, radius: float, cell_size: float,
+                 populated: Collection[Cell]) -> List[Cell]:
+    """Return populated cells overlapping the bounding box of a circle.
+
+    Walks the populated cells instead of the box when the box spans more
+    cells than there are.
+    """
+    lat_span = radius / METERS_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(center[1])), 1e-6)
+    lon_span = lat_span / cos_lat
+    lon_min, lat_min = cell_of((center[0] - lon_span, center[1] - lat_span),
+                               cell_size)
+    lon_max, lat_max = cell_of((center[0] + lon_span, center[1] + lat_span),
+                               cell_size)
+    if (lon_max - lon_min + 1) * (lat_max - lat_min + 1) > len(populated):
+        return [(lon, lat) for lon, lat in populated
+                if lon_min <= lon <= lon_max and lat_min <= lat <= lat_max]
+    return [(lon, lat) for lon in range(lon_min, lon_max + 1)
+            for lat in range(lat_min, lat_max + 1) if (lon, lat) in populated]
+
+
+def nearest(points: Iterable[Tuple[int, Point]], center: Point,
+            radius: float) -> List[Tuple[float, int]]:
+    """Return (distance, user_id) of points within radius, closest first."""
+    found = []
+    for user_id, point in points:
+        distance = distance_m(center, point)
+        if distance <= radius:
+            found.append((distance, user_id))
+    found.sort()
+    return found
+
+
+def page_within(
+    found: List[Tuple[float, int]],
+    limit: int,
+    offset: int,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+) -> dict:
+    """Return one page of sorted (distance, user_id) pairs.
+
+    Answers with the same page shape as users.mongodb.get_users_within,
+    and a cursor holds the last pair like in MongoDB searches.
+    """
+    total = len(found) if with_total else None
+    if cursor:
+        after = tuple(decode_values(cursor, 2))
+        found = [pair for pair in found if pair > after]
+        offset = 0
+    page = found[offset:offset + limit + 1]
+    items = [{"user_id": user_id, "distance": distance}
+             for distance, user_id in page[:limit]]
+    return {
+        "items": items,
+        "total": total,
+        "next_cursor": encode_cursor(list(page[limit - 1]))
+        if len(page) > limit else None,
+    }
+
+
+class GeoIndex:
+    """Grid of square cells, cell_size degrees wide, holding user points.
+
+    Radius searches only look at cells overlapping the bounding box of the
+    circle, and answer with the same page shape as
+    users.mongodb.get_users_within.
+    """
+
+    def __init__(self, cell_size: float, refresh_interval: float = 300.0):
+        self.cell_size = cell_size
+        self.refresh_interval = refresh_interval
+        self.cells: Dict[Cell, Dict[int, Point]] = {}
+        self.points: Dict[int, Point] = {}
+        self.ready = False
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def cell_of(self, point: Point) -> Cell:
+        """Return the cell containing a (lon, lat) point."""
+        return cell_of(point, self.cell_size)
+
+    def set(self, user_id: int, point: Point):
+        """Add user at point, moving it if already indexed."""
+        self.remove(user_id)
+        point = (float(point[0]), float(point[1]))
+        self.points[user_id] = point
+        self.cells.setdefault(self.cell_of(point), {})[user_id] = point
+
+    def remove(self, user_id: int):
+        """Remove user if indexed."""
+        point = self.points.pop(user_id, None)
+        if point is None:
+            return
+        cell = self.cell_of(point)
+        del self.cells[cell][user_id]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def load(self, locations: Iterable[Tuple[int, Point]]):
+        """Replace every indexed user with (user_id, point) pairs."""
+        index = GeoIndex(self.cell_size)
+        for user_id, point in locations:
+            index.set(user_id, point)
+        self.cells, self.points = index.cells, index.points
+        self.ready = True
+        logging.info("Indexed %d trainer locations.", len(self.points))
+
+    def candidates(self, center: Point, radius: float) -> Iterable:
+        """Yield (user_id, point) in cells overlapping the search circle."""
+        for cell in cells_around(center, radius, self.cell_size, self.cells):
+            yield from self.cells[cell].items()
+
+    def around(self, center: Point, radius: float,
+               limit: Optional[int] = None) -> List[Tuple[int, Point]]:
+        """Return (user_id, point) of users within radius meters.
+
+        Stops after limit users, if given.
+        """
+        return list(islice(
+            ((user_id, point)
+             for user_id, point in self.candidates(center, radius)
+             if distance_m(center, point) <= radius),
+            limit,
+        ))
+
+    # pylint: disable=too-many-arguments
+    def within(
+        self,
+        center: Point,
+        radius: float,
+        limit: int,
+        offset: int,
+        cursor: Optional[str] = None,
+        with_total: bool = True,
+    ) -> dict:
+        """Return one page of users within radius meters, closest first.
+
+        Pages are sorted by distance, then user id, see page_within.
+        """
+        return page_within(
+            nearest(self.candidates(center, radius), center, radius),
+            limit, offset, cursor, with_total,
+        )
+
+    # pylint: disable=broad-exception-caught
+    async def refresh_forever(self, loader: Callable):
+        """Reload every refresh_interval seconds from the location store.
+
+        Picks up locations saved by other replicas.
+        """
+        while True:
+            try:
+                self.load(await loader())
+            except Exception:
+                logging.exception("Error when loading trainer locations.")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, loader: Callable):
+        """Load locations now and keep reloading in a background task."""
+        self.task = asyncio.create_task(self.refresh_forever(loader))
+
+    async def stop(self):
+        """Cancel the reload task."""
+        await cancel(self.task)
+        self.task = None
@@ -0,0 +1,468 @@
+"""Monthly partitions of the transactions ledger, and their archive.
+
+On Postgres, transactions is partitioned by month of date, so listings
+with a date range only read the partitions they overlap. Partitions of
+upcoming months are added on startup and every partition_interval
+seconds, see PartitionKeeper. Closed months
+older than keep_months are exported to gzip CSV files in archive_dir, one
+per month, and dropped from the database:
+
+    python -m users.ledger
+
+Listings whose since date falls in an archived month stream those files
+before reading the database, see list_transactions.
+"""
+import asyncio
+import csv
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterator, List, Optional, Union
+
+from environ import to_config
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+from users.config import AppConfig
+from users.crud import TRANSACTIONS_KEY, get_all_transactions
+from users.database import AnySession, build_engine, dispose, run
+from users.models import Transactions
+from users.pagination import EXACT, NO_TOTAL, cursor_for, decode_cursor, \
+    offset_page
+from users.tasks import cancel
+
+CONFIGURATION = to_config(AppConfig)
+ARCHIVE_COLUMNS = ["id", "sender", "receiver", "amount", "date"]
+ARCHIVE_FILE = re.compile(r"^transactions_(\d{4})_(\d{2})\.csv\.gz$")
+# Live rows read per query when merging them with archived ones.
+CHUNK_SIZE = 500
+
+
+def month_start(day: datetime) -> datetime:
+    """Return midnight of the first day of the month of day."""
+    return datetime(day.year, day.month, 1)
+
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Return value as a naive UTC date time, like ledger dates.
+
+    Naive values are taken to be UTC already.
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_now() -> datetime:
+    """Return the current naive UTC date time."""
+    return naive_utc(datetime.now(timezone.utc))
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    """Return the start of the month months after start's."""
+    index = start.year * 12 + start.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    """Return the name of the partition holding start's month."""
+    return f"transactions_{start:%Y_%m}"
+
+
+def archive_path(directory: str, start: datetime) -> str:
+    """Return the archive file of start's month."""
+    return os.path.join(directory, f"{partition_name(start)}.csv.gz")
+
+
+def is_partitioned(connection: Connection) -> bool:
+    """Return true if transactions is a Postgres partitioned table."""
+    if connection.dialect.name != "postgresql":
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'transactions'"
+    )).first() is not None
+
+
+def partition_exists(connection: Connection, start: datetime) -> bool:
+    """Return true if start's month has its own partition."""
+    return connection.execute(
+        text("SELECT to_regclass(:name)"), {"name": partition_name(start)}
+    ).scalar() is not None
+
+
+def create_partition(connection: Connection, start: datetime):
+    """Create the partition of start's month.
+
+    Postgres refuses it while the default partition holds rows of that
+    month, so the default partition is detached meanwhile and those rows
+    are moved to the new one.
+    """
+    end = add_months(start, 1)
+    for statement in (
+        "ALTER TABLE transactions DETACH PARTITION transactions_default",
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} "
+        "PARTITION OF transactions "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')",
+        "WITH moved AS (DELETE FROM transactions_default "
+        f"WHERE date >= '{start:%Y-%m-%d}' AND date < '{end:%Y-%m-%d}' "
+        "RETURNING id, sender, receiver, amount, date) "
+        "INSERT INTO transactions (id, sender, receiver, amount, date) "
+        "SELECT id, sender, receiver, amount, date FROM moved",
+        "ALTER TABLE transactions ATTACH PARTITION transactions_default "
+        "DEFAULT",
+    ):
+        connection.execute(text(statement))
+
+
+def create_partitions(connection: Connection, first: datetime,
+                      last: datetime):
+    """Create missing partitions for months from first to last."""
+    start = month_start(first)
+    while start <= last:
+        if not partition_exists(connection, start):
+            logging.info("Creating partition %s...", partition_name(start))
+            create_partition(connection, start)
+        start = add_months(start, 1)
+
+
+def partition_transactions(connection: Connection):
+    """Turn transactions into a table partitioned by month on Postgres.
+
+    Rows are copied into partitions for every month they cover, plus a
+    default partition for dates outside them.
+    """
+    if connection.dialect.name != "postgresql" or \
+            is_partitioned(connection):
+        return
+    logging.info("Partitioning transactions by month...")
+    oldest = connection.execute(
+        select(func.min(Transactions.date))
+    ).scalar() or utc_now()
+    for statement in (
+        "ALTER TABLE transactions RENAME TO transactions_unpartitioned",
+        "ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT "
+        "transactions_pkey TO transactions_unpartitioned_pkey",
+        "ALTER SEQUENCE transactions_id_seq OWNED BY NONE",
+        "CREATE TABLE transactions ("
+        "id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'), "
+        "sender VARCHAR, receiver VARCHAR, amount FLOAT, "
+        "date TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+        "PRIMARY KEY (id, date)) PARTITION BY RANGE (date)",
+        "CREATE TABLE transactions_default PARTITION OF transactions DEFAULT",
+    ):
+        connection.execute(text(statement))
+    create_partitions(connection, oldest, add_months(
+        month_start(utc_now()), CONFIGURATION.ledger.months_ahead
+    ))
+    for statement in (
+        "INSERT INTO transactions (id, sender, receiver, amount, date) "
+        "SELECT id, sender, receiver, amount, date "
+        "FROM transactions_unpartitioned",
+        "DROP TABLE transactions_unpartitioned",
+        "ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id",
+    ):
+        connection.execute(text(statement))
+
+
+def add_upcoming_partitions(connection: Connection):
+    """Create partitions up to months_ahead months from now."""
+    if is_partitioned(connection):
+        now = month_start(utc_now())
+        create_partitions(connection, now, add_months(
+            now, CONFIGURATION.ledger.months_ahead
+        ))
+
+
+async def add_partitions(engine: Union[Engine, AsyncEngine]):
+    """Create upcoming partitions in their own transaction."""
+    if isinstance(engine, AsyncEngine):
+        async with engine.begin() as connection:
+            await connection.run_sync(add_upcoming_partitions)
+    else:
+        with engine.begin() as connection:
+            add_upcoming_partitions(connection)
+
+
+class PartitionKeeper:
+    """Creates upcoming partitions every interval seconds.
+
+    Startup migrations only cover months_ahead months, this keeps
+    long-running replicas from writing new months to the default
+    partition.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+
+    # pylint: disable=broad-exception-caught
+    async def keep_forever(self, engine: Union[Engine, AsyncEngine]):
+        """Add partitions after each interval, logging failures."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await add_partitions(engine)
+            except Exception:
+                logging.exception("Error when adding partitions, retrying "
+                                  "in %.0fs.", self.interval)
+
+    def start(self, engine: Union[Engine, AsyncEngine]):
+        """Keep adding partitions in a background task."""
+        self.task = asyncio.create_task(self.keep_forever(engine))
+
+    async def stop(self):
+        """Cancel the background task."""
+        await cancel(self.task)
+        self.task = None
+
+
+PARTITION_KEEPER = PartitionKeeper(CONFIGURATION.ledger.partition_interval)
+
+
+def export_month(connection: Connection, directory: str,
+                 start: datetime) -> int:
+    """Write transactions of start's month to its archive file.
+
+    Rows are streamed in (date, id) order. Returns how many were written.
+    """
+    path = archive_path(directory, start)
+    rows = connection.execution_options(yield_per=CHUNK_SIZE).execute(
+        select(*[getattr(Transactions, name) for name in ARCHIVE_COLUMNS])
+        .where(Transactions.date >= start,
+               Transactions.date < add_months(start, 1))
+        .order_by(*TRANSACTIONS_KEY)
+    )
+    written = 0
+    with gzip.open(path + ".tmp", "wt", newline="") as archive_file:
+        writer = csv.writer(archive_file)
+        writer.writerow(ARCHIVE_COLUMNS)
+        for row in rows:
+            writer.writerow([row.id, row.sender, row.receiver, row.amount,
+                             row.date.isoformat()])
+            written += 1
+    os.replace(path + ".tmp", path)
+    return written
+
+
+def remove_month(connection: Connection, start: datetime):
+    """Drop transactions of start's month from the database."""
+    if is_partitioned(connection) and connection.execute(
+        text("SELECT to_regclass(:name)"), {"name": partition_name(start)}
+    ).scalar():
+        connection.execute(text(
+            f"ALTER TABLE transactions DETACH PARTITION "
+            f"{partition_name(start)}"
+        ))
+        connection.execute(text(f"DROP TABLE {partition_name(start)}"))
+    # Also rows that landed in the default partition.
+    connection.execute(Transactions.__table__.delete().where(
+        Transactions.date >= start, Transactions.date < add_months(start, 1)
+    ))
+
+
+def months_to_archive(connection: Connection, keep_months: int,
+                      today: datetime) -> List[datetime]:
+    """Return starts of stored months older than keep_months."""
+    cutoff = add_months(month_start(today), -keep_months)
+    oldest = connection.execute(
+        select(func.min(Transactions.date))
+    ).scalar()
+    months = []
+    start = month_start(oldest) if oldest else cutoff
+    while start < cutoff:
+        months.append(start)
+        start = add_months(start, 1)
+    return months
+
+
+def archive_month(connection: Connection, directory: str,
+                  start: datetime) -> int:
+    """Export then remove one month, returning archived rows."""
+    rows = export_month(connection, directory, start)
+    remove_month(connection, start)
+    logging.info("Archived %d transactions of %s.", rows, f"{start:%Y-%m}")
+    return rows
+
+
+async def archive(engine: Union[Engine, AsyncEngine], directory: str,
+                  keep_months: int,
+                  today: Optional[datetime] = None) -> dict:
+    """Archive closed months, each in its own transaction.
+
+    A month is removed only once its file is complete. Returns archived
+    rows by month.
+    """
+    os.makedirs(directory, exist_ok=True)
+    today = today or utc_now()
+    archived = {}
+    if isinstance(engine, AsyncEngine):
+        async with engine.connect() as connection:
+            months = await connection.run_sync(
+                months_to_archive, keep_months, today
+            )
+        for start in months:
+            async with engine.begin() as connection:
+                archived[f"{start:%Y-%m}"] = await connection.run_sync(
+                    archive_month, directory, start
+                )
+        return archived
+    with engine.connect() as connection:
+        months = months_to_archive(connection, keep_months, today)
+    for start in months:
+        with engine.begin() as connection:
+            archived[f"{start:%Y-%m}"] = archive_month(
+                connection, directory, start
+            )
+    return archived
+
+
+def archived_months(directory: str) -> List[datetime]:
+    """Return starts of archived months, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    found = [ARCHIVE_FILE.match(name) for name in os.listdir(directory)]
+    return sorted(datetime(int(match[1]), int(match[2]), 1)
+                  for match in found if match)
+
+
+def archive_boundary(directory: str) -> Optional[datetime]:
+    """Return when the newest archived month ends, None without archive."""
+    months = archived_months(directory)
+    return add_months(months[-1], 1) if months else None
+
+
+def read_month(path: str) -> Iterator[Transactions]:
+    """Yield transactions stored in an archive file, in file order."""
+    with gzip.open(path, "rt", newline="") as archive_file:
+        for row in csv.DictReader(archive_file):
+            yield Transactions(
+                id=int(row["id"]), sender=row["sender"],
+                receiver=row["receiver"], amount=float(row["amount"]),
+                date=datetime.fromisoformat(row["date"]),
+            )
+
+
+def read_archive(directory: str, since: datetime,
+                 until: Optional[datetime] = None,
+                 descending: bool = False) -> Iterator[Transactions]:
+    """Stream archived transactions dated from since until until.
+
+    Sorted by (date, id). Descending order reverses one month at a time.
+    """
+    for start in archived_months(directory)[::-1 if descending else 1]:
+        if add_months(start, 1) <= since or (until and start >= until):
+            continue
+        rows = read_month(archive_path(directory, start))
+        if descending:
+            rows = reversed(list(rows))
+        for row in rows:
+            if row.date >= since and (until is None or row.date < until):
+                yield row
+
+
+def matches(row: Transactions, address: Optional[str],
+            minimum: float) -> bool:
+    """Return true if an archived row passes the listing filters."""
+    return row.amount >= minimum and \
+        (not address or address in (row.sender, row.receiver))
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+async def list_transactions(session: AnySession, directory: str,
+                            address: str, minimum: float, limit: int,
+                            offset: int, cursor: Optional[str] = None,
+                            count: str = EXACT,
+                            since: Optional[datetime] = None,
+                            until: Optional[datetime] = None,
+                            newest_first: bool = False):
+    """Like get_all_transactions, reading archived months since since.
+
+    Archived rows are all older than stored ones, so pages go through
+    both in order. Counting archived rows reads every file in the range.
+    Files are read in a worker thread, to keep the loop free.
+    """
+    boundary = await asyncio.to_thread(archive_boundary, directory)
+    if boundary is None or since is None or since >= boundary:
+        return await run(session, get_all_transactions, address, minimum,
+                         limit, offset, cursor, count, since, until,
+                         newest_first)
+    after = tuple(decode_cursor(cursor, TRANSACTIONS_KEY)) if cursor else None
+    in_archive = after is not None and after[0] < boundary
+
+    def past_cursor(row: Transactions) -> bool:
+        return after is None or ((row.date, row.id) < after if newest_first
+                                 else (row.date, row.id) > after)
+
+    def archived(size: int) -> List[Transactions]:
+        # Oldest first, a cursor in stored months is past every file.
+        if not (newest_first or after is None or in_archive):
+            return []
+        rows = (row for row in read_archive(directory, since, until,
+                                            newest_first)
+                if matches(row, address, minimum) and past_cursor(row))
+        return list(islice(rows, size))
+
+    def live(sync_session: Session, size: int) -> List[Transactions]:
+        rows: List[Transactions] = []
+        if (until and until <= boundary) or (newest_first and in_archive):
+            return rows
+        page = {"next_cursor": None if in_archive else cursor}
+        while len(rows) < size:
+            page = get_all_transactions(
+                sync_session, address, minimum, CHUNK_SIZE, 0,
+                page["next_cursor"], NO_TOTAL, boundary, until, newest_first,
+            )
+            rows.extend(page["items"])
+            if not page["next_cursor"]:
+                break
+        return rows[:size]
+
+    start = 0 if cursor else offset
+    size = start + limit + 1
+    if newest_first:
+        window = await run(session, live, size)
+        window += await asyncio.to_thread(archived, size - len(window))
+    else:
+        window = await asyncio.to_thread(archived, size)
+        window += await run(session, live, size - len(window))
+    items = window[start:start + limit]
+    next_cursor = cursor_for(items[-1], TRANSACTIONS_KEY) \
+        if len(window) > start + limit else None
+    total = None
+    if count != NO_TOTAL:
+        live_total = 0
+        if not until or until > boundary:
+            live_total = (await run(
+                session, get_all_transactions, address, minimum, 1, 0, None,
+                count, boundary, until
+            ))["total"]
+        total = live_total + await asyncio.to_thread(
+            lambda: sum(1 for row in read_archive(directory, since, until)
+                        if matches(row, address, minimum))
+        )
+    if cursor:
+        return {"items": items, "total": total, "size": len(items),
+                "next_cursor": next_cursor}
+    return offset_page(items, total, limit, offset, next_cursor)
+
+
+async def main():
+    """Archive closed months of the configured database."""
+    engine = build_engine(CONFIGURATION)
+    archived = await archive(engine, CONFIGURATION.ledger.archive_dir,
+                             CONFIGURATION.ledger.keep_months)
+    for month, rows in archived.items():
+        logging.info("%s: %d transactions archived.", month, rows)
+    await dispose(engine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
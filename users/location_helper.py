@@ -2,14 +2,82 @@
 import logging
 from typing import List, Tuple, Optional
 
+from environ import to_config
 from fastapi import HTTPException, status
 from users.config import AppConfig
-from users.mongodb import (
-    edit_location,
-    get_mongodb_connection
+from users.crud import set_location
+from users.database import AnySession, run
+from users.geo_cache import GeoCache
+from users.geo_index import GeoIndex
+from users.models import Users
+from users.mongodb import get_locations_within, get_mongodb_connection
+from users.outbox import LocationRelay
+from users.pagination import offset_page
+
+CONFIGURATION = to_config(AppConfig)
+GEO_INDEX = GeoIndex(CONFIGURATION.geo.cell_size,
+                     CONFIGURATION.geo.refresh_interval)
+GEO_CACHE = GeoCache(
+    CONFIGURATION.geo.cache_cell_size,
+    CONFIGURATION.geo.cache_radius_step,
+    CONFIGURATION.geo.cache_size,
+    CONFIGURATION.geo.cache_ttl,
+    CONFIGURATION.geo.cache_max_trainers,
+)
+# Told apart from areas cached as None, see GeoCache.get.
+MISSING = object()
+LOCATION_RELAY = LocationRelay(
+    CONFIGURATION.outbox.batch_size,
+    CONFIGURATION.outbox.poll_interval,
+    CONFIGURATION.outbox.max_backoff,
+    lambda changes: locations_relayed(changes),
 )
 
 
+def uses_geo_index(config: AppConfig) -> bool:
+    """Return true if trainer locations are kept in GEO_INDEX.
+
+    It is the only search backend without MongoDB, and an optional
+    accelerator in front of it.
+    """
+    return not config.mongo.enabled or config.geo.index
+
+
+def index_serves(config: AppConfig) -> bool:
+    """Return true if searches should be answered by GEO_INDEX.
+
+    In front of MongoDB, only once locations are loaded.
+    """
+    return not config.mongo.enabled or \
+        (config.geo.index and GEO_INDEX.ready)
+
+
+async def trainers_around(coordinates: Tuple[float, float], radius: int,
+                          config: AppConfig) -> Optional[List]:
+    """Return (user_id, point) of trainers around a search, cached.
+
+    Covers every trainer within radius of coordinates, see GeoCache. None
+    if the cache is disabled or there are too many trainers to cache, at
+    most max_trainers + 1 are read.
+    """
+    if not GEO_CACHE.enabled:
+        return None
+    area = GEO_CACHE.search_area(coordinates, radius)
+    trainers = GEO_CACHE.get(area, MISSING)
+    if trainers is MISSING:
+        limit = GEO_CACHE.max_trainers + 1
+        if index_serves(config):
+            trainers = GEO_INDEX.around(*area, limit)
+        else:
+            trainers = await get_locations_within(
+                get_mongodb_connection(config), *area, limit
+            )
+        if len(trainers) > GEO_CACHE.max_trainers:
+            trainers = None
+        GEO_CACHE.set(area, trainers)
+    return trainers
+
+
 def get_coordinates(
     longitude: Optional[float], latitude: Optional[float]
 ) -> Optional[Tuple]:
@@ -37,19 +105,80 @@ def get_user_ids(documents: List) -> List:
     return ids
 
 
-def save_location(
-    mongo_url: str,
+def nearby_page(nearby: dict, users: List[Users], limit: int,
+                offset: int) -> dict:
+    """Build a users page from a geo search, closest users first.
+
+    Every user includes distance_m, meters from the searched location.
+    """
+    distances = {
+        document["user_id"]: document["distance"]
+        for document in nearby["items"]
+    }
+    items = [
+        {column.key: getattr(user, column.key)
+         for column in Users.__table__.columns}
+        | {"distance_m": distances[user.id]}
+        for user in users
+    ]
+    return offset_page(items, nearby["total"], limit, offset,
+                       nearby["next_cursor"])
+
+
+def outbox_coordinates(
+    is_athlete: bool,
+    coordinates: Optional[Tuple[float, float]],
+    config: AppConfig
+) -> Optional[Tuple[float, float]]:
+    """Return the coordinates to queue for MongoDB along with the user."""
+    if is_athlete or not config.mongo.enabled:
+        return None
+    return coordinates
+
+
+async def save_location(
+    session: AnySession,
     is_athlete: bool,
     user_id: int,
     coordinates: Tuple[float, float],
     config: AppConfig
 ):
-    """Save location if user is trainer."""
-    if not config.mongo.enabled:
-        logging.debug("Geolocation disabled, not saving coordinates.")
-        return
+    """Save location if user is trainer.
+
+    Stored in the database when MongoDB is disabled. Otherwise it was
+    queued with the user, see outbox_coordinates, and the relay is woken,
+    which invalidates searches again once MongoDB has it.
+    """
     if is_athlete:
-        logging.debug("Not saving location in MongoDB for athlete")
+        logging.debug("Not saving location for athlete")
+        return
+    if coordinates is None:
+        logging.debug("No coordinates to save")
         return
-    logging.debug("Saving location in MongoDB...")
-    edit_location(get_mongodb_connection(mongo_url), user_id, coordinates)
+    if config.mongo.enabled:
+        logging.debug("Location queued, waking MongoDB relay...")
+        LOCATION_RELAY.wanted.set()
+    else:
+        logging.debug("Geolocation disabled, saving coordinates in DB...")
+        await run(session, set_location, user_id, coordinates)
+    locations_saved([(user_id, coordinates)], config)
+
+
+def locations_saved(changes: List[Tuple[int, Tuple[float, float]]],
+                    config: AppConfig):
+    """Refresh GEO_CACHE and GEO_INDEX after saving (user_id, coordinates)."""
+    for user_id, coordinates in changes:
+        GEO_CACHE.invalidate(user_id, GEO_INDEX.points.get(user_id),
+                             coordinates)
+        if uses_geo_index(config):
+            GEO_INDEX.set(user_id, coordinates)
+
+
+def locations_relayed(changes: List[Tuple[int, Tuple[float, float]]]):
+    """Drop searches cached while (user_id, coordinates) were queued.
+
+    Those made before MongoDB took a change may hold the old location.
+    GEO_INDEX is left alone, it already has the newest one.
+    """
+    for user_id, coordinates in changes:
+        GEO_CACHE.invalidate(user_id, coordinates)
@@ -0,0 +1,101 @@
+"""Catalog of CABA locations, parsed and serialized once."""
+import hashlib
+import json
+import math
+from typing import List, Optional, Tuple
+
+from fastapi import Response
+
+from users.geo_index import Point, distance_m
+from users.schemas import Location
+
+LOCATIONS_PATH = "static/location.json"
+
+# Loaded on startup, see get_catalog.
+CATALOG: Optional["LocationCatalog"] = None
+
+
+class LocationCatalog:
+    """Validated locations with their response body and ETag.
+
+    Also resolves coordinates to the closest location. Candidates are
+    ranked on a flat projection around the catalog, which is exact enough
+    at city scale, and only the winner's distance is computed on the
+    sphere.
+    """
+
+    def __init__(self, locations: List[Location], max_age: int):
+        self.locations = locations
+        self.max_age = max_age
+        latitudes = [location.coordinates[1] for location in locations]
+        self.lon_scale = math.cos(math.radians(
+            sum(latitudes) / len(latitudes) if latitudes else 0
+        ))
+        self.projected = [
+            (location.coordinates[0] * self.lon_scale,
+             location.coordinates[1])
+            for location in locations
+        ]
+        self.body = json.dumps(
+            [location.dict() for location in locations],
+            separators=(",", ":"),
+        ).encode()
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+    @classmethod
+    def load(cls, path: str, max_age: int) -> "LocationCatalog":
+        """Read and validate a JSON list of locations."""
+        with open(path, encoding="UTF-8") as location_file:
+            locations = json.load(location_file)
+        return cls([Location(**location) for location in locations], max_age)
+
+    def nearest(self, point: Point) -> Optional[Tuple[Location, float]]:
+        """Return the closest location and its distance in meters."""
+        if not self.locations:
+            return None
+        target = (point[0] * self.lon_scale, point[1])
+        closest = min(range(len(self.projected)),
+                      key=lambda idx: math.dist(self.projected[idx], target))
+        location = self.locations[closest]
+        return location, distance_m(location.coordinates, point)
+
+    def resolve(self, point: Optional[Point],
+                max_distance: float) -> Optional[Location]:
+        """Return the closest location within max_distance meters."""
+        found = self.nearest(point) if point else None
+        if found is None or found[1] > max_distance:
+            return None
+        return found[0]
+
+    def normalize(self, location: Optional[str], point: Optional[Point],
+                  max_distance: float) -> Optional[str]:
+        """Return the name of the location at point, else location."""
+        found = self.resolve(point, max_distance)
+        return found.location if found else location
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Return true if the client already has this catalog."""
+        if not if_none_match:
+            return False
+        tags = [tag.strip().removeprefix("W/")
+                for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+    def response(self, if_none_match: Optional[str] = None) -> Response:
+        """Return the catalog, or 304 if the client ETag is current."""
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"public, max-age={self.max_age}",
+        }
+        if self.matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json",
+                        headers=headers)
+
+
+def get_catalog(max_age: int) -> LocationCatalog:
+    """Return the shared catalog, loading it if not loaded yet."""
+    global CATALOG  # pylint: disable=global-statement
+    if CATALOG is None:
+        CATALOG = LocationCatalog.load(LOCATIONS_PATH, max_age)
+    return CATALOG
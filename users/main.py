@@ -1,73 +1,159 @@
 """Define all endpoints here."""
-import json
 import logging
 import os
 import time
-from typing import List, Optional
-import httpx
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import List, Optional, Tuple, Union
 
-from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, \
+    Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.applications import get_swagger_ui_html
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
 from environ import to_config
 from newrelic.agent import (
     record_custom_metric as record_metric,
     register_application,
 )
+from users.clients import close_clients, start_clients
+from users.compensations import COMPENSATION_RETRIER
 from users.config import AppConfig
-from users.database import get_database_url
+from users.database import (
+    AnySession,
+    build_engine,
+    build_session_factory,
+    close,
+    create_tables,
+    dispose,
+    run,
+)
 from users.crud import (
     create_user,
     get_all_users,
     get_user_by_id,
     get_user_by_username,
-    get_users_by_id,
+    get_trainer_locations,
+    get_users_in_order,
     update_user,
     change_blocked_status,
     get_user_by_email,
     get_users_followed_by,
     unfollow_user,
     follow_new_user, get_wallet_details,
-    get_followers, add_transaction, get_all_transactions,
-    user_is_blocked, is_athlete, delete_user
+    get_followers, add_transaction,
+    user_is_blocked, is_athlete, delete_user, find_conflict
 )
-from users.metrics import queue
+from users.bulk import create_many
+from users.export import FORMATS, export_transactions
+from users.geo_index import nearest, page_within
+from users.ledger import PARTITION_KEEPER, list_transactions, naive_utc
+from users.locations import get_catalog
+from users.migrations import migrate
+from users.metrics import queue, start_metrics, stop_metrics
 from users.mongodb import (
-    get_mongo_url,
+    close_mongo,
+    get_all_locations,
     get_mongodb_connection,
     get_users_within,
-    initialize
+    initialize,
+    start_mongo,
 )
+from users.pagination import COUNTS_CACHE, NO_TOTAL, count_strategy
+from users.rollups import get_aggregates
 from users.payment.dto import BalanceBonus
-from users.schemas import UserCreate, UserUpdate, UserBase, Location
+from users.signup import Signup
+from users.schemas import UserCreate, UserUpdate, UserBase, Location, \
+    NearestLocation
 from users.models import Base
+from users.telemetry import (
+    InstrumentedRoute,
+    instrument_dependencies,
+    start_metrics_server,
+    stop_metrics_server,
+)
+from users.tokens import LOCAL
 from users.admin.dao import create_admin, get_all as get_all_admins
 from users.admin.dto import AdminCreationDTO
-from users.util import get_auth_header, get_credentials, \
-    get_token, add_user_firebase, token_login_firebase, \
-    create_wallet, upload_image, download_image, get_balance, \
-    transfer_money_outside, deposit_money, add_to_balance
+from users.util import get_auth_header, get_credentials, auth_client, \
+    get_token, add_user_firebase, delete_user_firebase, token_login_firebase, \
+    create_wallet, delete_wallet, upload_image, download_image, get_balance, \
+    transfer_money_outside, deposit_money, add_to_balance, CREDENTIALS_CACHE, \
+    TOKEN_VERIFIER, WALLET_POOL
 from users.healthcheck import HealthCheckDto
 from users.location_helper import (
+    GEO_CACHE,
+    GEO_INDEX,
+    LOCATION_RELAY,
     get_coordinates,
     get_user_ids,
+    index_serves,
+    nearby_page,
+    outbox_coordinates,
     save_location,
+    trainers_around,
+    uses_geo_index,
 )
 
 BASE_URI = "/users"
 CONFIGURATION = to_config(AppConfig)
 DOCUMENTATION_URI = BASE_URI + "/documentation/"
 START = time.time()
-MONGO_URL = get_mongo_url(CONFIGURATION)
 
 logging.basicConfig(encoding="utf-8", level=CONFIGURATION.log_level.upper())
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Create shared resources on startup and release them on shutdown."""
+    metrics_server = None
+    if "TESTING" not in os.environ:
+        metrics_server = await start_metrics_server(
+            CONFIGURATION.prometheus_port
+        )
+        logging.info("Building database...")
+        await create_tables(ENGINE, Base.metadata)
+        await migrate(ENGINE)
+        PARTITION_KEEPER.start(ENGINE)
+        COMPENSATION_RETRIER.start(SESSION_FACTORY, {
+            "auth": delete_user_firebase, "wallet": delete_wallet,
+        })
+        if CONFIGURATION.mongo.enabled:
+            start_mongo(CONFIGURATION)
+            await initialize(get_mongodb_connection(CONFIGURATION))
+            LOCATION_RELAY.start(SESSION_FACTORY,
+                                 get_mongodb_connection(CONFIGURATION))
+    get_catalog(CONFIGURATION.locations_max_age)
+    start_clients(CONFIGURATION)
+    start_metrics(CONFIGURATION)
+    if CONFIGURATION.auth.verification == LOCAL:
+        TOKEN_VERIFIER.start(auth_client)
+    if uses_geo_index(CONFIGURATION):
+        GEO_INDEX.start(load_locations)
+    if WALLET_POOL.size > 0:
+        WALLET_POOL.start(SESSION_FACTORY, create_wallet)
+    yield
+    await WALLET_POOL.stop()
+    await PARTITION_KEEPER.stop()
+    await COMPENSATION_RETRIER.stop()
+    await stop_metrics_server(metrics_server)
+    await GEO_INDEX.stop()
+    await TOKEN_VERIFIER.stop()
+    await stop_metrics()
+    await close_clients()
+    await LOCATION_RELAY.stop()
+    await close_mongo()
+    await dispose(ENGINE)
+
+
 app = FastAPI(
     debug=CONFIGURATION.log_level.upper() == "DEBUG",
     openapi_url=DOCUMENTATION_URI + "openapi.json",
+    lifespan=lifespan,
 )
+# Count and time requests per route, served on prometheus_port.
+app.router.route_class = InstrumentedRoute
+instrument_dependencies()
 
 METHODS = [
     "GET",
@@ -97,57 +183,108 @@ app.add_middleware(
 NR_APP = register_application()
 COUNTER = {"count": 1}
 
-# Database initialization.
-# Maybe move this, so it is only run when required? Now it runs when ever
-# the application is started, and we may not need to create the database
-# structure.
-ENGINE = create_engine(get_database_url(CONFIGURATION),
-                       pool_pre_ping=True, )
-if "TESTING" not in os.environ:
-    logging.info("Building database...")
-    Base.metadata.create_all(bind=ENGINE)
-    initialize(get_mongodb_connection(MONGO_URL))
+# Database initialization. Sync or async depending on USERS_DB_DRIVER,
+# tables are created in the lifespan.
+ENGINE = build_engine(CONFIGURATION)
+SESSION_FACTORY = build_session_factory(ENGINE)
 
 
 # Helper methods, move somewhere else
-def get_db() -> Session:
-    """Create a session."""
-    return Session(autocommit=False, autoflush=False, bind=ENGINE)
+async def get_db():
+    """Create a session, closed once the request is handled."""
+    session = SESSION_FACTORY()
+    try:
+        yield session
+    finally:
+        await close(session)
+
+
+async def load_locations() -> List:
+    """Return every saved trainer location, to fill GEO_INDEX."""
+    if CONFIGURATION.mongo.enabled:
+        return await get_all_locations(get_mongodb_connection(CONFIGURATION))
+    session = SESSION_FACTORY()
+    try:
+        return await run(session, get_trainer_locations)
+    finally:
+        await close(session)
 
 
 # Endpoint definition
 @app.post("/users/login")
-async def login(request: Request, session: Session = Depends(get_db)):
+async def login(request: Request, session: AnySession = Depends(get_db)):
     """Log in to Firebase with email, password. Return token if successful."""
     record_metric('Custom/users-login/post', COUNTER, NR_APP)
     logging.info("Log-in user %s...")
     req = await request.json()
     email = req["email"]
     body = await token_login_firebase(request, "user", session)
-    if user_is_blocked(session, email):
+    if await run(session, user_is_blocked, email):
         raise HTTPException(status_code=401, detail="User is blocked")
     queue(CONFIGURATION, "user_login_count", "using_email_password")
     return JSONResponse(content=body, status_code=200)
 
 
-def validate_user(session: Session, user: UserBase):
-    """Create new user in the database based on id and user details."""
+async def validate_user(session: AnySession, user: UserBase):
+    """Reject users whose email or username is taken, in one query."""
     logging.info("Validating user...")
-    with session as open_session:
-        db_user = get_user_by_email(open_session, email=user.email)
-        if db_user:
-            msg = "User with that email already present"
-            logging.warning("Error creating user: %s", msg)
-            raise HTTPException(status_code=400, detail=msg)
-        db_user = get_user_by_username(open_session, username=user.username)
-        if db_user:
-            msg = "User with that username already present"
-            logging.warning("Error creating user: %s", msg)
-            raise HTTPException(status_code=400, detail=msg)
+    conflict = await run(session, find_conflict, user.email, user.username)
+    if conflict:
+        msg = f"User with that {conflict} already present"
+        logging.warning("Error creating user: %s", msg)
+        raise HTTPException(status_code=400, detail=msg)
+
+
+def normalize_location(user: Union[UserBase, UserUpdate]) -> Optional[str]:
+    """Return the neighborhood at the user coordinates.
+
+    The given location is kept when coordinates are missing or too far
+    from every known neighborhood.
+    """
+    return get_catalog(CONFIGURATION.locations_max_age).normalize(
+        user.location, user.coordinates, CONFIGURATION.locations_max_distance
+    )
+
+
+async def take_wallet_along(signup: Signup, session: AnySession,
+                            steps: dict) -> dict:
+    """Run signup steps, returning a pooled wallet or one created with them.
+
+    The payments service is only called when the wallet pool is empty.
+    """
+    wallet = await signup.step(
+        "wallet_pool", WALLET_POOL.take(session),
+        lambda pooled: WALLET_POOL.put_back(session, pooled),
+    )
+    if wallet is None:
+        steps["wallet"] = (create_wallet(), lambda created: (
+            COMPENSATION_RETRIER.undo("wallet", delete_wallet, created)
+        ))
+    results = await signup.concurrently(steps)
+    return wallet or results["wallet"]
+
+
+async def store_location(signup: Signup, session: AnySession, db_user,
+                         coordinates: Optional[Tuple[float, float]]):
+    """Save a new user's location as the last step of its signup.
+
+    With MongoDB, it was already queued along with the user.
+    """
+    try:
+        await signup.step("location", save_location(
+            session,
+            db_user.is_athlete,
+            db_user.id,
+            coordinates,
+            CONFIGURATION
+        ))
+    except Exception as exc:
+        raise HTTPException(detail="Error when saving location",
+                            status_code=500) from exc
 
 
 @app.post("/users")
-async def create(new_user: UserCreate, session: Session = Depends(get_db)):
+async def create(new_user: UserCreate, session: AnySession = Depends(get_db)):
     """Create new user in Firebase, add it to the database if successful."""
     logging.info("Creating user %s...", new_user)
     record_metric('Custom/users/post', COUNTER, NR_APP)
@@ -158,32 +295,70 @@ async def create(new_user: UserCreate, session: Session = Depends(get_db)):
             new_user.email, new_user.password
         )
         raise HTTPException(detail=msg, status_code=400)
-    validate_user(session, new_user)
-    await add_user_firebase(new_user.email, new_user.password)
-    wallet = await create_wallet()
-    logging.debug("Creating user in DB...")
-    if new_user.image:
-        logging.info("Uploading user image...")
-        await upload_image(new_user.image, new_user.username)
-    db_user = create_user(session=session, user=new_user, wallet=wallet)
-    try:
-        save_location(
-            MONGO_URL,
-            db_user.is_athlete,
-            db_user.id,
-            new_user.coordinates,
-            CONFIGURATION
+    await validate_user(session, new_user)
+    new_user.location = normalize_location(new_user)
+    async with Signup() as signup:
+        # Auth, payments and image storage calls don't depend on each other.
+        steps = {
+            "auth": (add_user_firebase(new_user.email, new_user.password),
+                     lambda _: COMPENSATION_RETRIER.undo(
+                         "auth", delete_user_firebase, new_user.email)),
+        }
+        if new_user.image:
+            logging.info("Uploading user image...")
+            steps["image"] = (upload_image(new_user.image,
+                                           new_user.username), None)
+        wallet = await take_wallet_along(signup, session, steps)
+        logging.debug("Creating user in DB...")
+        db_user = await signup.step(
+            "database",
+            run(session, create_user, user=new_user, wallet=wallet,
+                coordinates=outbox_coordinates(new_user.is_athlete,
+                                               new_user.coordinates,
+                                               CONFIGURATION)),
+            lambda user: run(session, delete_user, user.id),
         )
-    except Exception as exc:
-        delete_user(session, db_user.id)
-        raise HTTPException(detail="MongoDB error when saving location",
-                            status_code=500) from exc
+        await store_location(signup, session, db_user, new_user.coordinates)
     queue(CONFIGURATION, "user_created_count", "using_email_password")
     if new_user.location:
         queue(CONFIGURATION, "user_by_region_count", new_user.location)
     return db_user
 
 
+@app.post("/users/bulk")
+async def create_bulk(
+    request: Request,
+    users: List[UserCreate],
+    session: AnySession = Depends(get_db)
+):
+    """Create many users at once, reporting the result of each one.
+
+    Users whose email or username is taken, or repeated in the batch, are
+    skipped, as are those the auth or payments services reject.
+    """
+    logging.info("Creating %d users...", len(users))
+    record_metric('Custom/users-bulk/post', COUNTER, NR_APP)
+    token = await get_credentials(request)
+    if token["role"] != "admin":
+        logging.warning("Invalid credentials for creating users in bulk")
+        raise HTTPException(status_code=403, detail="Invalid credentials")
+    if len(users) > CONFIGURATION.bulk.max_users:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {CONFIGURATION.bulk.max_users} users at once",
+        )
+    for user in users:
+        user.location = normalize_location(user)
+    items = await create_many(session, users, CONFIGURATION)
+    for user, item in zip(users, items):
+        if item["status"] == 200:
+            queue(CONFIGURATION, "user_created_count", "using_email_password")
+            if user.location:
+                queue(CONFIGURATION, "user_by_region_count", user.location)
+    return {"items": items,
+            "created": sum(item["status"] == 200 for item in items)}
+
+
 async def validate_idp_token(request: Request):
     """Validate IDP Token through auth microservice."""
     logging.debug("Validating IDP token...")
@@ -194,8 +369,7 @@ async def validate_idp_token(request: Request):
     request = await request.json()
     url = f"http://{CONFIGURATION.auth.host}/auth/loginIDP"
     logging.info("Validating IDP token '%s' in '%s'", auth_header, url)
-    res = await httpx.AsyncClient().post(url, json=request,
-                                         headers=auth_header)
+    res = await auth_client().post(url, json=request, headers=auth_header)
     if res.status_code != 200:
         error = res.json()["Message"]
         logging.error("Error when trying to login with IDP token: %s", error)
@@ -204,47 +378,47 @@ async def validate_idp_token(request: Request):
 
 @app.post("/users/usersIDP")
 async def create_idp_user(request: Request,
-                          user: UserBase, session: Session = Depends(get_db)):
+                          user: UserBase,
+                          session: AnySession = Depends(get_db)):
     """Create new user with federated identity in database."""
     logging.info("Creating user with IDP token...")
     record_metric('Custom/users-usersIDP/post', COUNTER, NR_APP)
     if user.email is None:
         msg = {'message': 'Error! Missing Email'}
         raise HTTPException(detail=msg, status_code=400)
-    validate_user(session, user)
-    await validate_idp_token(request)
-    wallet = await create_wallet()
-    logging.debug("Creating IDP user in DB...")
-    db_user = create_user(session=session, user=user, wallet=wallet)
-    try:
-        save_location(
-            MONGO_URL,
-            db_user.is_athlete,
-            db_user.id,
-            user.coordinates,
-            CONFIGURATION
+    await validate_user(session, user)
+    user.location = normalize_location(user)
+    async with Signup() as signup:
+        # The wallet is given back if the token turns out invalid.
+        wallet = await take_wallet_along(signup, session, {
+            "idp_token": (validate_idp_token(request), None),
+        })
+        logging.debug("Creating IDP user in DB...")
+        db_user = await signup.step(
+            "database",
+            run(session, create_user, user=user, wallet=wallet,
+                coordinates=outbox_coordinates(user.is_athlete,
+                                               user.coordinates,
+                                               CONFIGURATION)),
+            lambda created: run(session, delete_user, created.id),
         )
-    except Exception as exc:
-        delete_user(session, db_user.id)
-        raise HTTPException(detail="MongoDB error when saving location",
-                            status_code=500) from exc
+        await store_location(signup, session, db_user, user.coordinates)
     queue(CONFIGURATION, "user_created_count", "using_idp")
     return db_user
 
 
 @app.post("/users/login/usersIDP")
-async def login_idp(request: Request, session: Session = Depends(get_db)):
+async def login_idp(request: Request, session: AnySession = Depends(get_db)):
     """Verify user is logged in through IDP and return token."""
     logging.info("Log-in user with IDP token...")
     record_metric('Custom/users-login-usersIDP/post', COUNTER, NR_APP)
     await validate_idp_token(request)
     request = await request.json()
-    with session as open_session:
-        user = get_user_by_email(session=open_session, email=request["email"])
-        if user is None:
-            msg = {'message': 'No IDP user with such an email'}
-            logging.warning("Could not login with IDP token: %s", msg)
-            raise HTTPException(detail=msg, status_code=404)
+    user = await run(session, get_user_by_email, email=request["email"])
+    if user is None:
+        msg = {'message': 'No IDP user with such an email'}
+        logging.warning("Could not login with IDP token: %s", msg)
+        raise HTTPException(detail=msg, status_code=404)
     queue(CONFIGURATION, "user_login_count", "using_idp")
     return {"token": await get_token("user", user.id), "id": user.id}
 
@@ -257,28 +431,95 @@ async def get_transactions(
     minimum: Optional[float] = 0.0,
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
-    session: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = True,
+    estimate_total: Optional[bool] = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    newest_first: Optional[bool] = False,
+    session: AnySession = Depends(get_db)
 ):
-    """Get all transactions."""
+    """Get all transactions, oldest first unless newest_first=true.
+
+    Pass next_cursor from a previous page as cursor to page by key, which
+    stays fast for deep pages. Offset is ignored then.
+    Counting every match is skipped with include_total=false, or replaced
+    by an approximation with estimate_total=true.
+    since and until limit dates, since included and until excluded, as
+    ISO 8601 date times. Those with an offset are converted to UTC.
+    """
     record_metric('Custom/users-transactions/get', COUNTER, NR_APP)
     token = await get_credentials(request)
     if token["role"] != "admin":
         logging.warning("Invalid credentials for requesting all transactions")
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        body = get_all_transactions(open_session,
-                                    wallet_address,
-                                    minimum,
-                                    limit,
-                                    offset)
-        return body
+    return await list_transactions(
+        session, CONFIGURATION.ledger.archive_dir, wallet_address, minimum,
+        limit, offset, cursor, count_strategy(include_total, estimate_total),
+        naive_utc(since), naive_utc(until), newest_first,
+    )
+
+
+@app.get("/users/transactions/aggregates")
+async def get_transaction_aggregates(
+    request: Request,
+    wallet_address: Optional[str] = None,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    session: AnySession = Depends(get_db)
+):
+    """Get daily transaction count, total and max amount, oldest first.
+
+    With wallet_address, those it sent and received. Otherwise, those of
+    every transaction. since and until limit days, since included and
+    until excluded. Archived months are included.
+    """
+    record_metric('Custom/users-transactions-aggregates/get', COUNTER,
+                  NR_APP)
+    token = await get_credentials(request)
+    if token["role"] != "admin":
+        logging.warning("Invalid credentials for transaction aggregates")
+        raise HTTPException(status_code=403, detail="Invalid credentials")
+    return await run(session, get_aggregates, wallet_address, since, until)
+
+
+# pylint: disable=too-many-arguments
+@app.get("/users/transactions/export")
+async def export_all_transactions(
+    request: Request,
+    wallet_address: Optional[str] = None,
+    minimum: Optional[float] = 0.0,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    export_format: str = Query("ndjson", alias="format",
+                               regex="^(ndjson|csv)$"),
+    session: AnySession = Depends(get_db)
+):
+    """Stream every matching transaction, oldest first, as NDJSON or CSV.
+
+    Takes the filters of GET /users/transactions. Rows are sent as they
+    are read, so exports of any size don't need paging.
+    """
+    record_metric('Custom/users-transactions-export/get', COUNTER, NR_APP)
+    token = await get_credentials(request)
+    if token["role"] != "admin":
+        logging.warning("Invalid credentials for exporting transactions")
+        raise HTTPException(status_code=403, detail="Invalid credentials")
+    return StreamingResponse(
+        export_transactions(session, CONFIGURATION.ledger.archive_dir,
+                            wallet_address, minimum, naive_utc(since),
+                            naive_utc(until), export_format),
+        media_type=FORMATS[export_format],
+        headers={"Content-Disposition":
+                 f'attachment; filename="transactions.{export_format}"'},
+    )
 
 
 @app.get("/users/{_id}")
 async def get_one(
     request: Request,
     _id: int,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Retrieve details for users with specified id."""
     logging.info("Retrieving user %d details...", _id)
@@ -287,8 +528,7 @@ async def get_one(
     if not token["role"] == "admin" and not token["role"] == "user":
         logging.warning("Invalid role %s", token["role"])
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=_id)
+    db_user = await run(session, get_user_by_id, user_id=_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -298,7 +538,7 @@ async def get_one(
 async def get_user_wallet(
     request: Request,
     user_id: int,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Retrieve wallet for users with specified id."""
     logging.info("Getting wallet belonging to user %d ...", user_id)
@@ -307,23 +547,22 @@ async def get_user_wallet(
     if token["role"] != "user" or token["id"] != user_id:
         logging.warning("Invalid wallet access for user %d", user_id)
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        wallet = get_wallet_details(open_session, user_id=user_id)
-        if wallet.user_id != token["id"]:
-            logging.warning("Invalid wallet access for user %d", user_id)
-            raise HTTPException(status_code=403, detail="Invalid credentials")
-        body = {
-            "address": wallet.address,
-            "private_key": wallet.private_key
-        }
-        return JSONResponse(content=body, status_code=200)
+    wallet = await run(session, get_wallet_details, user_id=user_id)
+    if wallet.user_id != token["id"]:
+        logging.warning("Invalid wallet access for user %d", user_id)
+        raise HTTPException(status_code=403, detail="Invalid credentials")
+    body = {
+        "address": wallet.address,
+        "private_key": wallet.private_key
+    }
+    return JSONResponse(content=body, status_code=200)
 
 
 @app.get("/users/{user_id}/wallet/balance")
 async def get_wallet_balance(
     request: Request,
     user_id: int,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Retrieve wallet balance for user with specified id."""
     logging.info("Getting wallet balance belonging to user %d ...", user_id)
@@ -332,22 +571,21 @@ async def get_wallet_balance(
     if token["id"] != user_id and token["role"] == "user":
         logging.warning("Invalid wallet access for user %d", user_id)
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        wallet = get_wallet_details(open_session, user_id=user_id)
-        if wallet is None:
-            logging.warning("Non existent wallet")
-            raise HTTPException(status_code=404, detail="Non existent wallet")
-        balance = await get_balance(wallet)
-        body = {
-            "balance": balance,
-        }
+    wallet = await run(session, get_wallet_details, user_id=user_id)
+    if wallet is None:
+        logging.warning("Non existent wallet")
+        raise HTTPException(status_code=404, detail="Non existent wallet")
+    balance = await get_balance(wallet)
+    body = {
+        "balance": balance,
+    }
     return JSONResponse(content=body, status_code=200)
 
 
 @app.post("/users/deposit")
 async def make_payment(
     request: Request,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Transfer specified money amount between specified users."""
     record_metric('Custom/users-deposit/post', COUNTER, NR_APP)
@@ -359,23 +597,23 @@ async def make_payment(
     if token["id"] != sender_id or token["role"] != "user":
         logging.warning("Invalid wallet access for user %d", sender_id)
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    if not is_athlete(session, sender_id) or is_athlete(session,
-                                                        receiver_id):
+    if not await run(session, is_athlete, sender_id) or \
+            await run(session, is_athlete, receiver_id):
         logging.warning("Invalid transfer from user %d", sender_id)
         raise HTTPException(status_code=403, detail="Invalid transfer")
-    with session as open_session:
-        sender_wallet = get_wallet_details(open_session, user_id=sender_id)
-        receiver_wallet = get_wallet_details(open_session, user_id=receiver_id)
-        await deposit_money(sender_wallet, receiver_wallet, amount)
-        add_transaction(session, sender_wallet.address,
-                        receiver_wallet.address, amount)
-        return JSONResponse(content={}, status_code=200)
+    sender_wallet = await run(session, get_wallet_details, user_id=sender_id)
+    receiver_wallet = await run(session, get_wallet_details,
+                                user_id=receiver_id)
+    await deposit_money(sender_wallet, receiver_wallet, amount)
+    await run(session, add_transaction, sender_wallet.address,
+              receiver_wallet.address, amount)
+    return JSONResponse(content={}, status_code=200)
 
 
 @app.post("/users/extraction")
 async def make_outside_payment(
     request: Request,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Transfer specified money amount to an outside account."""
     record_metric('Custom/users-extraction/post', COUNTER, NR_APP)
@@ -387,18 +625,17 @@ async def make_outside_payment(
     if token["id"] != sender_id or token["role"] != "user":
         logging.warning("Invalid wallet access for user %d", sender_id)
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        sender_wallet = get_wallet_details(open_session, user_id=sender_id)
-        await transfer_money_outside(sender_wallet, receiver_address, amount)
-        add_transaction(session, sender_wallet.address,
-                        receiver_address, amount)
-        return JSONResponse(content={}, status_code=200)
+    sender_wallet = await run(session, get_wallet_details, user_id=sender_id)
+    await transfer_money_outside(sender_wallet, receiver_address, amount)
+    await run(session, add_transaction, sender_wallet.address,
+              receiver_address, amount)
+    return JSONResponse(content={}, status_code=200)
 
 
 @app.patch("/users/status/{_id}")
 async def change_status(request: Request,
                         _id: int,
-                        session: Session = Depends(get_db)):
+                        session: AnySession = Depends(get_db)):
     """Invert blocked status of a user.
 
     Only admins allowed, can't block other admins
@@ -409,13 +646,12 @@ async def change_status(request: Request,
     if not token["role"] == "admin":
         logging.warning("Invalid role %s", token["role"])
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=_id)
-        if not db_user.is_blocked:
-            queue(CONFIGURATION, "user_blocked_count", None)
-        change_blocked_status(open_session, _id)
+    db_user = await run(session, get_user_by_id, user_id=_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+    if not db_user.is_blocked:
+        queue(CONFIGURATION, "user_blocked_count", None)
+    await run(session, change_blocked_status, _id)
 
 
 @app.patch("/users/{_id}")
@@ -423,7 +659,7 @@ async def patch_user(
     request: Request,
     _id: int,
     user: UserUpdate,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Update user data."""
     record_metric('Custom/users-id/patch', COUNTER, NR_APP)
@@ -432,21 +668,23 @@ async def patch_user(
     if token["role"] == "user" and token["id"] != _id:
         logging.warning("Invalid role %s", token["role"])
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=_id)
-        if db_user is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-            )
-        update_user(session, _id, user)
-        if user.coordinates:
-            save_location(
-                MONGO_URL,
-                db_user.is_athlete,
-                _id,
-                user.coordinates,
-                CONFIGURATION,
-            )
+    db_user = await run(session, get_user_by_id, user_id=_id)
+    if db_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+        )
+    user.location = normalize_location(user)
+    await run(session, update_user, _id, user, outbox_coordinates(
+        db_user.is_athlete, user.coordinates, CONFIGURATION
+    ))
+    if user.coordinates:
+        await save_location(
+            session,
+            db_user.is_athlete,
+            _id,
+            user.coordinates,
+            CONFIGURATION,
+        )
     return JSONResponse(content={}, status_code=200)
 
 
@@ -455,7 +693,7 @@ async def add_balance(
     request: Request,
     body: BalanceBonus,
     user_id: int,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Add balance to a user wallet."""
     logging.info("Creating admin...")
@@ -464,10 +702,9 @@ async def add_balance(
     if token["role"] != "admin":
         logging.warning("Invalid credentials for balance modification")
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        receiver_wallet = get_wallet_details(open_session, user_id=user_id)
-        await add_to_balance(receiver_wallet, body.amount)
-        return JSONResponse(content={}, status_code=200)
+    receiver_wallet = await run(session, get_wallet_details, user_id=user_id)
+    await add_to_balance(receiver_wallet, body.amount)
+    return JSONResponse(content={}, status_code=200)
 
 
 # pylint: disable=too-many-arguments
@@ -476,12 +713,24 @@ async def get_all(
     username: Optional[str] = None,
     latitude: Optional[float] = None,
     longitude: Optional[float] = None,
-    radius: Optional[int] = 1000,
+    radius: Optional[int] = Query(1000, gt=0,
+                                  le=CONFIGURATION.geo.max_radius),
     offset: Optional[int] = 0,
     limit: Optional[int] = 10,
-    session: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = True,
+    estimate_total: Optional[bool] = False,
+    session: AnySession = Depends(get_db),
 ):
-    """Retrieve details for all users matching a search criteria."""
+    """Retrieve details for all users matching a search criteria.
+
+    Pass next_cursor from a previous page as cursor to page by key, which
+    stays fast for deep pages. Offset is ignored then.
+    Counting every match is skipped with include_total=false, or replaced
+    by an approximation with estimate_total=true.
+    Searching by location returns the closest users first, each with its
+    distance_m, within radius meters, up to USERS_GEO_MAX_RADIUS.
+    """
     logging.info(
         "Retrieving users, using filters: username='%s' latitude='%s' "
         "longitude='%s' radius='%s' offset='%s' limit='%s'",
@@ -489,26 +738,21 @@ async def get_all(
     )
     record_metric('Custom/users/get', COUNTER, NR_APP)
     coordinates = get_coordinates(longitude, latitude)
+    count = count_strategy(include_total, estimate_total)
     if username and coordinates:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="Can't search by username and location. Use only one."
         )
-    with session as open_session:
-        if username is None and coordinates is None:
-            logging.info("Retrieving all users...")
-            return get_all_users(open_session, limit=limit, offset=offset)
-        if coordinates:
-            user_ids = get_users_within(
-                get_mongodb_connection(MONGO_URL), coordinates, radius
-            )
-            logging.debug("Found %s trainer IDs close to position.", user_ids)
-            logging.info("Retrieving trainer data...")
-            return get_users_by_id(
-                open_session, get_user_ids(user_ids), limit, offset
-            )
-        logging.info("Retrieving user by name...")
-        db_user = get_user_by_username(open_session, username=username)
+    if username is None and coordinates is None:
+        logging.info("Retrieving all users...")
+        return await run(session, get_all_users, limit=limit, offset=offset,
+                         cursor=cursor, count=count)
+    if coordinates:
+        return await search_nearby(session, coordinates, radius, limit,
+                                   offset, cursor, count)
+    logging.info("Retrieving user by name...")
+    db_user = await run(session, get_user_by_username, username=username)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     if username is not None:
@@ -518,19 +762,47 @@ async def get_all(
     return db_user
 
 
+# pylint: disable=too-many-arguments
+async def search_nearby(session: AnySession, coordinates: Tuple[float, float],
+                        radius: int, limit: int, offset: int,
+                        cursor: Optional[str], count: str) -> dict:
+    """Return a page of trainers close to coordinates, closest first.
+
+    Uncached and crowded areas are paged by the index or MongoDB.
+    """
+    with_total = count != NO_TOTAL
+    trainers = await trainers_around(coordinates, radius, CONFIGURATION)
+    if trainers is not None:
+        nearby = page_within(nearest(trainers, coordinates, radius), limit,
+                             offset, cursor, with_total)
+    elif index_serves(CONFIGURATION):
+        nearby = GEO_INDEX.within(coordinates, radius, limit, offset, cursor,
+                                  with_total)
+    else:
+        nearby = await get_users_within(
+            get_mongodb_connection(CONFIGURATION), coordinates, radius,
+            limit, offset, cursor, with_total
+        )
+    logging.debug("Found %s trainers close to position.", nearby)
+    logging.info("Retrieving trainer data...")
+    users = await run(session, get_users_in_order,
+                      get_user_ids(nearby["items"]))
+    return nearby_page(nearby, users, limit, offset)
+
+
 @app.post("/users/recovery/{username}")
-async def password_recovery(username: str, session: Session = Depends(get_db)):
+async def password_recovery(username: str,
+                            session: AnySession = Depends(get_db)):
     """Request auth service to start password recovery for user_id."""
     logging.info("Recovering password for user %s...", username)
     record_metric('Custom/users-recover-username/post', COUNTER, NR_APP)
-    with session as open_session:
-        db_user = get_user_by_username(session=open_session, username=username)
-        if db_user is None:
-            raise HTTPException(status_code=404, detail="User not found")
+    db_user = await run(session, get_user_by_username, username=username)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     url = f"http://{CONFIGURATION.auth.host}/auth/recovery?email=" + \
           db_user["email"] + "&username=" + username
     logging.info("Requesting password recovery to %s...", url)
-    res = await httpx.AsyncClient().post(url)
+    res = await auth_client().post(url)
     if res.status_code != 200:
         error = res.json()["Message"]
         logging.error("Error when recovering password: %s", error)
@@ -542,31 +814,49 @@ async def password_recovery(username: str, session: Session = Depends(get_db)):
 @app.get("/users/{user_id}/followed")
 async def get_followed_users(
     user_id: int,
-    session: Session = Depends(get_db)
+    limit: Optional[int] = 100,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = Query(None),
+    include_total: Optional[bool] = True,
+    estimate_total: Optional[bool] = False,
+    session: AnySession = Depends(get_db)
 ):
-    """Retrieve all users followed by user with specified id."""
+    """Retrieve users followed by user with specified id.
+
+    Pages hold up to limit users, pass next_cursor as cursor for the next
+    one. Repeat fields to return only those columns, id is always present.
+    """
     logging.info("Getting followed users for user %s...", user_id)
     record_metric('Custom/users-id-followed/get', COUNTER, NR_APP)
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=user_id)
-        if db_user is None:
-            raise HTTPException(status_code=404, detail="User not found")
-    return get_users_followed_by(session, user_id)
+    db_user = await run(session, get_user_by_id, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await run(session, get_users_followed_by, user_id, limit, cursor,
+                     fields, count_strategy(include_total, estimate_total))
 
 
 @app.get("/users/{user_id}/followers")
 async def get_user_followers(
     user_id: int,
-    session: Session = Depends(get_db)
+    limit: Optional[int] = 100,
+    cursor: Optional[str] = None,
+    fields: Optional[List[str]] = Query(None),
+    include_total: Optional[bool] = True,
+    estimate_total: Optional[bool] = False,
+    session: AnySession = Depends(get_db)
 ):
-    """Retrieve all users followed by user with specified id."""
+    """Retrieve users who follow user with specified id.
+
+    Pages hold up to limit users, pass next_cursor as cursor for the next
+    one. Repeat fields to return only those columns, id is always present.
+    """
     logging.info("Getting followers for user %s...", user_id)
     record_metric('Custom/users-id-followers/get', COUNTER, NR_APP)
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=user_id)
-        if db_user is None:
-            raise HTTPException(status_code=404, detail="User not found")
-    return get_followers(session, user_id)
+    db_user = await run(session, get_user_by_id, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await run(session, get_followers, user_id, limit, cursor, fields,
+                     count_strategy(include_total, estimate_total))
 
 
 @app.delete("/users/{user_id}/followed/{_id}")
@@ -574,18 +864,17 @@ async def stop_following_user(
     request: Request,
     _id: int,
     user_id: int,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
-    """Retrieve all users followed by user with specified id."""
+    """Stop following user _id, returning the follow that was removed."""
     record_metric('Custom/users-id-followed-id/delete', COUNTER, NR_APP)
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=user_id)
-        if db_user is None:
-            raise HTTPException(status_code=404, detail="User not found")
+    db_user = await run(session, get_user_by_id, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
     token = await get_credentials(request)
     if token["id"] != user_id:
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    return unfollow_user(session, user_id, _id)
+    return await run(session, unfollow_user, user_id, _id)
 
 
 @app.post("/users/{user_id}/followed/{_id}")
@@ -593,12 +882,11 @@ async def follow_user(
     request: Request,
     _id: int,
     user_id: int,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
-    """Retrieve all users followed by user with specified id."""
+    """Follow user _id, returning the new follow."""
     record_metric('Custom/users-id-followed-id/post', COUNTER, NR_APP)
-    with session as open_session:
-        db_user = get_user_by_id(open_session, user_id=user_id)
+    db_user = await run(session, get_user_by_id, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     token = await get_credentials(request)
@@ -607,14 +895,14 @@ async def follow_user(
     if _id == user_id:
         msg = "User can't follow himself"
         raise HTTPException(status_code=400, detail=msg)
-    return follow_new_user(session, user_id, _id)
+    return await run(session, follow_new_user, user_id, _id)
 
 
 # Admin endpoints. Maybe move to their own module.
 @app.post("/admins")
 async def add_admin(
     new_admin: AdminCreationDTO,
-    session: Session = Depends(get_db)
+    session: AnySession = Depends(get_db)
 ):
     """Create an admin."""
     logging.info("Creating admin...")
@@ -626,12 +914,11 @@ async def add_admin(
         msg = {'message': 'Error! Missing Password.'}
         raise HTTPException(detail=msg, status_code=400)
     await add_user_firebase(new_admin.email, new_admin.password)
-    with session as open_session:
-        return create_admin(open_session, new_admin)
+    return await run(session, create_admin, new_admin)
 
 
 @app.get("/admins")
-async def get_admins(request: Request, session: Session = Depends(get_db)):
+async def get_admins(request: Request, session: AnySession = Depends(get_db)):
     """Return all administrators."""
     logging.info("Retrieving admins...")
     record_metric('Custom/admins/get', COUNTER, NR_APP)
@@ -639,12 +926,11 @@ async def get_admins(request: Request, session: Session = Depends(get_db)):
     if token["role"] != "admin":
         logging.warning("Invalid role %s", token["role"])
         raise HTTPException(status_code=403, detail="Invalid credentials")
-    with session as open_session:
-        return get_all_admins(open_session)
+    return await run(session, get_all_admins)
 
 
 @app.post("/admins/login")
-async def admin_login(request: Request, session: Session = Depends(get_db)):
+async def admin_login(request: Request, session: AnySession = Depends(get_db)):
     """Login as administrator. Return token if successful."""
     logging.info("Login admins...")
     record_metric('Custom/admins-login/post', COUNTER, NR_APP)
@@ -658,6 +944,16 @@ async def health_check() -> HealthCheckDto:
     return HealthCheckDto(uptime=time.time() - START)
 
 
+@app.get(BASE_URI + "/caches/")
+async def cache_stats():
+    """Return size and hit/miss/eviction counters for in-process caches."""
+    return {
+        "credentials": CREDENTIALS_CACHE.stats(),
+        "counts": COUNTS_CACHE.stats(),
+        "geo": GEO_CACHE.stats(),
+    }
+
+
 @app.get(DOCUMENTATION_URI, include_in_schema=False)
 async def custom_swagger_ui_html(req: Request):
     """To show Swagger with API documentation."""
@@ -670,9 +966,29 @@ async def custom_swagger_ui_html(req: Request):
 
 
 @app.get(BASE_URI + "/locations/", response_model=List[Location])
-async def get_locations() -> List[Location]:
-    """Return CABA locations. Coordinates format (longitude, latitude)."""
+async def get_locations(if_none_match: Optional[str] = Header(None)):
+    """Return CABA locations. Coordinates format (longitude, latitude).
+
+    Answers 304 when If-None-Match holds the current ETag.
+    """
     logging.info("Returning locations...")
     record_metric('Custom/users-locations/get', COUNTER, NR_APP)
-    with open("static/location.json", encoding="UTF-8") as location_file:
-        return json.load(location_file)
+    return get_catalog(CONFIGURATION.locations_max_age).response(
+        if_none_match
+    )
+
+
+@app.get(BASE_URI + "/locations/nearest/", response_model=NearestLocation)
+async def get_nearest_location(longitude: float, latitude: float):
+    """Return the neighborhood closest to coordinates, with distance."""
+    record_metric('Custom/users-locations-nearest/get', COUNTER, NR_APP)
+    found = get_catalog(CONFIGURATION.locations_max_age).nearest(
+        (longitude, latitude)
+    )
+    if found is None or found[1] > CONFIGURATION.locations_max_distance:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No location near those coordinates",
+        )
+    location, distance = found
+    return NearestLocation(distance_m=distance, **location.dict())
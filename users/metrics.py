@@ -1,37 +1,194 @@
 """Write application metrics to Reddis queue."""
 
+import asyncio
 import logging
+import time
 from datetime import datetime
-from typing import Optional
-from redis import Redis, BlockingConnectionPool
+from typing import Dict, Optional, Tuple
+
+from redis.asyncio import Redis
 from users.config import AppConfig
+from users.tasks import cancel, repeat
+from users.telemetry import REGISTRY, Gauge, observe_dependency
+
+QUEUE_KEY = "metrics"
+
+# Shared by every request, see start_metrics.
+FLUSHER: Optional["MetricsFlusher"] = None
+FLUSHER_GAUGE = REGISTRY.register(Gauge(
+    "metrics_flusher", "Buffered, flushed and dropped metric events.",
+    ("stat",)
+))
 
 
 def get_redis_connection(config: AppConfig) -> Redis:
-    """Create a redis connection."""
+    """Create a pooled asyncio redis client."""
     logging.info("Connecting to Redis...")
-    pool = BlockingConnectionPool(
+    return Redis(
         host=config.redis.host,
         port=config.redis.port,
         db=0,
-        timeout=10,
+        socket_timeout=config.redis.timeout,
+        socket_connect_timeout=config.redis.timeout,
+    )
+
+
+# pylint: disable=too-many-instance-attributes
+class MetricsFlusher:
+    """Buffer metric events and push them to Redis in batches.
+
+    Events with the same metric and label are coalesced into one message
+    whose value is their count. Messages are pushed with one pipeline every
+    flush_interval seconds, or sooner once batch_size events are waiting.
+    At most buffer_size distinct messages are kept while Redis is down,
+    events for new ones are dropped and counted. Failed flushes are retried
+    with backoff, up to max_backoff seconds apart.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, client: Redis, flush_interval: float,
+                 batch_size: int, buffer_size: int, max_backoff: float = 60):
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.buffer: Dict[Tuple[str, Optional[str]], list] = {}
+        self.pending = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, label: Optional[str] = None, value: int = 1,
+            date: Optional[str] = None):
+        """Count value events for a metric, without blocking."""
+        self.keep(name, label, value, date)
+        if self.pending >= self.batch_size:
+            self.wake.set()
+
+    def keep(self, name: str, label: Optional[str], value: int,
+             date: Optional[str] = None):
+        """Buffer value events for a metric, or drop them if it is full."""
+        entry = self.buffer.get((name, label))
+        if entry is None:
+            if len(self.buffer) >= self.buffer_size:
+                self.dropped += value
+                return
+            date = date or datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+            entry = self.buffer[(name, label)] = [0, date]
+        entry[0] += value
+        self.pending += value
+
+    async def flush(self):
+        """Push buffered messages to Redis in a single pipeline.
+
+        On errors the messages go back to the buffer for the next flush,
+        without waking the flush task, and the error is raised.
+        """
+        if not self.buffer:
+            return
+        batch, self.buffer, self.pending = self.buffer, {}, 0
+        pipeline = self.client.pipeline(transaction=False)
+        for (name, label), (value, date) in batch.items():
+            message = {"metric": name, "value": value, "date": date}
+            if label:
+                message["label"] = label
+            pipeline.rpush(QUEUE_KEY, str(message))
+        start = time.perf_counter()
+        try:
+            await pipeline.execute()
+        except Exception:
+            observe_dependency("redis", "pipeline",
+                               time.perf_counter() - start, failed=True)
+            self.failures += 1
+            dropped = self.dropped
+            for (name, label), (value, date) in batch.items():
+                self.keep(name, label, value, date)
+            if self.dropped > dropped:
+                logging.warning("Metrics buffer full, %d events dropped.",
+                                self.dropped - dropped)
+            raise
+        observe_dependency("redis", "pipeline", time.perf_counter() - start)
+        self.flushed += len(batch)
+        logging.debug("Flushed %d metric messages.", len(batch))
+
+    async def flush_forever(self):
+        """Flush every flush_interval seconds or when a batch is full."""
+        await repeat(self.flush, self.wake, self.flush_interval,
+                     self.max_backoff, "saving metrics")
+
+    def start(self):
+        """Flush in a background task."""
+        self.wake = asyncio.Event()
+        self.task = asyncio.create_task(self.flush_forever())
+
+    async def stop(self):
+        """Stop the background task, flushing what is left."""
+        await cancel(self.task)
+        self.task = None
+        try:
+            await self.flush()
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("Error when saving metrics on stop, %d events "
+                              "lost.", self.pending)
+
+    def stats(self) -> dict:
+        """Return buffer size and flush/drop counters."""
+        return {
+            "buffered": len(self.buffer),
+            "pending_events": self.pending,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failures": self.failures,
+        }
+
+
+def build_flusher(config: AppConfig) -> MetricsFlusher:
+    """Create a flusher from the Redis configuration."""
+    return MetricsFlusher(
+        get_redis_connection(config),
+        config.redis.flush_interval,
+        config.redis.batch_size,
+        config.redis.buffer_size,
+        config.redis.max_backoff,
     )
-    return Redis(connection_pool=pool)
 
 
-# pylint: disable=broad-exception-caught
+def get_flusher(config: AppConfig) -> MetricsFlusher:
+    """Return the shared flusher, creating it if not started yet."""
+    global FLUSHER  # pylint: disable=global-statement
+    if FLUSHER is None:
+        FLUSHER = build_flusher(config)
+    return FLUSHER
+
+
+def start_metrics(config: AppConfig):
+    """Start flushing metrics in the background."""
+    get_flusher(config).start()
+
+
+async def stop_metrics():
+    """Flush pending metrics and close the Redis client."""
+    global FLUSHER  # pylint: disable=global-statement
+    if FLUSHER is None:
+        return
+    await FLUSHER.stop()
+    await FLUSHER.client.aclose()
+    FLUSHER = None
+
+
+def collect_flusher_stats():
+    """Copy flusher counters into FLUSHER_GAUGE."""
+    if FLUSHER is not None:
+        for stat, value in FLUSHER.stats().items():
+            FLUSHER_GAUGE.labels(stat).set(value)
+
+
+REGISTRY.add_collector(collect_flusher_stats)
+
+
 def queue(config: AppConfig, name: str, label: Optional[str] = None) -> None:
     """Queue a metric with name and label."""
-    message = {
-        "metric": name,
-        "value": 1,  # How much to increase
-        "date": datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-    }
-    if label:
-        message["label"] = label
-    try:
-        client = get_redis_connection(config)
-        logging.exception("Queuing message %s", message)
-        client.rpush("metrics", str(message))
-    except Exception:
-        logging.exception("Error when trying to save metrics.")
+    get_flusher(config).add(name, label)
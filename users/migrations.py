@@ -0,0 +1,128 @@
+"""Bring databases created by older versions up to the current schema.
+
+Every step is idempotent, so migrate runs on each startup after
+create_tables and can also be run by hand:
+
+    python -m users.migrations
+"""
+import asyncio
+import logging
+from typing import Callable, List, Union
+
+from environ import to_config
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateIndex
+
+from users.config import AppConfig
+from users.database import build_engine, dispose
+from users.ledger import add_upcoming_partitions, partition_transactions
+from users.rollups import build_rollups
+from users.models import Base, Transactions
+
+
+def find_duplicates(connection: Connection, index) -> list:
+    """Return up to 5 values repeated in the columns of a unique index."""
+    expressions = list(index.expressions)
+    return connection.execute(
+        select(*expressions, func.count())
+        .group_by(*expressions)
+        .having(func.count() > 1)
+        .limit(5)
+    ).all()
+
+
+def add_lookup_indexes(connection: Connection):
+    """Create indexes and unique constraints missing from older tables.
+
+    Unique indexes are skipped, and their duplicates logged, while rows
+    break them. They are created on the next run once those are fixed.
+    """
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"]
+                    for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.unique:
+                duplicates = find_duplicates(connection, index)
+                if duplicates:
+                    logging.error(
+                        "Can't create unique index %s, duplicated: %s",
+                        index.name, duplicates,
+                    )
+                    continue
+            # Not every dialect reflects expression indexes.
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def add_transaction_ids(connection: Connection):
+    """Replace the (sender, receiver, amount, date) key with an id.
+
+    Postgres adds a serial column in place. SQLite can't change a primary
+    key, so the table is copied, numbering rows by date.
+    """
+    columns = {column["name"] for column in
+               inspect(connection).get_columns(Transactions.__tablename__)}
+    if "id" in columns:
+        return
+    logging.info("Adding ids to transactions...")
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(
+            "ALTER TABLE transactions DROP CONSTRAINT transactions_pkey"
+        ))
+        connection.execute(text(
+            "ALTER TABLE transactions ADD COLUMN id SERIAL PRIMARY KEY"
+        ))
+        return
+    connection.execute(text(
+        "ALTER TABLE transactions RENAME TO transactions_before_ids"
+    ))
+    Transactions.__table__.create(connection)
+    connection.execute(text(
+        "INSERT INTO transactions (sender, receiver, amount, date) "
+        "SELECT sender, receiver, amount, date "
+        "FROM transactions_before_ids ORDER BY date"
+    ))
+    connection.execute(text("DROP TABLE transactions_before_ids"))
+
+
+# Indexes go last, to cover tables rebuilt by previous steps.
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    add_transaction_ids,
+    partition_transactions,
+    add_upcoming_partitions,
+    build_rollups,
+    add_lookup_indexes,
+]
+
+
+def migrate_sync(connection: Connection):
+    """Apply every migration on a connection."""
+    for migration in MIGRATIONS:
+        logging.info("Applying migration %s...", migration.__name__)
+        migration(connection)
+
+
+async def migrate(engine: Union[Engine, AsyncEngine]):
+    """Apply every migration in one transaction."""
+    if isinstance(engine, AsyncEngine):
+        async with engine.begin() as connection:
+            await connection.run_sync(migrate_sync)
+    else:
+        with engine.begin() as connection:
+            migrate_sync(connection)
+
+
+async def main():
+    """Migrate the configured database."""
+    engine = build_engine(to_config(AppConfig))
+    await migrate(engine)
+    await dispose(engine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
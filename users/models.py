@@ -1,7 +1,7 @@
 """Defines table structure for each table in the database."""
 
 from sqlalchemy import Column, String, Integer, \
-    Float, Boolean, ForeignKey, DateTime
+    Float, Boolean, ForeignKey, Date, DateTime, Index, func
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -13,7 +13,7 @@ class Users(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     email = Column(String)
-    username = Column(String)
+    username = Column(String, unique=True, index=True)
     name = Column(String)
     surname = Column(String)
     height = Column(Float)
@@ -23,6 +23,9 @@ class Users(Base):
     registration_date = Column(String)
     is_athlete = Column(Boolean)
     is_blocked = Column(Boolean)
+    __table_args__ = (
+        Index("ix_users_email_lower", func.lower(email), unique=True),
+    )
 
 
 class FollowedUsers(Base):
@@ -30,7 +33,17 @@ class FollowedUsers(Base):
 
     __tablename__ = "usersFollowed"
     id = Column(Integer, ForeignKey("users.id"), primary_key=True)
-    followed_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    followed_id = Column(Integer, ForeignKey("users.id"), primary_key=True,
+                         index=True)
+
+
+class UsersLocations(Base):
+    """Table structure for trainer coordinates, used without MongoDB."""
+
+    __tablename__ = "usersLocations"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    longitude = Column(Float)
+    latitude = Column(Float)
 
 
 class UsersWallets(Base):
@@ -38,18 +51,81 @@ class UsersWallets(Base):
 
     __tablename__ = "usersWallets"
     user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
-    address = Column(String)
+    address = Column(String, unique=True, index=True)
     private_key = Column(String)
 
 
+class PooledWallets(Base):
+    """Table structure for wallets created ahead of signups."""
+
+    __tablename__ = "walletPool"
+    address = Column(String, primary_key=True)
+    private_key = Column(String)
+    created_at = Column(DateTime)
+
+
+class LocationOutbox(Base):
+    """Table structure for location changes not yet sent to MongoDB."""
+
+    __tablename__ = "locationOutbox"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer)
+    longitude = Column(Float)
+    latitude = Column(Float)
+    created_at = Column(DateTime)
+
+
+class FailedCompensations(Base):
+    """Table structure for signup steps that could not be undone yet."""
+
+    __tablename__ = "failedCompensations"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    step = Column(String)
+    payload = Column(String)
+    error = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime)
+
+
 class Transactions(Base):
     """Table structure for user."""
 
     __tablename__ = "transactions"
-    sender = Column(String, primary_key=True)
-    receiver = Column(String, primary_key=True)
-    amount = Column(Float, primary_key=True)
-    date = Column(DateTime, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sender = Column(String)
+    receiver = Column(String)
+    amount = Column(Float)
+    date = Column(DateTime)
+    # Listings are sorted by (date, id), filtered by sender or receiver.
+    __table_args__ = (
+        Index("ix_transactions_date", date, id),
+        Index("ix_transactions_sender_date", sender, date, id),
+        Index("ix_transactions_receiver_date", receiver, date, id),
+    )
+
+
+class TransactionRollups(Base):
+    """Per wallet and day totals of sent and received transactions."""
+
+    __tablename__ = "transactionRollups"
+    wallet = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    sent_count = Column(Integer, nullable=False, default=0)
+    sent_total = Column(Float, nullable=False, default=0.0)
+    sent_max = Column(Float)
+    received_count = Column(Integer, nullable=False, default=0)
+    received_total = Column(Float, nullable=False, default=0.0)
+    received_max = Column(Float)
+
+
+class DailyTransactionRollups(Base):
+    """Per day totals of every transaction."""
+
+    __tablename__ = "transactionDailyRollups"
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)
+    max = Column(Float)
 
 
 class Admin(Base):
@@ -59,3 +135,6 @@ class Admin(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     email = Column(String)
     username = Column(String)
+    __table_args__ = (
+        Index("ix_admin_email_lower", func.lower(email), unique=True),
+    )
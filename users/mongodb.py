@@ -1,13 +1,23 @@
 """MongoDB connection and queries."""
+import asyncio
 import logging
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
 
-from pymongo import MongoClient, GEOSPHERE
+from pymongo import AsyncMongoClient, MongoClient, GEOSPHERE, UpdateOne
 
 from users.config import AppConfig
+from users.geo_index import EARTH_RADIUS_M
+from users.pagination import decode_values, encode_cursor
 
 LOCATION_KEY = "location"
 USER_ID_KEY = "user_id"
+DISTANCE_KEY = "distance"
+VERSION_KEY = "outbox_id"
+
+AnyMongoClient = Union[MongoClient, AsyncMongoClient]
+
+# Shared by every request, see start_mongo.
+CLIENT: Optional[AnyMongoClient] = None
 
 
 def get_mongo_url(config: AppConfig) -> str:
@@ -16,45 +26,211 @@ def get_mongo_url(config: AppConfig) -> str:
         f"{config.mongo.password}@{config.mongo.host}/{config.mongo.database}"
 
 
-def initialize(connection: MongoClient):
+def build_mongo_client(config: AppConfig) -> AnyMongoClient:
+    """Create a pooled client, asyncio based if configured."""
+    client_class = AsyncMongoClient if config.mongo.asynchronous \
+        else MongoClient
+    return client_class(
+        get_mongo_url(config),
+        maxPoolSize=config.mongo.max_pool_size,
+        minPoolSize=config.mongo.min_pool_size,
+        maxIdleTimeMS=int(config.mongo.max_idle_time * 1000),
+        serverSelectionTimeoutMS=int(
+            config.mongo.server_selection_timeout * 1000
+        ),
+    )
+
+
+def start_mongo(config: AppConfig):
+    """Create the shared client."""
+    global CLIENT  # pylint: disable=global-statement
+    logging.info("Creating MongoDB client...")
+    CLIENT = build_mongo_client(config)
+
+
+async def close_mongo():
+    """Close the shared client, releasing pooled connections."""
+    global CLIENT  # pylint: disable=global-statement
+    if CLIENT is None:
+        return
+    logging.info("Closing MongoDB client...")
+    if isinstance(CLIENT, AsyncMongoClient):
+        await CLIENT.close()
+    else:
+        CLIENT.close()
+    CLIENT = None
+
+
+def get_mongodb_connection(config: AppConfig) -> AnyMongoClient:
+    """Return the shared client, creating it if not started yet."""
+    if CLIENT is None:
+        start_mongo(config)
+    return CLIENT
+
+
+async def initialize(connection: AnyMongoClient):
     """Create geolocation index."""
-    connection.fiufit.user_location.create_index([(LOCATION_KEY, GEOSPHERE)])
+    collection = connection.fiufit.user_location
+    index = [(LOCATION_KEY, GEOSPHERE)]
+    if isinstance(connection, AsyncMongoClient):
+        await collection.create_index(index)
+    else:
+        await asyncio.to_thread(collection.create_index, index)
+
+
+def location_update(outbox_id: int, user_id: int,
+                    location: Tuple[float, float]) -> UpdateOne:
+    """Upsert a location unless the document holds a newer one.
+
+    Documents keep the outbox id of their location, so replaying or
+    reordering outbox rows never brings back an older location.
+    """
+    newer = {"$lt": [f"${VERSION_KEY}", outbox_id]}
+    return UpdateOne({USER_ID_KEY: user_id}, [{"$set": {
+        LOCATION_KEY: {"$cond": [newer, {"$literal": list(location)},
+                                 f"${LOCATION_KEY}"]},
+        VERSION_KEY: {"$cond": [newer, outbox_id, f"${VERSION_KEY}"]},
+    }}], upsert=True)
 
 
-def get_mongodb_connection(connection_string: str) -> MongoClient:
-    """Create a MongoDB connection."""
-    client = MongoClient(connection_string)
-    return client
+async def write_locations(connection: AnyMongoClient, locations: List):
+    """Write (outbox_id, user_id, location) rows with a single bulk_write.
 
+    Only the latest row of each user is sent.
+    """
+    latest = {user_id: (outbox_id, user_id, location)
+              for outbox_id, user_id, location in sorted(locations)}
+    requests = [location_update(*row) for row in latest.values()]
+    logging.info("Writing %d locations", len(requests))
+    collection = connection.fiufit.user_location
+    if isinstance(connection, AsyncMongoClient):
+        await collection.bulk_write(requests, ordered=False)
+    else:
+        await asyncio.to_thread(collection.bulk_write, requests,
+                                ordered=False)
 
-def edit_location(
-    connection: MongoClient, user_id: int, location: Tuple[float, float]
-):
-    """Edit location for a user. Creates if does not exist."""
-    user_filter = {USER_ID_KEY: user_id}
-    document = {USER_ID_KEY: user_id, LOCATION_KEY: location}
-    logging.info("Updating location %s", document)
-    connection.fiufit.user_location.replace_one(
-        user_filter, document, upsert=True
+
+async def find_locations(connection: AnyMongoClient, query: dict,
+                         limit: int = 0) -> List:
+    """Return (user_id, (longitude, latitude)) of documents matching query.
+
+    At most limit of them, unless it is 0.
+    """
+    cursor = connection.fiufit.user_location.find(
+        query,
+        projection={"_id": False, USER_ID_KEY: True, LOCATION_KEY: True},
+        limit=limit,
     )
+    if isinstance(connection, AsyncMongoClient):
+        documents = await cursor.to_list()
+    else:
+        documents = await asyncio.to_thread(list, cursor)
+    return [(document[USER_ID_KEY], tuple(document[LOCATION_KEY]))
+            for document in documents]
+
+
+async def get_all_locations(connection: AnyMongoClient) -> List:
+    """Return (user_id, (longitude, latitude)) for every saved location."""
+    return await find_locations(connection, {})
+
+
+async def get_locations_within(connection: AnyMongoClient,
+                               location: Tuple[float, float],
+                               radius: float, limit: int = 0) -> List:
+    """Return (user_id, (longitude, latitude)) within radius meters.
+
+    At most limit of them, unless it is 0.
+    """
+    return await find_locations(connection, {LOCATION_KEY: {"$geoWithin": {
+        "$centerSphere": [list(location), radius / EARTH_RADIUS_M],
+    }}}, limit)
 
 
-def get_users_within(
-    connection: MongoClient, location: Tuple[float, float], radius: int
-) -> List:
-    """Search for users within radius from location."""
-    query = {
-        "location": {
-            "$near": {
-                "$geometry": {
-                    "type": "Point",
-                    "coordinates": location
-                },
-                "$maxDistance": radius
-            }
-        }
+# pylint: disable=too-many-arguments
+def build_near_pipeline(
+    location: Tuple[float, float],
+    radius: int,
+    limit: int,
+    offset: int,
+    after: Optional[list] = None,
+    with_total: bool = True,
+) -> List[dict]:
+    """Build a $geoNear aggregation returning one page of nearby users.
+
+    Users are sorted by distance, then user id. With after, a
+    [distance, user_id] pair, the page starts right after that user and
+    offset is ignored. One extra user is fetched to know if there is a next
+    page. Counting every user in range needs a $facet, skipped without
+    with_total.
+    """
+    near = {
+        "near": {"type": "Point", "coordinates": location},
+        "distanceField": DISTANCE_KEY,
+        "maxDistance": radius,
+        "spherical": True,
+        "key": LOCATION_KEY,
+    }
+    stages = []
+    if after:
+        distance, user_id = after
+        near["minDistance"] = distance
+        stages.append({"$match": {"$or": [
+            {DISTANCE_KEY: {"$gt": distance}},
+            {USER_ID_KEY: {"$gt": user_id}},
+        ]}})
+        offset = 0
+    items = stages + [
+        {"$sort": {DISTANCE_KEY: 1, USER_ID_KEY: 1}},
+        {"$skip": offset},
+        {"$limit": limit + 1},
+        {"$project": {"_id": False, USER_ID_KEY: True, DISTANCE_KEY: True}},
+    ]
+    if not with_total:
+        return [{"$geoNear": near}] + items
+    return [{"$geoNear": near}, {"$facet": {
+        "items": items, "total": [{"$count": "count"}]
+    }}]
+
+
+# pylint: disable=too-many-arguments
+async def get_users_within(
+    connection: AnyMongoClient,
+    location: Tuple[float, float],
+    radius: int,
+    limit: int,
+    offset: int,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+) -> dict:
+    """Search for users within radius from location, closest first.
+
+    Returns documents with user_id and distance in meters for one page,
+    the number of users in range if with_total, and the cursor for the
+    next page.
+    """
+    after = decode_values(cursor, 2) if cursor else None
+    pipeline = build_near_pipeline(
+        location, radius, limit, offset, after, with_total
+    )
+    logging.info("Searching for users %s", pipeline)
+    collection = connection.fiufit.user_location
+    if isinstance(connection, AsyncMongoClient):
+        results = await (await collection.aggregate(pipeline)).to_list()
+    else:
+        results = await asyncio.to_thread(
+            lambda: list(collection.aggregate(pipeline))
+        )
+    total = None
+    documents = results
+    if with_total:
+        documents = results[0]["items"] if results else []
+        counts = results[0]["total"] if results else []
+        total = counts[0]["count"] if counts else 0
+    items = documents[:limit]
+    return {
+        "items": items,
+        "total": total,
+        "next_cursor": encode_cursor(
+            [items[-1][DISTANCE_KEY], items[-1][USER_ID_KEY]]
+        ) if len(documents) > limit else None,
     }
-    logging.info("Searching for users %s", query)
-    return list(connection.fiufit.user_location.find(
-        query, projection={"_id": False, "user_id": True}
-    )) or []
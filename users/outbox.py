@@ -0,0 +1,175 @@
+"""Location changes on their way to MongoDB.
+
+Requests never wait on MongoDB: a location change is added to
+locationOutbox in the same transaction that creates or updates the user,
+and a background relay sends pending rows with one bulk_write per batch,
+deleting them once MongoDB took them. Failed batches stay in the outbox
+and are retried with exponential backoff. Batches are locked with
+SELECT ... FOR UPDATE SKIP LOCKED, so replicas relay different rows, and
+documents remember the row they came from, see location_update.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from newrelic.agent import record_custom_metric as record_metric
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from users.database import close, run
+from users.models import LocationOutbox
+from users.mongodb import AnyMongoClient, write_locations
+from users.tasks import cancel, repeat
+from users.telemetry import REGISTRY, Counter, Gauge, Histogram
+
+OUTBOX_DEPTH = REGISTRY.register(Gauge(
+    "location_outbox_depth", "Location changes not yet in MongoDB.",
+))
+OUTBOX_LAG = REGISTRY.register(Gauge(
+    "location_outbox_lag_seconds",
+    "Age of the oldest location change not yet in MongoDB.",
+))
+RELAY_LATENCY = REGISTRY.register(Histogram(
+    "location_outbox_write_duration_seconds",
+    "Time to write one batch of locations to MongoDB.",
+))
+RELAYED = REGISTRY.register(Counter(
+    "location_outbox_relayed_total",
+    "Location changes relayed to MongoDB, by outcome.", ("outcome",),
+))
+
+
+def record_location(session: Session, user_id: int,
+                    coordinates: Tuple[float, float]):
+    """Queue a location change, saved with the caller's commit."""
+    session.add(LocationOutbox(user_id=user_id, longitude=coordinates[0],
+                               latitude=coordinates[1],
+                               created_at=datetime.now()))
+
+
+def record_locations(session: Session,
+                     changes: List[Tuple[int, Tuple[float, float]]]):
+    """Queue (user_id, coordinates) changes with one multi-row insert."""
+    now = datetime.now()
+    session.execute(insert(LocationOutbox), [
+        {"user_id": user_id, "longitude": coordinates[0],
+         "latitude": coordinates[1], "created_at": now}
+        for user_id, coordinates in changes
+    ])
+
+
+def pending_locations(session: Session, limit: int) -> List[tuple]:
+    """Lock the oldest queued changes, as (id, user_id, coordinates).
+
+    Rows locked by other relays are skipped. They stay locked until
+    sent_locations commits or the session rolls back.
+    """
+    rows = session.execute(
+        select(LocationOutbox.id, LocationOutbox.user_id,
+               LocationOutbox.longitude, LocationOutbox.latitude)
+        .order_by(LocationOutbox.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not rows:
+        session.rollback()
+    return [(_id, user_id, (longitude, latitude))
+            for _id, user_id, longitude, latitude in rows]
+
+
+def sent_locations(session: Session, ids: List[int]):
+    """Remove changes already written to MongoDB."""
+    session.execute(delete(LocationOutbox).where(LocationOutbox.id.in_(ids)))
+    session.commit()
+
+
+def outbox_status(session: Session) -> Tuple[int, Optional[datetime]]:
+    """Return how many changes are queued and when the oldest was."""
+    count, oldest = session.execute(
+        select(func.count(), func.min(LocationOutbox.created_at))
+    ).one()
+    return count, oldest
+
+
+class LocationRelay:
+    """Drains the location outbox to MongoDB in a background task.
+
+    on_sent, if given, is called with the (user_id, coordinates) of every
+    batch MongoDB took.
+    """
+
+    def __init__(self, batch_size: int, poll_interval: float,
+                 max_backoff: float, on_sent: Optional[Callable] = None):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.on_sent = on_sent
+        self.wanted = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    async def report(self, session_factory: Callable):
+        """Publish how many changes wait and for how long."""
+        session = session_factory()
+        try:
+            depth, oldest = await run(session, outbox_status)
+        finally:
+            await close(session)
+        lag = (datetime.now() - oldest).total_seconds() if oldest else 0.0
+        OUTBOX_DEPTH.labels().set(depth)
+        OUTBOX_LAG.labels().set(lag)
+        record_metric("Custom/location-outbox/depth", depth)
+        record_metric("Custom/location-outbox/lag", lag)
+
+    async def relay(self, session, connection: AnyMongoClient) -> int:
+        """Send one batch to MongoDB, returning how many changes it had."""
+        locations = await run(session, pending_locations, self.batch_size)
+        if not locations:
+            return 0
+        start = time.perf_counter()
+        try:
+            await write_locations(connection, locations)
+        except Exception:
+            RELAYED.labels("failed").inc(len(locations))
+            raise
+        elapsed = time.perf_counter() - start
+        RELAY_LATENCY.labels().observe(elapsed)
+        record_metric("Custom/location-outbox/write", elapsed)
+        await run(session, sent_locations,
+                  [location[0] for location in locations])
+        RELAYED.labels("sent").inc(len(locations))
+        if self.on_sent is not None:
+            self.on_sent([(user_id, coordinates)
+                          for _, user_id, coordinates in locations])
+        return len(locations)
+
+    async def drain(self, session_factory: Callable,
+                    connection: AnyMongoClient):
+        """Relay batches until the outbox is empty."""
+        session = session_factory()
+        try:
+            while await self.relay(session, connection) == self.batch_size:
+                pass
+        finally:
+            await close(session)
+            await self.report(session_factory)
+
+    async def relay_forever(self, session_factory: Callable,
+                            connection: AnyMongoClient):
+        """Drain when changes are queued, or every poll_interval seconds.
+
+        Failures are retried with backoff, see users.tasks.repeat.
+        """
+        await repeat(lambda: self.drain(session_factory, connection),
+                     self.wanted, self.poll_interval, self.max_backoff,
+                     "relaying locations to MongoDB")
+
+    def start(self, session_factory: Callable, connection: AnyMongoClient):
+        """Relay queued changes in a background task."""
+        self.task = asyncio.create_task(
+            self.relay_forever(session_factory, connection)
+        )
+
+    async def stop(self):
+        """Cancel the relay task, queued changes wait for the next start."""
+        await cancel(self.task)
+        self.task = None
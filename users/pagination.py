@@ -0,0 +1,227 @@
+"""Helpers to paginate list queries."""
+import binascii
+import json
+import logging
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select, text, tuple_, union
+from sqlalchemy.orm import Query
+
+from users.cache import TTLCache
+
+# How to fill in the total of a page.
+EXACT = "exact"  # Run a count() along with the page query.
+ESTIMATED = "estimated"  # Ask the planner, or reuse a recent count().
+NO_TOTAL = "none"  # Skip it, total and pages are null.
+
+# Exact counts reused for estimates on databases without a planner estimate.
+COUNTS_CACHE = TTLCache(1024, 60)
+
+
+def encode_cursor(values: list) -> str:
+    """Build an opaque cursor from the key values of the last row."""
+    return urlsafe_b64encode(
+        json.dumps(values, default=datetime.isoformat).encode()
+    ).decode()
+
+
+def decode_values(cursor: str, size: int) -> list:
+    """Return the size values stored in a cursor."""
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError("Wrong number of values")
+        return values
+    except (ValueError, TypeError, binascii.Error) as error:
+        raise HTTPException(status_code=400,
+                            detail="Invalid cursor") from error
+
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    """Return key values in a cursor, converted to the column types."""
+    values = decode_values(cursor, len(columns))
+    try:
+        return [
+            datetime.fromisoformat(value)
+            if column.type.python_type is datetime else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError) as error:
+        raise HTTPException(status_code=400,
+                            detail="Invalid cursor") from error
+
+
+def cursor_for(row, columns: list) -> str:
+    """Return cursor pointing after row."""
+    return encode_cursor([getattr(row, column.key) for column in columns])
+
+
+def order_by_key(query: Query, columns: list,
+                 descending: bool = False) -> Query:
+    """Sort query by key columns, so offsets and cursors are stable."""
+    if descending:
+        return query.order_by(*[column.desc() for column in columns])
+    return query.order_by(*columns)
+
+
+def filter_after_cursor(query: Query, columns: list, cursor: str,
+                        descending: bool = False) -> Query:
+    """Keep rows sorted after the ones a cursor was built from."""
+    values = decode_cursor(cursor, columns)
+    key = columns[0] if len(columns) == 1 else tuple_(*columns)
+    after = values[0] if len(columns) == 1 else tuple_(*values)
+    return query.filter(key < after if descending else key > after)
+
+
+def fetch_after_cursor(
+    query: Query, columns: list, cursor: Optional[str], limit: int,
+    descending: bool = False,
+) -> Tuple[List, Optional[str]]:
+    """Return rows after cursor, plus the cursor for the next page.
+
+    Uses the key columns instead of an offset, so deep pages cost the same
+    as the first one. Next cursor is None on the last page.
+    """
+    if cursor:
+        query = filter_after_cursor(query, columns, cursor, descending)
+    rows = order_by_key(query, columns, descending).limit(limit + 1).all()
+    items = rows[:limit]
+    if len(rows) > limit:
+        return items, cursor_for(items[-1], columns)
+    return items, None
+
+
+def count_strategy(include_total: bool, estimate_total: bool) -> str:
+    """Map list endpoint query parameters to a count strategy."""
+    if not include_total:
+        return NO_TOTAL
+    return ESTIMATED if estimate_total else EXACT
+
+
+def estimate_count(query: Query) -> int:
+    """Return an approximate number of rows for query.
+
+    Postgres answers from planner statistics, without scanning. Elsewhere
+    an exact count is cached for a while.
+    """
+    dialect = query.session.get_bind().dialect
+    sql = str(query.statement.compile(
+        dialect=dialect, compile_kwargs={"literal_binds": True}
+    ))
+    if dialect.name == "postgresql":
+        plan = query.session.execute(
+            text("EXPLAIN (FORMAT JSON) " + sql)
+        ).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+    total = COUNTS_CACHE.get(sql)
+    if total is None:
+        logging.debug("Refreshing cached count for %s", sql)
+        total = query.count()
+        COUNTS_CACHE.set(sql, total)
+    return total
+
+
+def count_rows(query: Query, count: str) -> Optional[int]:
+    """Return total rows in query using a count strategy."""
+    if count == NO_TOTAL:
+        return None
+    if count == ESTIMATED:
+        return estimate_count(query)
+    return query.count()
+
+
+def offset_page(items: list, total: Optional[int], limit: int, offset: int,
+                next_cursor: Optional[str]) -> dict:
+    """Return the page dict for items found at offset."""
+    return {
+        "items": items,
+        "total": total,
+        "page": 1 + math.ceil(offset / limit),
+        "size": len(items),
+        "pages": None if total is None else math.ceil(total / limit),
+        "next_cursor": next_cursor,
+    }
+
+
+# pylint: disable=too-many-arguments
+def fetch_page(
+    query: Query,
+    total: Optional[int],
+    key_columns: list,
+    limit: int,
+    offset: int,
+    cursor: Optional[str] = None,
+    descending: bool = False,
+) -> dict:
+    """Return the page dict of query, by offset or after a cursor."""
+    if cursor:
+        items, next_cursor = fetch_after_cursor(
+            query, key_columns, cursor, limit, descending
+        )
+        return {"items": items, "total": total, "size": len(items),
+                "next_cursor": next_cursor}
+    rows = order_by_key(query, key_columns, descending) \
+        .limit(limit + 1).offset(offset).all()
+    items = rows[:limit]
+    return offset_page(
+        items, total, limit, offset,
+        cursor_for(items[-1], key_columns) if len(rows) > limit else None,
+    )
+
+
+# pylint: disable=too-many-arguments
+def paginate(
+    query: Query,
+    key_columns: list,
+    limit: int,
+    offset: int,
+    cursor: Optional[str] = None,
+    count: str = EXACT,
+    descending: bool = False,
+) -> dict:
+    """Return one page of query as a dict, by offset or after a cursor.
+
+    Rows are sorted by key_columns, every page includes the cursor for the
+    next one, null on the last page.
+    """
+    return fetch_page(query, count_rows(query, count), key_columns, limit,
+                      offset, cursor, descending)
+
+
+# pylint: disable=too-many-arguments
+def paginate_union(
+    query: Query,
+    conditions: list,
+    key_columns: list,
+    limit: int,
+    offset: int,
+    cursor: Optional[str] = None,
+    count: str = EXACT,
+    descending: bool = False,
+) -> dict:
+    """Like paginate, for rows of query matching any of conditions.
+
+    Replaces an OR, which databases tend to answer with a full scan, when
+    each condition has an index: rows matching each one are sorted and cut
+    to the page on their own, then only those candidates are merged. The
+    last key column must be unique.
+    """
+    queries = [query.filter(condition) for condition in conditions]
+    total = count_rows(queries[0].union(*queries[1:]), count)
+    unique = key_columns[-1]
+    window = limit + 1 if cursor else offset + limit + 1
+    candidates = []
+    for branch in queries:
+        if cursor:
+            branch = filter_after_cursor(branch, key_columns, cursor,
+                                         descending)
+        candidates.append(select(
+            order_by_key(branch, key_columns, descending)
+            .with_entities(unique).limit(window).subquery()
+        ))
+    return fetch_page(query.filter(unique.in_(union(*candidates))), total,
+                      key_columns, limit, offset, cursor, descending)
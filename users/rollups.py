@@ -0,0 +1,238 @@
+"""Per wallet and per day transaction totals, kept up to date on transfers.
+
+add_transaction upserts the sender and receiver rows of its day, and the
+day row, in the same commit, so aggregates are read from rollup tables
+instead of scanning the ledger. Rollups of archived months stay. To
+compare them with totals rebuilt from the stored transactions, and
+replace wrong ones:
+
+    python -m users.rollups [--since YYYY-MM-DD] [--fix]
+"""
+import argparse
+import asyncio
+import logging
+import math
+from datetime import date, datetime, time
+from typing import Dict, List, Optional, Tuple, Union
+
+from environ import to_config
+from sqlalchemy import Date, Table, case, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+from users.config import AppConfig
+from users.database import build_engine, dispose
+from users.models import DailyTransactionRollups, TransactionRollups, \
+    Transactions
+
+STATS = ("count", "total", "max")
+WALLETS = TransactionRollups.__table__
+DAYS = DailyTransactionRollups.__table__
+# Rows inserted per statement when replacing rollups.
+BATCH_SIZE = 1000
+
+Totals = Dict[Tuple, dict]
+
+
+def stat_columns(table: Table) -> List[str]:
+    """Return names of the totals columns of a rollup table."""
+    return [column.key for column in table.columns
+            if not column.primary_key]
+
+
+def empty(table: Table) -> dict:
+    """Return totals of a rollup row without transactions."""
+    return {name: None if name.endswith("max") else 0
+            for name in stat_columns(table)}
+
+
+def upsert(session: Session, table: Table, key: dict, prefix: str,
+           amount: float):
+    """Add one transaction to the totals starting with prefix of a row."""
+    count, total, peak = (table.c[prefix + stat] for stat in STATS)
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" \
+        else sqlite
+    statement = dialect.insert(table).values(
+        **key, **{count.key: 1, total.key: amount, peak.key: amount},
+    )
+    session.execute(statement.on_conflict_do_update(
+        index_elements=list(key),
+        set_={count.key: count + 1, total.key: total + amount,
+              peak.key: case((or_(peak.is_(None), peak < amount), amount),
+                             else_=peak)},
+    ))
+
+
+def record_transaction(session: Session, transaction: Transactions):
+    """Add a new transaction to its rollups, committed along with it."""
+    day = transaction.date.date()
+    amount = transaction.amount
+    upsert(session, WALLETS, {"wallet": transaction.sender, "day": day},
+           "sent_", amount)
+    upsert(session, WALLETS, {"wallet": transaction.receiver, "day": day},
+           "received_", amount)
+    upsert(session, DAYS, {"day": day}, "", amount)
+
+
+def get_aggregates(session: Session, address: Optional[str],
+                   since: Optional[date], until: Optional[date]) -> dict:
+    """Return daily totals, from since (included) to until (excluded).
+
+    With an address, its sent and received totals. Otherwise, those of
+    every transaction.
+    """
+    table = WALLETS if address else DAYS
+    stats = stat_columns(table)
+    query = select(table.c.day, *[table.c[stat] for stat in stats])
+    if address:
+        query = query.where(table.c.wallet == address)
+    if since:
+        query = query.where(table.c.day >= since)
+    if until:
+        query = query.where(table.c.day < until)
+    items = [row._asdict()
+             for row in session.execute(query.order_by(table.c.day))]
+    totals = {
+        stat: max((item[stat] for item in items
+                   if item[stat] is not None), default=None)
+        if stat.endswith("max") else sum(item[stat] for item in items)
+        for stat in stats
+    }
+    return {"items": items, "totals": totals}
+
+
+def rebuild(connection: Union[Connection, Session],
+            since: Optional[date] = None) -> Dict[Table, Totals]:
+    """Return rollups of each table computed from stored transactions."""
+    day = func.date(Transactions.date, type_=Date)
+    totals = {WALLETS: {}, DAYS: {}}
+    for table, prefix, keys in (
+        (WALLETS, "sent_", [Transactions.sender, day]),
+        (WALLETS, "received_", [Transactions.receiver, day]),
+        (DAYS, "", [day]),
+    ):
+        query = select(*keys, func.count(), func.sum(Transactions.amount),
+                       func.max(Transactions.amount)).group_by(*keys)
+        if since:
+            query = query.where(
+                Transactions.date >= datetime.combine(since, time())
+            )
+        for row in connection.execute(query):
+            totals[table].setdefault(tuple(row[:len(keys)]),
+                                     empty(table)).update(
+                zip([prefix + stat for stat in STATS], row[len(keys):])
+            )
+    return totals
+
+
+def stored(connection: Union[Connection, Session], table: Table,
+           since: Optional[date] = None) -> Totals:
+    """Return rollups in a table since since, by primary key."""
+    query = select(table)
+    if since:
+        query = query.where(table.c.day >= since)
+    keys, stats = table.primary_key.columns.keys(), stat_columns(table)
+    totals = {}
+    for row in connection.execute(query):
+        values = row._asdict()
+        totals[tuple(values[key] for key in keys)] = {
+            stat: values[stat] for stat in stats
+        }
+    return totals
+
+
+def same(expected: Optional[float], actual: Optional[float]) -> bool:
+    """Compare totals, allowing for float rounding in sums."""
+    if expected is None or actual is None:
+        return expected == actual
+    return math.isclose(expected, actual, rel_tol=1e-9, abs_tol=1e-6)
+
+
+def diff(table: Table, expected: Totals, actual: Totals) -> List[tuple]:
+    """Return (table, key, expected, actual) of rollups that differ."""
+    missing = empty(table)
+    return [
+        (table.name, key, expected.get(key), actual.get(key))
+        for key in sorted(expected.keys() | actual.keys())
+        if not all(same(expected.get(key, missing)[stat],
+                        actual.get(key, missing)[stat])
+                   for stat in stat_columns(table))
+    ]
+
+
+def replace(connection: Connection, table: Table, totals: Totals,
+            since: Optional[date] = None):
+    """Swap rollups of a table since since for totals, in bulk."""
+    delete = table.delete()
+    if since:
+        delete = delete.where(table.c.day >= since)
+    connection.execute(delete)
+    keys = table.primary_key.columns.keys()
+    rows = [dict(zip(keys, key), **values) for key, values in totals.items()]
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(insert(table), rows[start:start + BATCH_SIZE])
+
+
+def check_sync(connection: Connection, since: Optional[date] = None,
+               fix: bool = False) -> List[tuple]:
+    """Diff rollups with rebuilt ones, replacing them if fix.
+
+    Without since, starts at the oldest stored transaction, so rollups of
+    archived months are kept.
+    """
+    if since is None:
+        oldest = connection.execute(
+            select(func.min(Transactions.date))
+        ).scalar()
+        if oldest is None:
+            return []
+        since = oldest.date()
+    differences = []
+    for table, expected in rebuild(connection, since).items():
+        found = diff(table, expected, stored(connection, table, since))
+        if fix and found:
+            replace(connection, table, expected, since)
+        differences.extend(found)
+    return differences
+
+
+async def check(engine: Union[Engine, AsyncEngine],
+                since: Optional[date] = None,
+                fix: bool = False) -> List[tuple]:
+    """Run check_sync in a transaction."""
+    if isinstance(engine, AsyncEngine):
+        async with engine.begin() as connection:
+            return await connection.run_sync(check_sync, since, fix)
+    with engine.begin() as connection:
+        return check_sync(connection, since, fix)
+
+
+def build_rollups(connection: Connection):
+    """Fill rollup tables from stored transactions, if they are empty."""
+    if connection.execute(select(DAYS.c.day)).first() is None:
+        for table, totals in rebuild(connection).items():
+            replace(connection, table, totals)
+
+
+async def main():
+    """Check rollups of the configured database."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", type=date.fromisoformat)
+    parser.add_argument("--fix", action="store_true",
+                        help="replace rollups that differ")
+    args = parser.parse_args()
+    engine = build_engine(to_config(AppConfig))
+    differences = await check(engine, args.since, args.fix)
+    for table, key, expected, actual in differences:
+        logging.warning("%s %s: expected %s, stored %s.",
+                        table, key, expected, actual)
+    logging.info("%d rollups differ%s.", len(differences),
+                 ", replaced" if args.fix and differences else "")
+    await dispose(engine)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -57,3 +57,9 @@ class Location(BaseModel):
 
     location: str
     coordinates: Tuple[float, float]
+
+
+class NearestLocation(Location):
+    """Location closest to some coordinates, distance in meters."""
+
+    distance_m: float
@@ -0,0 +1,100 @@
+"""Run the remote steps of a signup concurrently, undoing them on failure.
+
+Steps that don't depend on each other go through concurrently, so signup
+takes about as long as its slowest call instead of their sum. Every step
+is timed, and steps that succeeded are compensated in reverse order when
+a later one fails.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from newrelic.agent import record_custom_metric as record_metric
+
+from users.telemetry import REGISTRY, Counter, Histogram
+
+STEP_LATENCY = REGISTRY.register(Histogram(
+    "signup_step_duration_seconds", "Time taken by each step of a signup.",
+    ("step",),
+))
+COMPENSATIONS = REGISTRY.register(Counter(
+    "signup_compensations_total", "Signup steps undone after a failure.",
+    ("step", "outcome"),
+))
+
+# Undoes a step, given what it returned.
+Compensation = Callable[[Any], Awaitable]
+
+
+class Signup:
+    """Steps of one signup, compensated if the block raises.
+
+    async with Signup() as signup:
+        results = await signup.concurrently({
+            "wallet": (create_wallet(), delete_wallet), ...
+        })
+        user = await signup.step("database", ..., undo)
+    """
+
+    def __init__(self):
+        self.undo: List[Tuple[str, Compensation, Any]] = []
+        self.timings: Dict[str, float] = {}
+
+    async def step(self, name: str, awaitable: Awaitable,
+                   undo: Optional[Compensation] = None):
+        """Await one step, timing it and keeping its compensation."""
+        start = time.perf_counter()
+        try:
+            result = await awaitable
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = elapsed
+            STEP_LATENCY.labels(name).observe(elapsed)
+            record_metric(f"Custom/signup/{name}", elapsed)
+        if undo is not None:
+            self.undo.append((name, undo, result))
+        return result
+
+    async def concurrently(
+        self, steps: Dict[str, Tuple[Awaitable, Optional[Compensation]]]
+    ) -> Dict[str, Any]:
+        """Run independent steps together, returning results by name.
+
+        If one fails the others are cancelled, and the first error is
+        raised once steps that finished are ready to be undone.
+        """
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = {name: group.create_task(self.step(name, *step))
+                         for name, step in steps.items()}
+        except BaseExceptionGroup as errors:
+            raise errors.exceptions[0] from None
+        return {name: task.result() for name, task in tasks.items()}
+
+    async def compensate(self):
+        """Undo steps that succeeded, newest first.
+
+        Failed compensations are logged, so the rest still run.
+        """
+        while self.undo:
+            name, undo, result = self.undo.pop()
+            try:
+                await undo(result)
+                COMPENSATIONS.labels(name, "done").inc()
+            except Exception:  # pylint: disable=broad-except
+                COMPENSATIONS.labels(name, "failed").inc()
+                logging.exception("Could not undo signup step %s.", name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, error_type, error, traceback):
+        if error is not None:
+            logging.warning("Signup failed, undoing %s.",
+                            [name for name, _, _ in self.undo])
+            await self.compensate()
+        logging.info("Signup steps took %s.", {
+            name: round(seconds, 3) for name, seconds in self.timings.items()
+        })
+        return False
@@ -0,0 +1,46 @@
+"""Helpers for background asyncio tasks."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+
+async def cancel(task: Optional[asyncio.Task]):
+    """Cancel task and wait until it finishes."""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def wait(event: asyncio.Event, timeout: float):
+    """Wait until event is set, for timeout seconds at most."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+# pylint: disable=broad-exception-caught
+async def repeat(work: Callable[[], Awaitable], wanted: asyncio.Event,
+                 interval: float, max_backoff: float, doing: str):
+    """Run work when wanted is set, or every interval seconds.
+
+    After a failure, waits twice as long as after the previous one, up to
+    max_backoff, whatever wanted. doing names the work in error logs.
+    """
+    delay = interval
+    while True:
+        wanted.clear()
+        try:
+            await work()
+        except Exception:
+            delay = min(delay * 2, max_backoff)
+            logging.exception("Error when %s, retrying in %.0fs.", doing,
+                              delay)
+            await asyncio.sleep(delay)
+            continue
+        delay = interval
+        await wait(wanted, delay)
@@ -0,0 +1,365 @@
+"""In-process metrics registry, exposed in Prometheus text format.
+
+Updates are plain attribute increments, a lock is only taken the first
+time a label combination shows up. Under the GIL, increments racing from
+worker threads may rarely be lost, which is fine for monitoring.
+"""
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from sqlalchemy import event as sqlalchemy_event
+from sqlalchemy.engine import Engine
+from starlette.exceptions import HTTPException
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value) -> str:
+    """Escape a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+        .replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    """Return {name="value",...}, or nothing without labels."""
+    if not names:
+        return ""
+    return "{" + ",".join(
+        f'{name}="{escape(value)}"' for name, value in zip(names, values)
+    ) + "}"
+
+
+class CounterChild:
+    """Counter for one label combination."""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        """Increase by amount."""
+        self.value += amount
+
+
+class GaugeChild(CounterChild):
+    """Gauge for one label combination."""
+
+    def dec(self, amount: float = 1.0):
+        """Decrease by amount."""
+        self.value -= amount
+
+    def set(self, value: float):
+        """Replace current value."""
+        self.value = value
+
+
+class HistogramChild:
+    """Bucketed observations for one label combination."""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Last slot holds observations above every bucket (+Inf).
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record one observation."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    """Metric family with a child per label combination."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str,
+                 label_names: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.children: Dict[Tuple, object] = {}
+        self.lock = threading.Lock()
+
+    def new_child(self):
+        """Create the child for a new label combination."""
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Return the child for label values, in label_names order."""
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def samples(self) -> List[str]:
+        """Return exposition lines for every child."""
+        return [
+            f"{self.name}{format_labels(self.label_names, values)} "
+            f"{child.value}"
+            for values, child in list(self.children.items())
+        ]
+
+    def render(self) -> str:
+        """Return HELP, TYPE and samples in text format."""
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(Metric):
+    """Monotonic counter."""
+
+    kind = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+
+class Gauge(Metric):
+    """Value going up and down."""
+
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 label_names: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                labels = format_labels(self.label_names + ("le",),
+                                       values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together.
+
+    Collectors are called before rendering, to refresh gauges from values
+    kept elsewhere.
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        """Add metric, returning it."""
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Call collector before every render."""
+        self.collectors.append(collector)
+
+    # pylint: disable=broad-exception-caught
+    def render(self) -> str:
+        """Return every metric in Prometheus text format."""
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception:
+                logging.exception("Error when collecting metrics.")
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Requests handled.",
+    ("method", "route", "status"),
+))
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time to handle a request.",
+    ("method", "route"),
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Requests being handled.",
+    ("method", "route"),
+))
+DEPENDENCY_LATENCY = REGISTRY.register(Histogram(
+    "dependency_request_duration_seconds",
+    "Time waiting on auth, payments, postgres, mongodb and redis.",
+    ("dependency", "operation"),
+))
+DEPENDENCY_ERRORS = REGISTRY.register(Counter(
+    "dependency_errors_total", "Failed calls to dependencies.",
+    ("dependency", "operation"),
+))
+
+
+def observe_dependency(dependency: str, operation: str, seconds: float,
+                       failed: bool = False):
+    """Record a call to a dependency."""
+    DEPENDENCY_LATENCY.labels(dependency, operation).observe(seconds)
+    if failed:
+        DEPENDENCY_ERRORS.labels(dependency, operation).inc()
+
+
+class InstrumentedRoute(APIRoute):
+    """Route counting and timing its requests, labeled by path template."""
+
+    async def handle(self, scope, receive, send):
+        method = scope["method"]
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(method, self.path)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await super().handle(scope, receive, send_with_status)
+        except HTTPException as error:
+            # Turned into a response by the exception handlers later on.
+            status[0] = error.status_code
+            raise
+        except RequestValidationError:
+            status[0] = 422
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            REQUEST_LATENCY.labels(method, self.path).observe(elapsed)
+            REQUESTS.labels(method, self.path, status[0]).inc()
+
+
+def build_httpx_hooks(dependency: str) -> dict:
+    """Return httpx event hooks timing requests to a dependency."""
+    async def on_request(request):
+        request.extensions["start"] = time.perf_counter()
+
+    async def on_response(response):
+        start = response.request.extensions.get("start")
+        if start is not None:
+            observe_dependency(
+                dependency, response.request.method,
+                time.perf_counter() - start, response.status_code >= 500,
+            )
+
+    return {"request": [on_request], "response": [on_response]}
+
+
+# pylint: disable=unused-argument, too-many-arguments
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Remember when a statement started."""
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+# pylint: disable=unused-argument, too-many-arguments
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    """Record how long a statement took."""
+    start = conn.info["query_start"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper()
+    observe_dependency("postgres", operation, time.perf_counter() - start)
+
+
+class MongoListener(monitoring.CommandListener):
+    """Record duration of MongoDB commands."""
+
+    def started(self, event):
+        """Nothing to do, durations come with the result."""
+
+    def succeeded(self, event):
+        """Record a finished command."""
+        observe_dependency("mongodb", event.command_name,
+                           event.duration_micros / 1e6)
+
+    def failed(self, event):
+        """Record a failed command."""
+        observe_dependency("mongodb", event.command_name,
+                           event.duration_micros / 1e6, failed=True)
+
+
+INSTRUMENTED = []
+
+
+def instrument_dependencies():
+    """Time every SQLAlchemy statement and MongoDB command.
+
+    MongoDB clients created afterwards are instrumented.
+    """
+    if INSTRUMENTED:
+        return
+    sqlalchemy_event.listen(Engine, "before_cursor_execute",
+                            before_cursor_execute)
+    sqlalchemy_event.listen(Engine, "after_cursor_execute",
+                            after_cursor_execute)
+    monitoring.register(MongoListener())
+    INSTRUMENTED.append(True)
+
+
+async def handle_scrape(reader: asyncio.StreamReader,
+                        writer: asyncio.StreamWriter):
+    """Answer one HTTP request with every metric."""
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        if request.startswith(b"GET /metrics"):
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int) -> Optional[asyncio.AbstractServer]:
+    """Serve GET /metrics on port, on every interface."""
+    logging.info("Serving metrics on port %d...", port)
+    try:
+        return await asyncio.start_server(handle_scrape, port=port)
+    except OSError:
+        logging.exception("Could not serve metrics on port %d.", port)
+        return None
+
+
+async def stop_metrics_server(server: Optional[asyncio.AbstractServer]):
+    """Stop serving metrics."""
+    if server is None:
+        return
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,104 @@
+"""Local verification of tokens signed by the auth service."""
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+import httpx
+import jwt
+from fastapi import HTTPException
+
+from users.tasks import cancel
+
+REMOTE = "remote"
+LOCAL = "local"
+
+
+def get_bearer_token(auth_header) -> str:
+    """Return the token in an Authorization header, without its scheme."""
+    value = auth_header["Authorization"]
+    scheme, _, token = value.partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return token
+    return value
+
+
+class TokenVerifier:
+    """Check token signatures with the public keys of the auth service.
+
+    Keys are fetched as a JWKS document and refreshed in the background.
+    Tokens signed with an unknown key are left for the auth service.
+    """
+
+    def __init__(self, url: str, refresh_interval: float):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def load(self, jwks: dict):
+        """Replace known keys with those in a JWKS document."""
+        keys = {}
+        for key in jwks.get("keys", []):
+            try:
+                jwk = jwt.PyJWK(key)
+            except jwt.PyJWTError:
+                logging.warning("Ignoring unsupported key %s", key.get("kid"))
+                continue
+            keys[jwk.key_id] = jwk
+        logging.info("Loaded %d token signing keys.", len(keys))
+        self.keys = keys
+
+    async def refresh(self, client: httpx.AsyncClient):
+        """Fetch signing keys from the auth service."""
+        logging.debug("Fetching token signing keys from %s", self.url)
+        res = await client.get(self.url)
+        res.raise_for_status()
+        self.load(res.json())
+
+    # pylint: disable=broad-exception-caught
+    async def refresh_forever(self, client_factory: Callable):
+        """Refresh signing keys every refresh_interval seconds."""
+        while True:
+            try:
+                await self.refresh(client_factory())
+            except Exception:
+                logging.exception("Error when fetching token signing keys.")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, client_factory: Callable):
+        """Fetch keys now and keep them fresh in a background task."""
+        self.task = asyncio.create_task(self.refresh_forever(client_factory))
+
+    async def stop(self):
+        """Cancel the refresh task."""
+        await cancel(self.task)
+        self.task = None
+
+    def verify(self, token: str) -> Optional[dict]:
+        """Return role and id claims, or None if the signing key is unknown.
+
+        Raises HTTPException for tokens that are malformed, expired or
+        carry a wrong signature.
+        """
+        try:
+            key_id = jwt.get_unverified_header(token).get("kid")
+        except jwt.PyJWTError as error:
+            raise HTTPException(status_code=401,
+                                detail="Invalid token") from error
+        key = self.keys.get(key_id)
+        if key is None:
+            logging.debug("Unknown signing key %s", key_id)
+            return None
+        try:
+            claims = jwt.decode(
+                token, key.key, algorithms=[key.algorithm_name]
+            )
+        except jwt.PyJWTError as error:
+            logging.warning("Invalid token: %s", error)
+            raise HTTPException(status_code=401,
+                                detail="Invalid token") from error
+        try:
+            return {"role": claims["role"], "id": claims["id"]}
+        except KeyError as error:
+            raise HTTPException(status_code=403,
+                                detail="Token format error") from error
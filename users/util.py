@@ -1,17 +1,48 @@
 """Provides functions for interacting with other microservices."""
 import logging
+from hashlib import sha256
+
 import httpx
 from environ import to_config
 from fastapi import HTTPException, Request
-from sqlalchemy.orm import Session
 from starlette.responses import JSONResponse
 
 from users.admin.dao import get_admin_by_email
+from users.cache import TTLCache
+from users.clients import AUTH, PAYMENTS, get_client
 from users.config import AppConfig
 from users.crud import get_user_by_email
+from users.database import AnySession, run
 from users.models import UsersWallets
+from users.tokens import LOCAL, TokenVerifier, get_bearer_token
+from users.wallet_pool import WalletPool
 
 CONFIGURATION = to_config(AppConfig)
+CREDENTIALS_CACHE = TTLCache(
+    CONFIGURATION.auth.credentials_cache_size,
+    CONFIGURATION.auth.credentials_cache_ttl,
+)
+# Auth service answers for tokens that will not become valid by retrying.
+NEGATIVE_CACHE_STATUSES = {401, 403}
+TOKEN_VERIFIER = TokenVerifier(
+    f"http://{CONFIGURATION.auth.host}{CONFIGURATION.auth.jwks_path}",
+    CONFIGURATION.auth.jwks_refresh,
+)
+WALLET_POOL = WalletPool(
+    CONFIGURATION.wallet_pool.size,
+    CONFIGURATION.wallet_pool.refill_interval,
+    CONFIGURATION.wallet_pool.max_backoff,
+)
+
+
+def auth_client() -> httpx.AsyncClient:
+    """Return shared client for the auth service."""
+    return get_client(AUTH, CONFIGURATION)
+
+
+def payments_client() -> httpx.AsyncClient:
+    """Return shared client for the payments service."""
+    return get_client(PAYMENTS, CONFIGURATION)
 
 
 def get_auth_header(request):
@@ -22,31 +53,69 @@ def get_auth_header(request):
     return {"Authorization": auth_header}
 
 
-async def get_credentials(request):
-    """Get user details from token in request header."""
-    logging.info("Getting user credentials...")
+async def fetch_credentials(auth_header):
+    """Get user details for an auth header from the auth service."""
     url = f"http://{CONFIGURATION.auth.host}/auth/credentials"
     logging.info("Getting user credentials in auth service: %s", url)
+    logging.info("Using auth header: %s...", auth_header)
+    creds = await auth_client().get(url, headers=auth_header)
+    if creds.status_code != 200:
+        error = creds.json()["Message"]
+        logging.error("Error when trying to authenticate: %s", error)
+        raise HTTPException(status_code=creds.status_code, detail=error)
+    try:
+        return {
+            "role": creds.json()['data']["role"],
+            "id": creds.json()['data']["id"]
+        }
+    except Exception as json_exception:
+        msg = "Token format error"
+        logging.exception("Error when trying to authenticate")
+        raise HTTPException(status_code=403,
+                            detail=msg) from json_exception
+
+
+async def resolve_credentials(auth_header):
+    """Get user details, verifying the token locally when configured."""
+    if CONFIGURATION.auth.verification == LOCAL:
+        credentials = TOKEN_VERIFIER.verify(get_bearer_token(auth_header))
+        if credentials is not None:
+            return credentials
+    return await fetch_credentials(auth_header)
+
+
+def credentials_cache_key(auth_header) -> str:
+    """Hash the auth header, so tokens are not kept in memory."""
+    return sha256(auth_header["Authorization"].encode()).hexdigest()
+
+
+async def get_credentials(request):
+    """Get user details from token in request header.
+
+    Results are cached by token, invalid tokens only for a short while.
+    """
+    logging.info("Getting user credentials...")
     auth_header = get_auth_header(request)
-    if auth_header is not None:
-        logging.info("Using auth header: %s...", auth_header)
-        creds = await httpx.AsyncClient().get(url, headers=auth_header)
-        if creds.status_code != 200:
-            error = creds.json()["Message"]
-            logging.error("Error when trying to authenticate: %s", error)
-            raise HTTPException(status_code=creds.status_code, detail=error)
-        try:
-            return {
-                "role": creds.json()['data']["role"],
-                "id": creds.json()['data']["id"]
-            }
-        except Exception as json_exception:
-            msg = "Token format error"
-            logging.exception("Error when trying to authenticate")
-            raise HTTPException(status_code=403,
-                                detail=msg) from json_exception
-    else:
+    if auth_header is None:
         raise HTTPException(status_code=403, detail="No token")
+    key = credentials_cache_key(auth_header)
+    cached = CREDENTIALS_CACHE.get(key)
+    if isinstance(cached, tuple):
+        raise HTTPException(status_code=cached[0], detail=cached[1])
+    if cached is not None:
+        return cached
+    try:
+        credentials = await resolve_credentials(auth_header)
+    except HTTPException as error:
+        if error.status_code in NEGATIVE_CACHE_STATUSES:
+            CREDENTIALS_CACHE.set(
+                key,
+                (error.status_code, error.detail),
+                CONFIGURATION.auth.credentials_negative_ttl,
+            )
+        raise
+    CREDENTIALS_CACHE.set(key, credentials)
+    return credentials
 
 
 async def get_token(role, user_id):
@@ -54,7 +123,7 @@ async def get_token(role, user_id):
     logging.info("Getting token for %d with role %s", user_id, role)
     url = f"http://{CONFIGURATION.auth.host}/auth/token?role=" + \
           role + "&id=" + str(user_id)
-    token = await httpx.AsyncClient().get(url)
+    token = await auth_client().get(url)
     return token.json()["data"]
 
 
@@ -67,15 +136,26 @@ async def add_user_firebase(email, password):
     }
     url = f"http://{CONFIGURATION.auth.host}/auth"
     logging.info("Creating user in auth service: %s", url)
-    res = await httpx.AsyncClient().post(url, json=body)
+    res = await auth_client().post(url, json=body)
     if res.status_code != 200:
         error = res.json()
         logging.error("Error when trying to authenticate: %s", error)
         raise HTTPException(status_code=res.status_code, detail=error)
 
 
+async def delete_user_firebase(email):
+    """Remove a user added by add_user_firebase, undoing a failed signup."""
+    logging.info("Deleting user %s in firebase", email)
+    url = f"http://{CONFIGURATION.auth.host}/auth"
+    res = await auth_client().delete(url, params={"email": email})
+    if res.status_code != 200:
+        error = res.json()
+        logging.error("Error when trying to delete user: %s", error)
+        raise HTTPException(status_code=res.status_code, detail=error)
+
+
 async def token_login_firebase(request: Request, role: str,
-                               session: Session):
+                               session: AnySession):
     """Log in with token in request header."""
     req = await request.json()
     url = f"http://{CONFIGURATION.auth.host}/auth/tokenLogin"
@@ -83,8 +163,7 @@ async def token_login_firebase(request: Request, role: str,
     auth_header = get_auth_header(request)
     if auth_header is not None:
         logging.info("Using auth header: %s...", auth_header)
-        res = await httpx.AsyncClient().post(url, json=req,
-                                             headers=auth_header)
+        res = await auth_client().post(url, json=req, headers=auth_header)
         if res.status_code != 200:
             error = res.json()["Message"]
             logging.error("Error when trying to login with token: %s", error)
@@ -93,21 +172,20 @@ async def token_login_firebase(request: Request, role: str,
     return await regular_login_firebase(req, role, session)
 
 
-async def regular_login_firebase(body, role, session: Session):
+async def regular_login_firebase(body, role, session: AnySession):
     """Log in with provided body and return token with proper role."""
     url = f"http://{CONFIGURATION.auth.host}/auth/login"
     logging.info("Logging 'regular' user in auth service: %s", url)
 
-    with session as open_session:
-        email = body["email"]
-        user = get_user_by_email(open_session, email=email)
-        if role == "admin":
-            user = get_admin_by_email(open_session, email=email)
-        if user is None:
-            msg = "No such user"
-            logging.exception("Couldn't log in non-existing user.")
-            raise HTTPException(status_code=404, detail=msg)
-    res = await httpx.AsyncClient().post(url, json=body)
+    email = body["email"]
+    user = await run(session, get_user_by_email, email=email)
+    if role == "admin":
+        user = await run(session, get_admin_by_email, email=email)
+    if user is None:
+        msg = "No such user"
+        logging.exception("Couldn't log in non-existing user.")
+        raise HTTPException(status_code=404, detail=msg)
+    res = await auth_client().post(url, json=body)
     if res.status_code != 200:
         error = res.json()["Message"]
         logging.error("Error when trying to login user: %s", error)
@@ -119,7 +197,7 @@ async def create_wallet():
     """Create wallet through payment services."""
     logging.info("Creating wallet for new user")
     url = f"http://{CONFIGURATION.payments.host}/payment/wallet"
-    res = await httpx.AsyncClient().post(url)
+    res = await payments_client().post(url)
     if res.status_code != 200:
         error = res.json()
         logging.error("Error when trying to create wallet: %s", error)
@@ -127,13 +205,25 @@ async def create_wallet():
     return res.json()
 
 
+async def delete_wallet(wallet):
+    """Remove a wallet made by create_wallet, undoing a failed signup."""
+    logging.info("Deleting wallet %s", wallet["address"])
+    url = f"http://{CONFIGURATION.payments.host}/payment/wallet/" + \
+          wallet["address"]
+    res = await payments_client().delete(url)
+    if res.status_code != 200:
+        error = res.json()
+        logging.error("Error when trying to delete wallet: %s", error)
+        raise HTTPException(status_code=res.status_code, detail=error)
+
+
 async def upload_image(image: str, username: str):
     """Upload image to auth service."""
     url = f"http://{CONFIGURATION.auth.host}/auth/storage/" + username
     body = {
         "image": image
     }
-    res = await httpx.AsyncClient().post(url, json=body)
+    res = await auth_client().post(url, json=body)
     if res.status_code != 200:
         raise HTTPException(status_code=res.status_code,
                             detail=res.json()["Message"])
@@ -142,7 +232,7 @@ async def upload_image(image: str, username: str):
 async def download_image(username: str):
     """Download image from auth service."""
     url = f"http://{CONFIGURATION.auth.host}/auth/storage/" + username
-    res = await httpx.AsyncClient().get(url)
+    res = await auth_client().get(url)
     if res.status_code != 200:
         return None
     return res.json()
@@ -152,7 +242,7 @@ async def get_balance(wallet: UsersWallets):
     """Get balance from wallet service."""
     url = f"http://{CONFIGURATION.payments.host}/payment/wallet/" + \
           wallet.address + "/balance"
-    res = await httpx.AsyncClient().get(url)
+    res = await payments_client().get(url)
     if res.status_code != 200:
         raise HTTPException(status_code=res.status_code,
                             detail="Issue retrieving wallet balance")
@@ -169,7 +259,7 @@ async def transfer_money_outside(send_wallet, receiver_address, amount):
         "amountInEthers": str(amount)
     }
     url = f"http://{CONFIGURATION.payments.host}/payment/extraction"
-    res = await httpx.AsyncClient().post(url, json=body)
+    res = await payments_client().post(url, json=body)
     if res.status_code != 200:
         error = res.json()
         logging.error("Error when trying to extract money: %s", error)
@@ -187,7 +277,7 @@ async def deposit_money(send_wallet, recv_wallet, amount):
         "amountInEthers": str(amount)
     }
     url = f"http://{CONFIGURATION.payments.host}/payment/deposit"
-    res = await httpx.AsyncClient().post(url, json=body)
+    res = await payments_client().post(url, json=body)
     if res.status_code != 200:
         error = res.json()
         logging.error("Error when trying to make deposit: %s", error)
@@ -203,7 +293,7 @@ async def add_to_balance(receiver_wallet, amount):
     }
     url = f"http://{CONFIGURATION.payments.host}/payment/wallet/+" \
           + receiver_wallet.address + "/balance"
-    res = await httpx.AsyncClient().patch(url, json=body)
+    res = await payments_client().patch(url, json=body)
     if res.status_code != 200:
         error = res.json()
         logging.error("Error transferring money from contract: %s", error)
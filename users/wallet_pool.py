@@ -0,0 +1,143 @@
+"""Wallets created ahead of signups, so they don't wait on payments.
+
+A background task keeps size wallets in walletPool, created through the
+payments service one at a time and retried with exponential backoff.
+Signups take one with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+signups never get the same wallet, and only call the payments service
+when the pool is empty. Each replica refills the shared table, which can
+overshoot size by the wallets created while others refilled.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from newrelic.agent import record_custom_metric as record_metric
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from users.database import AnySession, close, run
+from users.models import PooledWallets
+from users.tasks import cancel, repeat
+from users.telemetry import REGISTRY, Counter, Gauge, Histogram
+
+POOL_DEPTH = REGISTRY.register(Gauge(
+    "wallet_pool_depth", "Wallets waiting in the pool, last seen.",
+))
+REFILL_LATENCY = REGISTRY.register(Histogram(
+    "wallet_pool_refill_duration_seconds",
+    "Time to create and store one pooled wallet.",
+))
+WALLETS_HANDED = REGISTRY.register(Counter(
+    "wallet_pool_signups_total", "Wallets given to signups, by source.",
+    ("source",),
+))
+
+
+def take_wallet(session: Session) -> Optional[dict]:
+    """Remove the oldest pooled wallet and return it, None if empty.
+
+    Rows locked by other signups are skipped instead of waited for.
+    """
+    pooled = session.execute(
+        select(PooledWallets).order_by(PooledWallets.created_at).limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar_one_or_none()
+    if pooled is None:
+        session.rollback()
+        return None
+    wallet = {"address": pooled.address, "privateKey": pooled.private_key}
+    session.delete(pooled)
+    session.commit()
+    return wallet
+
+
+def add_wallet(session: Session, wallet: dict):
+    """Store a wallet in the pool."""
+    session.add(PooledWallets(address=wallet["address"],
+                              private_key=wallet["privateKey"],
+                              created_at=datetime.now()))
+    session.commit()
+
+
+def count_wallets(session: Session) -> int:
+    """Return how many wallets are in the pool."""
+    return session.execute(
+        select(func.count()).select_from(PooledWallets)
+    ).scalar()
+
+
+class WalletPool:
+    """Keeps size wallets ready, refilling them in a background task."""
+
+    def __init__(self, size: int, refill_interval: float,
+                 max_backoff: float):
+        self.size = size
+        self.refill_interval = refill_interval
+        self.max_backoff = max_backoff
+        self.depth = 0
+        self.wanted = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def report(self):
+        """Publish the last known depth."""
+        POOL_DEPTH.labels().set(self.depth)
+        record_metric("Custom/wallet-pool/depth", self.depth)
+
+    async def take(self, session: AnySession) -> Optional[dict]:
+        """Return a pooled wallet, or None to create one on the spot."""
+        wallet = None
+        if self.size > 0:
+            wallet = await run(session, take_wallet)
+        WALLETS_HANDED.labels("pool" if wallet else "payments").inc()
+        if wallet is not None:
+            self.depth = max(self.depth - 1, 0)
+            self.report()
+            self.wanted.set()
+        else:
+            logging.info("Wallet pool empty, creating wallet on signup.")
+        return wallet
+
+    async def put_back(self, session: AnySession, wallet: Optional[dict]):
+        """Return a wallet whose signup failed to the pool."""
+        if wallet is not None:
+            await run(session, add_wallet, wallet)
+            self.depth += 1
+
+    async def refill(self, session_factory: Callable, create: Callable):
+        """Create wallets until the pool holds size of them."""
+        session = session_factory()
+        try:
+            self.depth = await run(session, count_wallets)
+            while self.depth < self.size:
+                start = time.perf_counter()
+                await run(session, add_wallet, await create())
+                elapsed = time.perf_counter() - start
+                REFILL_LATENCY.labels().observe(elapsed)
+                record_metric("Custom/wallet-pool/refill", elapsed)
+                self.depth += 1
+        finally:
+            self.report()
+            await close(session)
+
+    async def refill_forever(self, session_factory: Callable,
+                             create: Callable):
+        """Refill after each take, or every refill_interval seconds.
+
+        Failures are retried with backoff, see users.tasks.repeat.
+        """
+        await repeat(lambda: self.refill(session_factory, create),
+                     self.wanted, self.refill_interval, self.max_backoff,
+                     "refilling wallet pool")
+
+    def start(self, session_factory: Callable, create: Callable):
+        """Fill the pool now and keep it full in a background task."""
+        self.task = asyncio.create_task(
+            self.refill_forever(session_factory, create)
+        )
+
+    async def stop(self):
+        """Cancel the refill task."""
+        await cancel(self.task)
+        self.task = None